@@ -0,0 +1,94 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from ultralytics.yolo.data.augment import BatchAugment
+from ultralytics.yolo.data.dataset import YOLODataset
+from ultralytics.yolo.utils.ops import xywh2xyxy
+
+S = 64  # image and train size
+RECTS = [(20, 20, 44, 44), (8, 28, 32, 52)]  # xyxy of the white square of every image
+
+
+def identity_hyp(**kwargs):
+    hyp = dict(mosaic=0.0, mixup=0.0, degrees=0.0, translate=0.0, scale=0.0, shear=0.0, perspective=0.0, hsv_h=0.0,
+               hsv_s=0.0, hsv_v=0.0, flipud=0.0, fliplr=0.0, mask_ratio=1, overlap_mask=False, copy_paste=0.0)
+    hyp.update(kwargs)
+    return SimpleNamespace(**hyp)
+
+
+def rect_segment(x1, y1, x2, y2, n=100):
+    # Closed polygon along the edges of a rectangle, n points per edge like the resampled dataset segments
+    t = torch.arange(n) / n
+    xs = torch.cat((x1 + (x2 - x1) * t, torch.full((n,), x2), x2 - (x2 - x1) * t, torch.full((n,), x1)))
+    ys = torch.cat((torch.full((n,), y1), y1 + (y2 - y1) * t, torch.full((n,), y2), y2 - (y2 - y1) * t))
+    return torch.stack((xs, ys), 1)
+
+
+def collated_batch():
+    # A collated batch of gray images with one labelled white square each, labels normalized to the content
+    img = torch.full((len(RECTS), 3, S, S), 114 / 255)
+    for i, (x1, y1, x2, y2) in enumerate(RECTS):
+        img[i, :, y1:y2, x1:x2] = 1.0
+    boxes = torch.tensor(RECTS, dtype=torch.float32)
+    return {
+        "img": img,
+        "resized_shape": [(S, S)] * len(RECTS),
+        "batch_idx": torch.arange(len(RECTS), dtype=torch.float32),
+        "cls": torch.zeros(len(RECTS), 1),
+        "bboxes": torch.cat(((boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]), 1) / S,
+        "segments": torch.stack([rect_segment(*r) for r in RECTS]) / S}
+
+
+def assert_aligned(batch):
+    # Every label's box and mask lie on a white square of its warped image
+    img, masks = batch["img"], batch["masks"].bool()
+    boxes = xywh2xyxy(batch["bboxes"]) * S
+    assert img.shape == (len(RECTS), 3, S, S)
+    assert len(boxes) == len(masks) == len(batch["cls"]) == len(batch["batch_idx"]) > 0
+    white = img.mean(1) > (1 + 114 / 255) / 2
+    for i, j in enumerate(batch["batch_idx"].long().tolist()):
+        x1, y1, x2, y2 = boxes[i].tolist()
+        region = torch.zeros_like(white[j])
+        region[max(int(y1) - 1, 0):int(y2) + 2, max(int(x1) - 1, 0):int(x2) + 2] = True
+        square = white[j] & region  # the square of this label, squares of other mosaic tiles are further away
+        iou = (square & masks[i]).sum() / (square | masks[i]).sum()
+        assert iou > 0.8, f"mask {i} is off its square, IoU {iou:.2f}"
+        ys, xs = masks[i].nonzero().T
+        mask_box = torch.stack((xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)).float()
+        assert torch.allclose(mask_box, boxes[i], atol=1.5), f"box {i} {boxes[i]} is off its mask {mask_box}"
+
+
+def test_identity():
+    batch = collated_batch()
+    img = batch["img"].clone()
+    out = BatchAugment(S, identity_hyp(), use_segments=True)(batch)
+    assert torch.allclose(out["img"], img, atol=1e-4)
+    assert_aligned(out)
+
+
+@pytest.mark.parametrize("hyp", [
+    dict(fliplr=1.0),
+    dict(flipud=1.0),
+    dict(translate=0.25),
+    dict(degrees=10.0, scale=0.2),
+    dict(mosaic=1.0),
+    dict(mosaic=1.0, fliplr=0.5)])
+def test_labels_follow_image(hyp):
+    torch.manual_seed(0)
+    for _ in range(4):
+        assert_aligned(BatchAugment(S, identity_hyp(**hyp), use_segments=True)(collated_batch()))
+
+
+def test_close_mosaic():
+    augment = BatchAugment(S, identity_hyp(mosaic=1.0, mixup=1.0), use_segments=True)
+    YOLODataset.close_mosaic(SimpleNamespace(batch_transforms=augment), hyp=None)
+    assert augment.mosaic == augment.mixup == 0.0
+    batch = collated_batch()
+    img = batch["img"].clone()
+    out = augment(batch)
+    assert torch.allclose(out["img"], img, atol=1e-4)  # neither tiled nor blended any more
+    assert out["batch_idx"].tolist() == list(range(len(RECTS)))
@@ -0,0 +1,22 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+
+import ast
+import importlib
+import inspect
+
+import pytest
+
+from ultralytics.yolo.utils.callbacks.base import integration_events
+
+
+@pytest.mark.parametrize('integration', sorted(integration_events))
+def test_integration_events(integration):
+    # The lazy proxies only fire the events listed in integration_events, they must cover every integration callback
+    module = importlib.import_module(f'ultralytics.yolo.utils.callbacks.{integration}')
+    keys = set(module.callbacks)  # empty if the integration package is not installed, so also read them from source
+    for node in ast.walk(ast.parse(inspect.getsource(module))):
+        if isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'callbacks' for t in node.targets):
+            value = node.value.body if isinstance(node.value, ast.IfExp) else node.value
+            keys |= {k.value for k in value.keys}
+    assert keys
+    assert keys <= set(integration_events[integration])
@@ -0,0 +1,32 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+
+import subprocess
+import sys
+
+import pytest
+
+# Seconds an import may take on top of torch and torchvision, which dominate and vary by machine
+BUDGET = 1.5
+
+
+def import_time(statement, setup='pass'):
+    # Returns the seconds `statement` takes to run in a fresh interpreter after `setup`, and the modules it loaded
+    code = (f'import sys, time\n{setup}\nbefore = set(sys.modules)\nt = time.perf_counter()\n{statement}\n'
+            'print(time.perf_counter() - t)\nprint(" ".join(set(sys.modules) - before))')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.splitlines()
+    return float(out[-2]), set(out[-1].split())
+
+
+def test_import_ultralytics():
+    t, modules = import_time('import ultralytics')
+    assert 'torch' not in modules
+    assert t < BUDGET, f'import ultralytics took {t:.2f}s'
+
+
+@pytest.mark.parametrize('statement', [
+    'from ultralytics import YOLO',
+    'from ultralytics.yolo.v8.detect import DetectionPredictor'])
+def test_import_budget(statement):
+    t, modules = import_time(statement, setup='import torch, torchvision')
+    assert not {'hydra', 'matplotlib', 'pandas', 'IPython'} & {m.split('.')[0] for m in modules}
+    assert t < BUDGET, f'{statement} took {t:.2f}s on top of torch'
@@ -0,0 +1,78 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+
+import numpy as np
+import torch
+
+from ultralytics.yolo.engine.predictor import BasePredictor
+
+
+class MotionStub:
+
+    def commit(self, streams):
+        pass
+
+
+class StaticImages:
+    # Two frames of different contents whose motion masks report a static scene
+    mode, frame = 'image', 0
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.motion = MotionStub()
+        self.motion_masks = [np.zeros((4, 4), dtype=bool)]
+
+    def __iter__(self):
+        for i, im0 in enumerate(self.frames):
+            yield f'{i}.jpg', im0.transpose(2, 0, 1).copy(), im0, None, ''
+
+
+class CountingModel(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def forward(self, im, augment=False, visualize=False):
+        self.calls += 1
+        return im
+
+
+class RecordingPredictor(BasePredictor):
+
+    def __init__(self, frames, plots_input=True):
+        super().__init__(overrides={'save': False, 'motion': 0.5})
+        self.dataset = StaticImages(frames)
+        self.model = CountingModel()
+        self.webcam, self.done_setup, self.imgsz = False, True, frames[0].shape[:2]
+        self.plotted, self.preprocessed, self.plots = [], 0, plots_input
+
+    def plots_input(self):
+        return self.plots
+
+    def preprocess(self, img):
+        self.preprocessed += 1
+        return torch.from_numpy(img).float() / 255
+
+    def postprocess(self, preds, img, orig_img):
+        return [preds]
+
+    def write_results(self, idx, preds, batch):
+        self.seen += 1
+        self.plotted.append(batch[1][idx].clone())  # the tensor masks are plotted over
+        return ''
+
+
+def test_static_frame_plots_current_frame():
+    frames = [np.full((8, 8, 3), v, dtype=np.uint8) for v in (0, 255)]
+    predictor = RecordingPredictor(frames)
+    predictor()
+    assert predictor.model.calls == 1  # the second frame is static and skips inference
+    assert torch.all(predictor.plotted[1] == 1)  # but is plotted over itself, not the held first frame
+
+
+def test_static_frame_skips_preprocess():
+    frames = [np.full((8, 8, 3), v, dtype=np.uint8) for v in (0, 255)]
+    predictor = RecordingPredictor(frames, plots_input=False)
+    predictor()
+    assert predictor.model.calls == predictor.preprocessed == 1  # nothing plots over the static frame's input
+    assert predictor.plotted[1].shape == predictor.plotted[0].shape  # the held input still gives the log shape
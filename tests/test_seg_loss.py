@@ -0,0 +1,84 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+
+import sys
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from ultralytics.yolo.utils import ROOT
+from ultralytics.yolo.utils.ops import crop_mask, xyxy2xywh
+
+sys.path.insert(0, str(ROOT / 'yolo/v8/segment'))  # the segment package imports deep_sort_pytorch from its folder
+from ultralytics.yolo.v8.segment.train import SegLoss  # noqa: E402
+
+NM, MASK, SIZE, ANCHORS = 8, 16, 64, 40
+
+
+def reference_mask_loss(masks, batch_idx, fg_mask, target_gt_idx, target_bboxes, pred_masks, proto, imgsz, overlap):
+    # The per-image crop_mask loop the bucketed loss replaced, indexing non-overlap masks by target_gt_idx
+    loss = 0
+    batch_size, nm, mask_h, mask_w = proto.shape
+    for i in range(batch_size):
+        if fg_mask[i].sum():
+            mask_idx = target_gt_idx[i][fg_mask[i]]
+            if overlap:
+                gt_mask = torch.where(masks[[i]] == (mask_idx + 1).view(-1, 1, 1), 1.0, 0.0)
+            else:
+                gt_mask = masks[batch_idx == i][mask_idx]
+            xyxyn = target_bboxes[i][fg_mask[i]] / imgsz[[1, 0, 1, 0]]
+            marea = xyxy2xywh(xyxyn)[:, 2:].prod(1)
+            mxyxy = xyxyn * torch.tensor([mask_w, mask_h, mask_w, mask_h])
+            pred_mask = (pred_masks[i][fg_mask[i]] @ proto[i].view(nm, -1)).view(-1, mask_h, mask_w)
+            bce = F.binary_cross_entropy_with_logits(pred_mask, gt_mask, reduction='none')
+            loss = loss + (crop_mask(bce, mxyxy).mean(dim=(1, 2)) / marea).mean()
+    return loss
+
+
+def random_targets(n_boxes, overlap):
+    # Assigner outputs for images with n_boxes[i] gts of mixed sizes, one crowded gt per image, and their masks
+    bs = len(n_boxes)
+    fg_mask = torch.rand(bs, ANCHORS) < 0.5
+    target_gt_idx = torch.zeros(bs, ANCHORS, dtype=torch.long)
+    target_bboxes = torch.zeros(bs, ANCHORS, 4)
+    masks = torch.zeros(bs, MASK, MASK) if overlap else []
+    for i, n in enumerate(n_boxes):
+        if not n:
+            fg_mask[i] = False
+            continue
+        xy = torch.rand(n, 2) * SIZE * 0.7
+        wh = torch.rand(n, 2) * SIZE * 0.5 + 2
+        gt_bboxes = torch.cat((xy, (xy + wh).clamp(max=SIZE)), 1)
+        target_gt_idx[i] = torch.where(torch.rand(ANCHORS) < 0.5, 0, torch.randint(0, n, (ANCHORS,)))
+        target_bboxes[i] = gt_bboxes[target_gt_idx[i]]
+        instances = (torch.rand(n, MASK, MASK) < 0.5).float()
+        if overlap:
+            for j in range(n):
+                masks[i][instances[j].bool()] = j + 1
+        else:
+            masks.append(instances)
+    if not overlap:
+        masks = torch.cat(masks)
+    batch_idx = torch.repeat_interleave(torch.arange(bs), torch.tensor(n_boxes)).float()
+    return masks, batch_idx, fg_mask, target_gt_idx, target_bboxes
+
+
+@pytest.mark.parametrize('overlap', [True, False])
+@pytest.mark.parametrize('n_boxes', [[3, 1, 5], [4, 0, 2], [1]])
+def test_mask_loss_matches_reference(overlap, n_boxes):
+    torch.manual_seed(0)
+    loss = SegLoss.__new__(SegLoss)  # mask_loss only needs these attributes, not a model
+    loss.overlap, loss.device, loss.nm = overlap, torch.device('cpu'), NM
+    imgsz = torch.tensor([SIZE, SIZE], dtype=torch.float32)
+    for _ in range(5):
+        masks, batch_idx, fg_mask, target_gt_idx, target_bboxes = random_targets(n_boxes, overlap)
+        pred_masks = torch.randn(len(n_boxes), ANCHORS, NM, requires_grad=True)
+        proto = torch.randn(len(n_boxes), NM, MASK, MASK, requires_grad=True)
+        args = masks, batch_idx, fg_mask, target_gt_idx, target_bboxes, pred_masks, proto, imgsz
+        value = loss.mask_loss(*args)
+        expected = reference_mask_loss(*args, overlap=overlap)
+        assert torch.allclose(value, expected, rtol=1e-4), f'{value} != {expected}'
+        grads = torch.autograd.grad(value, (pred_masks, proto))
+        expected_grads = torch.autograd.grad(expected, (pred_masks, proto))
+        for x, y in zip(grads, expected_grads):
+            assert torch.allclose(x, y, rtol=1e-4, atol=1e-6)
@@ -0,0 +1,53 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+
+import pytest
+import torch
+
+from ultralytics.yolo.utils.tal import TaskAlignedAssigner, make_anchors
+
+NC, SIZE, STRIDES = 5, 128, (8, 16, 32)
+
+
+def anchors():
+    # Anchor centres of a 3 level head in image pixels, as the detection loss passes them
+    feats = [torch.zeros(1, 1, SIZE // s, SIZE // s) for s in STRIDES]
+    anchor_points, stride_tensor = make_anchors(feats, STRIDES)
+    return anchor_points * stride_tensor
+
+
+def random_batch(bs, n_max_boxes, n_boxes, tied=False):
+    # Predictions and zero padded gts, image i has n_boxes[i] gts
+    anc_points = anchors()
+    n_anchors = len(anc_points)
+    xy = torch.rand(bs, n_max_boxes, 2) * SIZE * 0.8
+    wh = torch.rand(bs, n_max_boxes, 2) * (SIZE * 0.4) + 4
+    gt_bboxes = torch.cat((xy, (xy + wh).clamp(max=SIZE)), -1)
+    gt_labels = torch.randint(0, NC, (bs, n_max_boxes, 1)).float()
+    mask_gt = (torch.arange(n_max_boxes)[None] < torch.tensor(n_boxes)[:, None]).float()[..., None]
+    gt_bboxes, gt_labels = gt_bboxes * mask_gt, gt_labels * mask_gt  # padding is zero, as in the loss
+    if tied:  # equal scores and boxes on every anchor, align metrics tie at the topk boundary
+        pd_scores = torch.full((bs, n_anchors, NC), 0.5)
+        pd_bboxes = gt_bboxes[:, :1].expand(-1, n_anchors, -1).clone()
+    else:
+        pd_scores = torch.rand(bs, n_anchors, NC)
+        ltrb = torch.rand(bs, n_anchors, 4) * SIZE * 0.3
+        pd_bboxes = torch.cat((anc_points - ltrb[..., :2], anc_points + ltrb[..., 2:]), -1)
+    return pd_scores, pd_bboxes, anc_points, gt_labels, gt_bboxes, mask_gt
+
+
+@pytest.mark.parametrize('n_boxes,tied', [
+    ([6, 6, 6, 6], False),  # no padding
+    ([6, 2, 4, 1], False),  # padded gts
+    ([3, 0, 6, 0], False),  # empty images
+    ([6, 1, 3, 5], True),  # tied metrics take the dense rerun of topk
+    ([2, 0, 6, 4], True)])
+def test_sparse_assigner_matches_dense(n_boxes, tied):
+    torch.manual_seed(0)
+    for _ in range(5):
+        args = random_batch(len(n_boxes), 6, n_boxes, tied)
+        dense = TaskAlignedAssigner(topk=10, num_classes=NC, alpha=0.5, beta=6.0, sparse=False)(*args)
+        sparse = TaskAlignedAssigner(topk=10, num_classes=NC, alpha=0.5, beta=6.0, sparse=True)(*args)
+        assert dense[3].any()
+        for name, x, y in zip(('target_labels', 'target_bboxes', 'target_scores', 'fg_mask', 'target_gt_idx'), dense,
+                              sparse):
+            assert torch.equal(x, y.to(x.dtype)), f'{name} differs'
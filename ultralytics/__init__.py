@@ -2,8 +2,20 @@
 
 __version__ = "8.0.3"
 
-from ultralytics.hub import checks
-from ultralytics.yolo.engine.model import YOLO
-from ultralytics.yolo.utils import ops
+import importlib
 
 __all__ = ["__version__", "YOLO", "hub", "checks"]  # allow simpler import
+
+# loaded on first access, so that importing the package doesn't pull in every task, trainer and exporter
+_LAZY = {"YOLO": "ultralytics.yolo.engine.model", "checks": "ultralytics.hub", "ops": "ultralytics.yolo.utils"}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+    elif name in ("hub", "nn", "yolo"):
+        value = importlib.import_module(f"{__name__}.{name}")
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
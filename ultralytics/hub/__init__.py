@@ -5,14 +5,12 @@ import shutil
 
 import psutil
 import requests
-from IPython import display  # to display images and clear console output
 
 from ultralytics.hub.auth import Auth
 from ultralytics.hub.session import HubTrainingSession
 from ultralytics.hub.utils import PREFIX, split_key
 from ultralytics.yolo.utils import LOGGER, emojis, is_colab
 from ultralytics.yolo.utils.torch_utils import select_device
-from ultralytics.yolo.v8.detect import DetectionTrainer
 
 
 def checks(verbose=True):
@@ -20,6 +18,8 @@ def checks(verbose=True):
         shutil.rmtree('sample_data', ignore_errors=True)  # remove colab /sample_data directory
 
     if verbose:
+        from IPython import display  # to display images and clear console output
+
         # System info
         gib = 1 << 30  # bytes per GiB
         ram = psutil.virtual_memory().total
@@ -53,6 +53,8 @@ def start(key=''):
         else:
             return model_id
 
+    from ultralytics.yolo.v8.detect import DetectionTrainer
+
     try:
         api_key, model_id = split_key(key)
         auth = Auth(api_key)  # attempts cookie login if no api key is present
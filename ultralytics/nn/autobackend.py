@@ -16,11 +16,19 @@ from ultralytics.yolo.utils import LOGGER, ROOT, yaml_load
 from ultralytics.yolo.utils.checks import check_requirements, check_suffix, check_version
 from ultralytics.yolo.utils.downloads import attempt_download, is_url
 from ultralytics.yolo.utils.ops import xywh2xyxy
+from ultralytics.yolo.utils.torch_utils import cached_model
 
 
 class AutoBackend(nn.Module):
 
-    def __init__(self, weights='yolov8n.pt', device=torch.device('cpu'), dnn=False, data=None, fp16=False, fuse=True):
+    def __init__(self,
+                 weights='yolov8n.pt',
+                 device=torch.device('cpu'),
+                 dnn=False,
+                 data=None,
+                 fp16=False,
+                 fuse=True,
+                 cache=False):
         """
         Ultralytics YOLO MultiBackend class for python inference on various backends
 
@@ -32,6 +40,8 @@ class AutoBackend(nn.Module):
           data: a dictionary containing the following keys:
           fp16: If true, will use half precision. Defaults to False
           fuse: whether to fuse the model or not. Defaults to True
+          cache: If true, *.pt models are restored ready to run from the model cache on the next launch instead of
+        being loaded and fused again. Defaults to False
 
         Supported format and their usage:
             | Platform              | weights          |
@@ -70,13 +80,22 @@ class AutoBackend(nn.Module):
             pt = True
         elif pt:  # PyTorch
             from ultralytics.nn.tasks import attempt_load_weights
-            model = attempt_load_weights(weights if isinstance(weights, list) else w,
-                                         device=device,
-                                         inplace=True,
-                                         fuse=fuse)
+
+            def load():
+                model = attempt_load_weights(weights if isinstance(weights, list) else w,
+                                             device=device,
+                                             inplace=True,
+                                             fuse=fuse)
+                return model.half() if fp16 else model.float()
+
+            if cache and fuse and not isinstance(weights, list):
+                w = attempt_download(w)
+                model, cached = cached_model(w, device, fp16, load)
+                LOGGER.info(f"{'Restored' if cached else 'Cached'} {w} for {device} {'FP16' if fp16 else 'FP32'}")
+            else:
+                model = load()
             stride = max(int(model.stride.max()), 32)  # model stride
             names = model.module.names if hasattr(model, 'module') else model.names  # get class names
-            model.half() if fp16 else model.float()
             self.model = model  # explicitly assign for to(), cpu(), cuda(), half()
         elif jit:  # TorchScript
             LOGGER.info(f'Loading {w} for TorchScript inference...')
@@ -1,3 +1,10 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
-from . import v8
+import importlib
+
+
+def __getattr__(name):
+    # yolo.v8 and its tasks are imported on first access
+    if name == "v8":
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,6 +6,7 @@ from pathlib import Path
 import hydra
 
 from ultralytics import hub, yolo
+from ultralytics.yolo.configs import hydra_patch  # noqa (patch hydra cli)
 from ultralytics.yolo.utils import DEFAULT_CONFIG, LOGGER, colorstr
 
 DIR = Path(__file__).parent
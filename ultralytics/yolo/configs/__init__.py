@@ -1,11 +1,13 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
+import functools
+from difflib import get_close_matches
 from pathlib import Path
 from typing import Dict, Union
 
 from omegaconf import DictConfig, OmegaConf
 
-from ultralytics.yolo.configs.hydra_patch import check_config_mismatch
+from ultralytics.yolo.utils import DEFAULT_CONFIG, LOGGER, colorstr
 
 
 def get_config(config: Union[str, DictConfig], overrides: Union[str, Dict] = None):
@@ -34,3 +36,29 @@ def get_config(config: Union[str, DictConfig], overrides: Union[str, Dict] = Non
     check_config_mismatch(dict(overrides).keys(), dict(config).keys())
 
     return OmegaConf.merge(config, overrides)
+
+
+def check_config_mismatch(overrides, cfg):
+    mismatched = [option for option in overrides if option not in cfg and 'hydra.' not in option]
+
+    for option in mismatched:
+        LOGGER.info(f"{colorstr(option)} is not a valid key. Similar keys: {get_close_matches(option, cfg, 3, 0.6)}")
+    if mismatched:
+        exit()
+
+
+def hydra_main(func):
+    """
+    hydra.main() on the default config for the entry points of the tasks. Hydra and its CLI patch are only imported
+    when the entry point is called, so that importing the trainers, validators and predictors doesn't import them.
+    """
+
+    @functools.wraps(func)
+    def wrapper(cfg=None):
+        import hydra
+
+        from ultralytics.yolo.configs import hydra_patch  # noqa (patch hydra cli)
+        main = hydra.main(version_base=None, config_path=str(DEFAULT_CONFIG.parent), config_name=DEFAULT_CONFIG.name)
+        return main(func)(cfg)
+
+    return wrapper
@@ -1,7 +1,6 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
 import sys
-from difflib import get_close_matches
 from textwrap import dedent
 
 import hydra
@@ -9,7 +8,7 @@ from hydra.errors import ConfigCompositionException
 from omegaconf import OmegaConf, open_dict  # noqa
 from omegaconf.errors import ConfigAttributeError, ConfigKeyError, OmegaConfBaseException  # noqa
 
-from ultralytics.yolo.utils import LOGGER, colorstr
+from ultralytics.yolo.configs import check_config_mismatch
 
 
 def override_config(overrides, cfg):
@@ -65,13 +64,4 @@ def override_config(overrides, cfg):
                 sys.exc_info()[2]) from ex
 
 
-def check_config_mismatch(overrides, cfg):
-    mismatched = [option for option in overrides if option not in cfg and 'hydra.' not in option]
-
-    for option in mismatched:
-        LOGGER.info(f"{colorstr(option)} is not a valid key. Similar keys: {get_close_matches(option, cfg, 3, 0.6)}")
-    if mismatched:
-        exit()
-
-
 hydra._internal.config_loader_impl.ConfigLoaderImpl._apply_overrides_to_config = override_config
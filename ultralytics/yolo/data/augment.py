@@ -7,14 +7,15 @@ from copy import deepcopy
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as T
 
 from ..utils import LOGGER, colorstr
 from ..utils.checks import check_version
 from ..utils.instance import Instances
 from ..utils.metrics import bbox_ioa
-from ..utils.ops import segment2box
-from .utils import IMAGENET_MEAN, IMAGENET_STD, polygons2masks, polygons2masks_overlap
+from ..utils.ops import xywh2xyxy, xyxy2xywh
+from .utils import IMAGENET_MEAN, IMAGENET_STD, masks2overlap, polygons2masks_batch
 
 
 # TODO: we might need a BaseTransform to make all these augments be compatible with both classification and semantic
@@ -293,7 +294,9 @@ class RandomPerspective:
         xy = xy @ M.T  # transform
         xy = xy[:, :2] / xy[:, 2:3]
         segments = xy.reshape(n, -1, 2)
-        bboxes = np.stack([segment2box(xy, self.size[0], self.size[1]) for xy in segments], 0)
+        inside = ((segments >= 0) & (segments <= self.size)).all(2, keepdims=True)  # segment2box() of every segment
+        lo, hi = np.where(inside, segments, np.inf).min(1), np.where(inside, segments, -np.inf).max(1)
+        bboxes = np.where(inside.any(1), np.concatenate((lo, hi), 1), 0.0)  # zeros if no point is inside
         return bboxes, segments
 
     def apply_keypoints(self, keypoints, M):
@@ -395,7 +398,10 @@ class RandomHSV:
             lut_val = np.clip(x * r[2], 0, 255).astype(dtype)
 
             im_hsv = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
-            cv2.cvtColor(im_hsv, cv2.COLOR_HSV2BGR, dst=img)  # no return needed
+            if img.flags.writeable:
+                cv2.cvtColor(im_hsv, cv2.COLOR_HSV2BGR, dst=img)  # no return needed
+            else:  # read-only view of packed images
+                labels["img"] = cv2.cvtColor(im_hsv, cv2.COLOR_HSV2BGR)
         return labels
 
 
@@ -522,6 +528,7 @@ class CopyPaste:
 
             result = cv2.flip(im, 1)  # augment segments (flip left-right)
             i = cv2.flip(im_new, 1).astype(bool)
+            im = im if im.flags.writeable else im.copy()  # read-only view of packed images
             im[i] = result[i]  # cv2.imwrite('debug.jpg', im)  # debug
 
         labels["img"] = im
@@ -583,11 +590,13 @@ class Format:
                  return_keypoint=False,
                  mask_ratio=4,
                  mask_overlap=True,
-                 batch_idx=True):
+                 batch_idx=True,
+                 return_segments=False):
         self.bbox_format = bbox_format
         self.normalize = normalize
         self.return_mask = return_mask  # set False when training detection only
         self.return_keypoint = return_keypoint
+        self.return_segments = return_segments  # resampled polygons, rasterised to masks later by BatchAugment
         self.mask_ratio = mask_ratio
         self.mask_overlap = mask_overlap
         self.batch_idx = batch_idx  # keep the batch indexes
@@ -599,12 +608,13 @@ class Format:
         instances = labels.pop("instances")
         instances.convert_bbox(format=self.bbox_format)
         instances.denormalize(w, h)
+        if self.return_segments and len(instances) and not len(instances.segments):
+            instances, cls = instances[:0], cls[:0]  # boxes without segments have no mask targets
         nl = len(instances)
 
         if self.return_mask:
             if nl:
                 masks, instances, cls = self._format_segments(instances, cls, w, h)
-                masks = torch.from_numpy(masks)
             else:
                 masks = torch.zeros(1 if self.mask_overlap else nl, img.shape[0] // self.mask_ratio,
                                     img.shape[1] // self.mask_ratio)
@@ -616,6 +626,8 @@ class Format:
         labels["bboxes"] = torch.from_numpy(instances.bboxes) if nl else torch.zeros((nl, 4))
         if self.return_keypoint:
             labels["keypoints"] = torch.from_numpy(instances.keypoints) if nl else torch.zeros((nl, 17, 2))
+        if self.return_segments:
+            labels["segments"] = torch.from_numpy(instances.segments).float()  # (nl, 1000, 2)
         # then we can use collate_fn
         if self.batch_idx:
             labels["batch_idx"] = torch.zeros(nl)
@@ -629,15 +641,13 @@ class Format:
         return img
 
     def _format_segments(self, instances, cls, w, h):
-        """convert polygon points to bitmap"""
-        segments = instances.segments
+        """convert polygon points to bitmap, all instances at once"""
+        masks = polygons2masks_batch(torch.from_numpy(instances.segments), (h, w), self.mask_ratio)
         if self.mask_overlap:
-            masks, sorted_idx = polygons2masks_overlap((h, w), segments, downsample_ratio=self.mask_ratio)
-            masks = masks[None]  # (640, 640) -> (1, 640, 640)
+            masks, sorted_idx = masks2overlap(masks, torch.zeros(len(masks), dtype=torch.long), 1)  # (1, 160, 160)
+            sorted_idx = sorted_idx.numpy()
             instances = instances[sorted_idx]
             cls = cls[sorted_idx]
-        else:
-            masks = polygons2masks((h, w), segments, color=1, downsample_ratio=self.mask_ratio)
 
         return masks, instances, cls
 
@@ -680,6 +690,250 @@ def affine_transforms(imgsz, hyp):
         RandomFlip(direction="horizontal", p=hyp.fliplr),])  # transforms
 
 
+# Batch augmentations --------------------------------------------------------------------------------------------------
+def rgb2hsv(img, eps=1e-8):
+    # (b, 3, h, w) RGB to HSV, all channels in [0, 1]
+    r, g, b = img.unbind(1)
+    v, vi = img.max(1)
+    c = v - img.min(1)[0]
+    h = torch.where(vi == 0, (g - b) / (c + eps) % 6, torch.where(vi == 1, (b - r) / (c + eps) + 2,
+                                                                  (r - g) / (c + eps) + 4)) / 6
+    return torch.stack((h * (c > 0), c / (v + eps), v), 1)
+
+
+def hsv2rgb(img):
+    # (b, 3, h, w) HSV to RGB, all channels in [0, 1]
+    h, s, v = img.unbind(1)
+    k = (torch.tensor([5, 3, 1], device=img.device).view(1, 3, 1, 1) + h[:, None] * 6) % 6
+    return v[:, None] - (v * s)[:, None] * torch.minimum(k, 4 - k).clamp(0, 1)
+
+
+class BatchAugment:
+    """
+    Mosaic, random perspective, MixUp, HSV and flip augmentation of collated batches, on the device of the batch.
+
+    The batched counterpart of mosaic_transforms() and affine_transforms(), so that dataloader workers only decode
+    images. The tiles of every mosaic are composed and warped in a single grid_sample() call, boxes, segments and
+    keypoints are transformed with the same matrices, and segments are rasterised to mask targets afterwards. Mosaic
+    and MixUp draw their other images from the same batch. CopyPaste and Albumentations are not applied.
+
+    Args:
+        imgsz (int): train image size.
+        hyp (DictConfig): augmentation hyperparameters.
+        rect (bool): rectangular batches, letterboxed by the workers, which disables mosaic and MixUp.
+        use_segments (bool): transform batch['segments'] and rasterise them to batch['masks'].
+        use_keypoints (bool): transform batch['keypoints'].
+    """
+
+    def __init__(self, imgsz, hyp, rect=False, use_segments=False, use_keypoints=False):
+        self.imgsz = imgsz
+        self.rect = rect
+        self.mosaic = 0.0 if rect else hyp.mosaic
+        self.mixup = 0.0 if rect else hyp.mixup
+        self.degrees = hyp.degrees
+        self.translate = hyp.translate
+        self.scale = hyp.scale
+        self.shear = hyp.shear
+        self.perspective = hyp.perspective
+        self.hsv = (hyp.hsv_h, hyp.hsv_s, hyp.hsv_v)
+        self.flipud = hyp.flipud
+        self.fliplr = hyp.fliplr
+        self.use_segments = use_segments
+        self.use_keypoints = use_keypoints
+        self.mask_ratio = hyp.mask_ratio
+        self.mask_overlap = hyp.overlap_mask
+        if hyp.copy_paste:
+            LOGGER.warning("WARNING ⚠️ copy_paste is not supported with batch_augment and will be ignored")
+
+    def close_mosaic(self):
+        self.mosaic = self.mixup = 0.0
+
+    @torch.no_grad()
+    def __call__(self, batch):
+        """
+        Augments a collated batch.
+
+        Args:
+            batch (dict): 'img' (b, 3, h, w) float in [0, 1] with the image content at the top left and its hw in
+                'resized_shape', 'cls', 'bboxes' xywh normalized to the content, 'batch_idx' in ascending order, and
+                'segments' (n, m, 2) or 'keypoints' (n, 17, 2) normalized to the content.
+
+        Returns:
+            (dict): the batch with 'img' (b, 3, imgsz, imgsz), or the rect shape, and its labels, 'masks' replacing
+                'segments', all on the device of 'img'.
+        """
+        img = batch["img"]
+        device, (b, _, h, w) = img.device, img.shape
+        idx = batch["batch_idx"].to(device).long()
+        content = torch.from_numpy(np.array(batch["resized_shape"], dtype=np.float32)[:, ::-1].copy()).to(device)  # wh
+        cls = batch["cls"].to(device)
+        boxes = xywh2xyxy(batch["bboxes"].to(device).float()) * content[idx].repeat(1, 2)
+        segments = batch["segments"].to(device) * content[idx, None] if self.use_segments else None
+        keypoints = batch["keypoints"].to(device).float() if self.use_keypoints else None
+        if keypoints is not None:
+            visible = keypoints != 0  # as in RandomPerspective, zero coordinates are not labelled
+            keypoints = keypoints * content[idx, None]
+
+        # Mosaic, tile q of image i is tiles[i, q] placed at offsets[i, q] on a canvas of wh canvas[i]
+        s = self.imgsz
+        ow, oh = (w, h) if self.rect else (s, s)
+        size = torch.tensor([ow, oh], device=device, dtype=torch.float32)  # output wh
+        mosaic = torch.rand(b, device=device) < self.mosaic
+        tiles = torch.arange(b, device=device).view(-1, 1).repeat(1, 4)
+        tiles[:, 1:] = torch.where(mosaic[:, None], torch.randint(0, b, (b, 3), device=device), tiles[:, 1:])
+        canvas = torch.where(mosaic[:, None], size.new_tensor([2 * s, 2 * s]), size)
+        centre = self._uniform(0.5 * s, 1.5 * s, (b, 2), device).floor()  # xc, yc
+        xc, yc = centre.unbind(1)
+        (w0, h0), (_, h1), (w2, _) = (content[tiles[:, q]].unbind(1) for q in range(3))
+        offsets = torch.stack((xc - w0, yc - h0, xc, yc - h1, xc - w2, yc, xc, yc), 1).view(b, 4, 2)  # tile top left
+        letterbox = ((canvas - content) / 2 - 0.1).round()  # without mosaic the image is centred like LetterBox
+        offsets = torch.where(mosaic[:, None, None], offsets, letterbox[:, None])
+
+        # Random perspective, one grid_sample() over the batch as depth samples every output pixel from its tile
+        M, scale = self._affine(canvas, size)
+        ys, xs = torch.arange(oh, device=device), torch.arange(ow, device=device)
+        p = torch.stack((xs.view(1, -1).expand(oh, ow), ys.view(-1, 1).expand(oh, ow)), -1).view(1, -1, 2).float()
+        xy = self._transform(p.expand(b, -1, -1), torch.inverse(M))  # (b, oh * ow, 2) canvas xy of every pixel
+        q = (xy + 0.5 >= centre[:, None]).long()  # pixel centres are at integers, their edges at halves
+        q = q[..., 0] + 2 * q[..., 1]  # quadrant, and tile, of every pixel
+        tile = tiles.gather(1, q)
+        inside = ((xy >= -0.5) & (xy < canvas[:, None] - 0.5)).all(2)  # on the canvas
+        xy = xy - offsets.gather(1, q[..., None].expand(-1, -1, 2))
+        wh = content[tile]
+        inside &= ((xy >= -0.5) & (xy < wh - 0.5)).all(2)  # and on the image of its tile, else gray
+        xy = torch.minimum(xy.clamp(0), wh - 1)  # tile edges are not interpolated with their padding
+        grid = torch.cat(((2 * xy + 1) / xy.new_tensor([w, h]) - 1, (2 * tile[..., None] + 1) / b - 1), 2)
+        img = F.grid_sample(img.float().transpose(0, 1)[None], grid.view(1, b, oh, ow, 3), align_corners=False)
+        img = torch.where(inside.view(b, 1, oh, ow), img[0].transpose(0, 1), img.new_tensor(114 / 255))
+
+        # Labels of the tiles on the canvas, then transformed like the pixels
+        pairs = torch.arange(4 * b, device=device)
+        pairs = pairs[mosaic.repeat_interleave(4) | (pairs % 4 == 0)]
+        i, q = pairs // 4, pairs % 4
+        rows, group = self._ragged_rows(idx, b, tiles[i, q])
+        idx, offset = i[group], offsets[i, q][group]
+        lim = canvas[idx]
+        cls = cls[rows]
+        boxes = torch.minimum((boxes[rows] + offset.repeat(1, 2)).clamp(0), lim.repeat(1, 2))  # clip to canvas
+        Mi = M[idx]
+        x1, y1, x2, y2 = boxes.unbind(1)
+        corners = torch.stack((x1, y1, x2, y2, x1, y2, x2, y1), 1).view(-1, 4, 2)
+        new = self._transform(corners, Mi)
+        new = torch.cat((new.min(1)[0], new.max(1)[0]), 1)
+        if segments is not None:
+            segments = torch.minimum((segments[rows] + offset[:, None]).clamp(0), lim[:, None])
+            segments = self._transform(segments, Mi)
+            inside = ((segments >= 0) & (segments <= size)).all(2, keepdim=True)  # segment2box() of every segment
+            new = torch.cat((torch.where(inside, segments, segments.new_tensor(float("inf"))).min(1)[0],
+                             torch.where(inside, segments, segments.new_tensor(float("-inf"))).max(1)[0]), 1)
+            new = torch.where(inside.any(1), new, new.new_tensor(0.0))
+            segments = torch.minimum(segments.clamp(0), size)
+        new = torch.minimum(new.clamp(0), size.repeat(2))
+        if keypoints is not None:
+            visible = visible[rows]
+            keypoints = self._transform(keypoints[rows] + offset[:, None], Mi)
+            visible &= ((keypoints >= 0) & (keypoints <= size)).all(2, keepdim=True)
+        keep = self._box_candidates(boxes * scale[idx, None], new, area_thr=0.01 if segments is not None else 0.10)
+        idx, cls, boxes = idx[keep], cls[keep], new[keep]
+        segments = segments[keep] if segments is not None else None
+        keypoints, visible = (keypoints[keep], visible[keep]) if keypoints is not None else (None, None)
+
+        # MixUp with another image of the batch, whose labels are appended
+        mix = torch.rand(b, device=device) < self.mixup
+        if mix.any():
+            other = torch.randint(0, b, (b,), device=device)
+            r = torch.distributions.Beta(img.new_tensor(32.0), img.new_tensor(32.0)).sample((b,))  # mixup ratio
+            r = torch.where(mix, r, r.new_tensor(1.0)).view(-1, 1, 1, 1)
+            img = img * r + img[other] * (1 - r)
+            rows, group = self._ragged_rows(idx, b, other[mix])
+            rows = torch.cat((torch.arange(len(idx), device=device), rows))
+            idx = torch.cat((idx, mix.nonzero()[:, 0][group]))
+            order = (idx * len(idx) + torch.arange(len(idx), device=device)).argsort()  # by image, appended last
+            rows, idx = rows[order], idx[order]
+            cls, boxes = cls[rows], boxes[rows]
+            segments = segments[rows] if segments is not None else None
+            keypoints, visible = (keypoints[rows], visible[rows]) if keypoints is not None else (None, None)
+
+        # HSV
+        if any(self.hsv):
+            gain = (torch.rand(b, 3, 1, 1, device=device) * 2 - 1) * img.new_tensor(self.hsv).view(1, 3, 1, 1) + 1
+            hsv = rgb2hsv(img.clamp(0, 1)) * gain
+            img = hsv2rgb(torch.cat((hsv[:, :1] % 1, hsv[:, 1:].clamp(0, 1)), 1))
+
+        # Flip up-down and left-right
+        for prob, d in (self.flipud, 1), (self.fliplr, 0):
+            flip = torch.rand(b, device=device) < prob
+            if flip.any():
+                img = torch.where(flip.view(-1, 1, 1, 1), img.flip(3 - d), img)
+                f = flip[idx]
+                boxes[:, [d, d + 2]] = torch.where(f[:, None], size[d] - boxes[:, [d + 2, d]], boxes[:, [d, d + 2]])
+                if segments is not None:
+                    segments[..., d] = torch.where(f[:, None], size[d] - segments[..., d], segments[..., d])
+                if keypoints is not None:
+                    keypoints[..., d] = torch.where(f[:, None], size[d] - keypoints[..., d], keypoints[..., d])
+
+        if segments is not None:
+            masks = polygons2masks_batch(segments, (oh, ow), self.mask_ratio)
+            if self.mask_overlap:
+                masks, order = masks2overlap(masks, idx, b)
+                idx, cls, boxes = idx[order], cls[order], boxes[order]
+            batch["masks"] = masks
+            batch.pop("segments")
+        if keypoints is not None:
+            batch["keypoints"] = keypoints * visible / size
+        batch["img"] = img.clamp(0, 1)
+        batch["batch_idx"] = idx.float()
+        batch["cls"] = cls
+        batch["bboxes"] = xyxy2xywh(boxes) / size.repeat(2)
+        return batch
+
+    def _affine(self, canvas, size):
+        # Random perspective matrices of canvases of wh canvas to images of wh size, and their scale gains
+        b, device = len(canvas), canvas.device
+        C = torch.eye(3, device=device).repeat(b, 1, 1)
+        C[:, :2, 2] = -canvas / 2  # centre
+        P = torch.eye(3, device=device).repeat(b, 1, 1)
+        P[:, 2, :2] = self._uniform(-self.perspective, self.perspective, (b, 2), device)  # perspective
+        R = torch.eye(3, device=device).repeat(b, 1, 1)
+        a = self._uniform(-self.degrees, self.degrees, (b,), device) * math.pi / 180
+        scale = self._uniform(1 - self.scale, 1 + self.scale, (b,), device)
+        R[:, 0, 0] = R[:, 1, 1] = scale * a.cos()  # rotation and scale, as cv2.getRotationMatrix2D()
+        R[:, 0, 1] = scale * a.sin()
+        R[:, 1, 0] = -R[:, 0, 1]
+        S = torch.eye(3, device=device).repeat(b, 1, 1)
+        S[:, [0, 1], [1, 0]] = (self._uniform(-self.shear, self.shear, (b, 2), device) * math.pi / 180).tan()  # shear
+        T = torch.eye(3, device=device).repeat(b, 1, 1)
+        T[:, :2, 2] = self._uniform(0.5 - self.translate, 0.5 + self.translate, (b, 2), device) * size  # translation
+        return T @ S @ R @ P @ C, scale
+
+    @staticmethod
+    def _uniform(a, b, shape, device):
+        return torch.rand(shape, device=device) * (b - a) + a
+
+    @staticmethod
+    def _transform(xy, M):
+        # Applies (n, 3, 3) perspective matrices to (n, m, 2) points
+        xy = xy @ M[:, :, :2].transpose(1, 2) + M[:, None, :, 2]
+        return xy[..., :2] / xy[..., 2:]
+
+    @staticmethod
+    def _ragged_rows(idx, b, images):
+        # Rows of the labels of images, in order, and the position in images of every row, for ascending batch idx
+        counts = torch.bincount(idx, minlength=b)
+        n = counts[images]
+        group = torch.arange(len(images), device=idx.device).repeat_interleave(n)
+        start = (counts.cumsum(0) - counts)[images]
+        return start[group] + torch.arange(len(group), device=idx.device) - (n.cumsum(0) - n)[group], group
+
+    @staticmethod
+    def _box_candidates(box1, box2, wh_thr=2, ar_thr=100, area_thr=0.1, eps=1e-16):
+        # RandomPerspective.box_candidates() of (n, 4) xyxy boxes before and after augmentation
+        w1, h1 = (box1[:, 2:] - box1[:, :2]).unbind(1)
+        w2, h2 = (box2[:, 2:] - box2[:, :2]).unbind(1)
+        ar = torch.maximum(w2 / (h2 + eps), h2 / (w2 + eps))  # aspect ratio
+        return (w2 > wh_thr) & (h2 > wh_thr) & (w2 * h2 / (w1 * h1 + eps) > area_thr) & (ar < ar_thr)
+
+
 # Classification augmentations -----------------------------------------------------------------------------------------
 def classify_transforms(size=224):
     # Transforms to apply if albumentations not installed
@@ -13,6 +13,7 @@ from torch.utils.data import Dataset
 from tqdm import tqdm
 
 from ..utils import NUM_THREADS, TQDM_BAR_FORMAT
+from .packed import PackedImages
 from .utils import HELP_URL, IMG_FORMATS, LOCAL_RANK
 
 
@@ -66,7 +67,10 @@ class BaseDataset(Dataset):
         # cache stuff
         self.ims = [None] * self.ni
         self.npy_files = [Path(f).with_suffix(".npy") for f in self.im_files]
-        if cache:
+        self.pack, self.pack_ids = None, None  # PackedImages and the store index of every image, for cache='mmap'
+        if cache == "mmap":
+            self.cache_images_to_pack()
+        elif cache:
             self.cache_images(cache)
 
         # transforms
@@ -98,37 +102,36 @@ class BaseDataset(Dataset):
 
     def update_labels(self, include_class: Optional[list]):
         """include_class, filter labels to include only these classes (optional)"""
-        include_class_array = np.array(include_class).reshape(1, -1)
-        for i in range(len(self.labels)):
-            if include_class:
-                cls = self.labels[i]["cls"]
-                bboxes = self.labels[i]["bboxes"]
-                segments = self.labels[i]["segments"]
-                j = (cls == include_class_array).any(1)
-                self.labels[i]["cls"] = cls[j]
-                self.labels[i]["bboxes"] = bboxes[j]
-                if segments:
-                    self.labels[i]["segments"] = segments[j]
-            if self.single_cls:
-                self.labels[i]["cls"] = 0
+        if include_class:
+            include_class_array = np.array(include_class).reshape(1, -1)
+            self.labels = self.labels.filter((self.labels.instances["cls"] == include_class_array).any(1))
+        if self.single_cls:
+            self.labels.instances["cls"] = np.zeros_like(self.labels.instances["cls"])
 
     def load_image(self, i):
         # Loads 1 image from dataset index 'i', returns (im, resized hw)
+        if self.pack is not None:  # read-only view of the packed images
+            return self.pack[self.pack_ids[i]]
         im, f, fn = self.ims[i], self.im_files[i], self.npy_files[i]
         if im is None:  # not cached in RAM
-            if fn.exists():  # load npy
-                im = np.load(fn)
-            else:  # read image
-                im = cv2.imread(f)  # BGR
-                assert im is not None, f"Image Not Found {f}"
-            h0, w0 = im.shape[:2]  # orig hw
-            r = self.imgsz / max(h0, w0)  # ratio
-            if r != 1:  # if sizes are not equal
-                interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
-                im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
-            return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
+            im, hw0 = self.read_image(fn if fn.exists() else f)
+            return im, hw0, im.shape[:2]  # im, hw_original, hw_resized
         return self.ims[i], self.im_hw0[i], self.im_hw[i]  # im, hw_original, hw_resized
 
+    def read_image(self, f):
+        # Reads an image or *.npy file and resizes it to imgsz, returns (im, hw_original)
+        if Path(f).suffix == ".npy":  # load npy
+            im = np.load(f)
+        else:  # read image
+            im = cv2.imread(str(f))  # BGR
+            assert im is not None, f"Image Not Found {f}"
+        h0, w0 = im.shape[:2]  # orig hw
+        r = self.imgsz / max(h0, w0)  # ratio
+        if r != 1:  # if sizes are not equal
+            interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
+            im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
+        return im, (h0, w0)
+
     def cache_images(self, cache):
         # cache images to memory or disk
         gb = 0  # Gigabytes of cached images
@@ -151,15 +154,26 @@ class BaseDataset(Dataset):
         if not f.exists():
             np.save(f.as_posix(), cv2.imread(self.im_files[i]))
 
+    def cache_images_to_pack(self, workers=NUM_THREADS):
+        # Packs the resized images into one memory-mapped file next to the images dir, or reuses an up to date one
+        files = sorted(self.im_files)  # the store doesn't depend on the order of the dataset, i.e. rect
+        path = Path(files[0]).parent
+        path = path.parent / f"{path.name}_{self.imgsz}_{'linear' if self.augment else 'area'}.pack"
+        self.pack = PackedImages.load(path, files)
+        if self.pack is None:
+            self.pack = PackedImages.build(path, files, lambda k: self.read_image(files[k]), workers, self.prefix)
+        ids = {f: k for k, f in enumerate(files)}
+        self.pack_ids = np.array([ids[f] for f in self.im_files])
+
     def set_rectangle(self):
         bi = np.floor(np.arange(self.ni) / self.batch_size).astype(int)  # batch index
         nb = bi[-1] + 1  # number of batches
 
-        s = np.array([x.pop("shape") for x in self.labels])  # hw
+        s = self.labels.images["shape"]  # hw
         ar = s[:, 0] / s[:, 1]  # aspect ratio
         irect = ar.argsort()
         self.im_files = [self.im_files[i] for i in irect]
-        self.labels = [self.labels[i] for i in irect]
+        self.labels = self.labels.take(irect)
         ar = ar[irect]
 
         # Set training image shapes
@@ -211,7 +225,7 @@ class BaseDataset(Dataset):
 
     def get_labels(self):
         """Users can custom their own format here.
-        Make sure your output is a list with each element like below:
+        Make sure your output is a LabelStore, i.e. LabelStore.from_records(...), indexing it returns dicts like below:
             dict(
                 im_file=im_file,
                 shape=shape,  # format: (height, width)
@@ -5,7 +5,7 @@ import random
 
 import numpy as np
 import torch
-from torch.utils.data import DataLoader, dataloader, distributed
+from torch.utils.data import DataLoader, RandomSampler, dataloader, distributed
 
 from ..utils import LOGGER, colorstr
 from ..utils.torch_utils import torch_distributed_zero_first
@@ -90,12 +90,37 @@ def build_dataloader(cfg, batch_size, img_path, stride=32, label_path=None, rank
                   shuffle=shuffle and sampler is None,
                   num_workers=nw,
                   sampler=sampler,
-                  pin_memory=PIN_MEMORY,
+                  pin_memory=PIN_MEMORY if cfg.get("pin_memory") is None else cfg.pin_memory,
                   collate_fn=getattr(dataset, "collate_fn", None),
                   worker_init_fn=seed_worker,
                   generator=generator), dataset
 
 
+def rebuild_dataloader(loader, batch_size, workers, pin_memory):
+    """
+    Returns a single-device loader of the same type over the dataset of `loader`, with other batch size, workers and
+    pin_memory settings, so that the dataset, its labels and image cache are not built again. Returns None for
+    rectangular datasets whose batch shapes can't follow a new batch size.
+    """
+    dataset = loader.dataset
+    batch_size = min(batch_size, len(dataset))
+    if getattr(dataset, "rect", False) and getattr(dataset, "batch_size", None) != batch_size:
+        if not hasattr(dataset, "set_rectangle"):
+            return None
+        dataset.batch_size = batch_size
+        dataset.set_rectangle()  # batch shapes follow the batch size
+    nd = torch.cuda.device_count()  # number of CUDA devices
+    nw = min([os.cpu_count() // max(nd, 1), batch_size if batch_size > 1 else 0, workers])  # number of workers
+    return type(loader)(dataset=dataset,
+                        batch_size=batch_size,
+                        shuffle=isinstance(loader.sampler, RandomSampler),
+                        num_workers=nw,
+                        pin_memory=PIN_MEMORY if pin_memory is None else pin_memory,
+                        collate_fn=loader.collate_fn,
+                        worker_init_fn=loader.worker_init_fn,
+                        generator=loader.generator)
+
+
 # build classification
 # TODO: using cfg like `build_dataloader`
 def build_classification_dataloader(path,
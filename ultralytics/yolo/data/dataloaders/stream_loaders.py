@@ -4,8 +4,9 @@ import glob
 import math
 import os
 import time
+from collections import deque
 from pathlib import Path
-from threading import Thread
+from threading import Condition, Thread
 from urllib.parse import urlparse
 
 import cv2
@@ -18,11 +19,68 @@ from ultralytics.yolo.utils import LOGGER, is_colab, is_kaggle, ops
 from ultralytics.yolo.utils.checks import check_requirements
 
 
+class MotionDetector:
+    """
+    Cheap per stream motion detection, a blurred grayscale copy of every frame downsampled to `size` pixels wide is
+    differenced against the copy of the last frame that was inferred, so that slow changes add up until they count.
+
+    Attributes:
+        size (int): width of the low resolution copy.
+        thres (int): minimum absolute difference of a moving pixel (0-255).
+        reference (dict): low resolution copy of the last inferred frame per stream index.
+        current (dict): low resolution copy of the latest frame per stream index.
+    """
+
+    def __init__(self, size=160, thres=25):
+        self.size = size
+        self.thres = thres
+        self.reference = {}
+        self.current = {}
+
+    def __call__(self, i, im0):
+        """Returns the low resolution boolean motion mask of frame im0 of stream i, everything moves on a new scene."""
+        h, w = im0.shape[:2]
+        small = cv2.resize(im0, (self.size, max(round(h * self.size / w), 1)), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        self.current[i] = small
+        ref = self.reference.get(i)
+        if ref is None or ref.shape != small.shape:
+            return np.ones(small.shape, dtype=bool)
+        return cv2.absdiff(small, ref) > self.thres
+
+    def commit(self, streams=None):
+        """Makes the latest frames of the given streams (all by default) the reference, once they have been inferred."""
+        self.reference.update(self.current if streams is None else {i: self.current[i] for i in streams})
+
+    def reset(self):
+        self.reference.clear()
+        self.current.clear()
+
+    @staticmethod
+    def boxes(mask, shape):
+        """Returns the xyxy boxes of the moving regions of a motion mask in pixels of a frame of the given shape."""
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+        boxes = stats[1:, :4].astype(np.float32)  # drop background, xywh
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes * np.array([shape[1] / mask.shape[1], shape[0] / mask.shape[0]] * 2, dtype=np.float32)
+
+
 class LoadStreams:
     # YOLOv5 streamloader, i.e. `python detect.py --source 'rtsp://example.com/media.mp4'  # RTSP, RTMP, HTTP streams`
-    def __init__(self, sources='file.streams', imgsz=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self,
+                 sources='file.streams',
+                 imgsz=640,
+                 stride=32,
+                 auto=True,
+                 transforms=None,
+                 vid_stride=1,
+                 motion=None,
+                 preprocess=True):
         torch.backends.cudnn.benchmark = True  # faster for fixed-size inference
         self.mode = 'stream'
+        self.motion = motion  # optional MotionDetector
+        self.preprocess = preprocess  # letterbox on the CPU, else im is None and the predictor does it on device
+        self.motion_masks = None
         self.imgsz = imgsz
         self.stride = stride
         self.vid_stride = vid_stride  # video frame-rate stride
@@ -91,7 +149,11 @@ class LoadStreams:
             raise StopIteration
 
         im0 = self.imgs.copy()
-        if self.transforms:
+        if self.motion:
+            self.motion_masks = [self.motion(i, x) for i, x in enumerate(im0)]
+        if not self.preprocess:
+            im = None
+        elif self.transforms:
             im = np.stack([self.transforms(x) for x in im0])  # transforms
         else:
             im = np.stack([LetterBox(self.imgsz, self.auto, stride=self.stride)(image=x) for x in im0])
@@ -104,6 +166,120 @@ class LoadStreams:
         return len(self.sources)  # 1E12 frames = 32 streams at 30 FPS for 30 years
 
 
+class StreamScheduler(LoadStreams):
+    """
+    Dynamic batching of many camera streams with differing frame rates. Every stream thread queues its frames with a
+    capture timestamp; a batch holds at most one frame per stream, the latest one, and is dispatched once `max_batch`
+    streams have a frame waiting or the oldest waiting frame has waited `max_wait` seconds. When more streams are
+    waiting than fit in a batch, the ones closest to their latency objective go first, streams without motion (when a
+    MotionDetector is given) are deferred by one objective.
+
+    Attributes:
+        max_batch (int): maximum number of frames per batch.
+        max_wait (float): maximum time in seconds the oldest frame waits for the batch to fill.
+        slo (list): latency objective in seconds per stream.
+        batch_ids (list): stream index of every frame of the last batch.
+        latency (list): deques of the latest capture to results latencies per stream, in seconds.
+        dropped (list): number of frames per stream replaced by a newer one before being batched.
+    """
+
+    def __init__(self,
+                 sources='file.streams',
+                 imgsz=640,
+                 stride=32,
+                 auto=True,
+                 transforms=None,
+                 vid_stride=1,
+                 motion=None,
+                 preprocess=True,
+                 max_batch=8,
+                 max_wait=0.01,
+                 slo=0.1):
+        n = len(Path(sources).read_text().rsplit()) if os.path.isfile(sources) else 1
+        self.cond = Condition()
+        self.queues = [deque(maxlen=1) for _ in range(n)]  # latest (capture time, frame) per stream
+        self.dropped = [0] * n
+        super().__init__(sources, imgsz, stride, auto, transforms, vid_stride, motion, preprocess)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.slo = [slo] if isinstance(slo, (int, float)) else list(slo)
+        self.slo += self.slo[-1:] * (n - len(self.slo))
+        self.batch_ids, self.batch_ts = [], []
+        self.latency = [deque(maxlen=1000) for _ in range(n)]
+
+    def update(self, i, cap, stream):
+        # Read stream `i` frames in daemon thread and queue them with their capture time
+        n, f = 0, self.frames[i]  # frame number, frame array
+        while cap.isOpened() and n < f:
+            n += 1
+            cap.grab()  # .read() = .grab() followed by .retrieve()
+            if n % self.vid_stride == 0:
+                success, im = cap.retrieve()
+                if not success:
+                    LOGGER.warning('WARNING ⚠️ Video stream unresponsive, please check your IP camera connection.')
+                    im = np.zeros_like(self.imgs[i])
+                    cap.open(stream)  # re-open stream if signal was lost
+                with self.cond:
+                    self.dropped[i] += len(self.queues[i])  # replaced before being batched
+                    self.queues[i].append((time.time(), im))
+                    self.cond.notify()
+            time.sleep(0.0)  # wait time
+
+    def __next__(self):
+        self.count += 1
+        if not any(x.is_alive() for x in self.threads) or cv2.waitKey(1) == ord('q'):  # q to quit
+            cv2.destroyAllWindows()
+            raise StopIteration
+
+        with self.cond:
+            while not any(self.queues):
+                self.cond.wait(0.1)
+                if not any(x.is_alive() for x in self.threads):
+                    raise StopIteration
+            oldest = min(q[0][0] for q in self.queues if q)
+            while sum(map(bool, self.queues)) < min(self.max_batch, len(self.queues)) and \
+                    time.time() < oldest + self.max_wait:
+                self.cond.wait(oldest + self.max_wait - time.time())
+            waiting = [(i, *q.pop()) for i, q in enumerate(self.queues) if q]
+
+        masks = [self.motion(i, im) for i, _, im in waiting] if self.motion else None
+        deadline = [ts + self.slo[i] * (1 if masks is None or masks[k].any() else 2) for k, (i, ts, _) in
+                    enumerate(waiting)]
+        order = sorted(range(len(waiting)), key=deadline.__getitem__)
+        if len(order) > self.max_batch:  # requeue what doesn't fit unless a newer frame arrived meanwhile
+            with self.cond:
+                for k in order[self.max_batch:]:
+                    i, ts, im = waiting[k]
+                    if not self.queues[i]:
+                        self.queues[i].append((ts, im))
+        order = sorted(order[:self.max_batch], key=lambda k: waiting[k][0])  # stream order within the batch
+        self.batch_ids = [waiting[k][0] for k in order]
+        self.batch_ts = [waiting[k][1] for k in order]
+        self.motion_masks = [masks[k] for k in order] if masks else None
+
+        im0 = [waiting[k][2] for k in order]
+        if not self.preprocess:
+            im = None
+        elif self.transforms:
+            im = np.stack([self.transforms(x) for x in im0])  # transforms
+        else:
+            im = np.stack([LetterBox(self.imgsz, self.auto, stride=self.stride)(image=x) for x in im0])
+            im = im[..., ::-1].transpose((0, 3, 1, 2))  # BGR to RGB, BHWC to BCHW
+            im = np.ascontiguousarray(im)  # contiguous
+
+        return [self.sources[i] for i in self.batch_ids], im, im0, None, ''
+
+    def done(self, batch_ids, batch_ts):
+        """Records the latency of a batch whose results are out."""
+        now = time.time()
+        for i, ts in zip(batch_ids, batch_ts):
+            self.latency[i].append(now - ts)
+
+    def latency_stats(self):
+        """Returns the (p50, p99) capture to results latency in seconds of every stream."""
+        return [tuple(np.percentile(x, (50, 99))) if x else (0.0, 0.0) for x in self.latency]
+
+
 class LoadScreenshots:
     # YOLOv5 screenshot dataloader, i.e. `python detect.py --source "screen 0 100 100 512 256"`
     def __init__(self, source, imgsz=640, stride=32, auto=True, transforms=None):
@@ -155,7 +331,8 @@ class LoadScreenshots:
 
 class LoadImages:
     # YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
-    def __init__(self, path, imgsz=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self, path, imgsz=640, stride=32, auto=True, transforms=None, vid_stride=1, motion=None,
+                 preprocess=True):
         if isinstance(path, str) and Path(path).suffix == ".txt":  # *.txt file with img/vid/dir on each line
             path = Path(path).read_text().rsplit()
         files = []
@@ -183,6 +360,9 @@ class LoadImages:
         self.auto = auto
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.motion = motion  # optional MotionDetector, videos only
+        self.preprocess = preprocess  # letterbox on the CPU, else im is None and the predictor does it on device
+        self.motion_masks = None
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -217,6 +397,8 @@ class LoadImages:
             self.frame += 1
             # im0 = self._cv2_rotate(im0)  # for use if cv2 autorotation is False
             s = f'video {self.count + 1}/{self.nf} ({self.frame}/{self.frames}) {path}: '
+            if self.motion:
+                self.motion_masks = [self.motion(0, im0)]
 
         else:
             # Read image
@@ -224,8 +406,11 @@ class LoadImages:
             im0 = cv2.imread(path)  # BGR
             assert im0 is not None, f'Image Not Found {path}'
             s = f'image {self.count}/{self.nf} {path}: '
+            self.motion_masks = None
 
-        if self.transforms:
+        if not self.preprocess:
+            im = None
+        elif self.transforms:
             im = self.transforms(im0)  # transforms
         else:
             im = LetterBox(self.imgsz, self.auto, stride=self.stride)(image=im0)
@@ -237,6 +422,8 @@ class LoadImages:
     def _new_video(self, path):
         # Create a new video capture object
         self.frame = 0
+        if self.motion:
+            self.motion.reset()
         self.cap = cv2.VideoCapture(path)
         self.frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) / self.vid_stride)
         self.orientation = int(self.cap.get(cv2.CAP_PROP_ORIENTATION_META))  # rotation degrees
@@ -4,17 +4,19 @@ from itertools import repeat
 from multiprocessing.pool import Pool
 from pathlib import Path
 
+import torch.nn.functional as F
 import torchvision
 from tqdm import tqdm
 
 from ..utils import NUM_THREADS, TQDM_BAR_FORMAT
 from .augment import *
 from .base import BaseDataset
-from .utils import HELP_URL, LOCAL_RANK, get_hash, img2label_paths, verify_image_label
+from .labels import LabelStore, join_strings, split_strings
+from .utils import HELP_URL, LOCAL_RANK, file_stats, img2label_paths, verify_image_label
 
 
 class YOLODataset(BaseDataset):
-    cache_version = 1.0  # dataset labels *.cache version, >= 1.0 for YOLOv8
+    cache_version = 1.1  # dataset labels *.cache version, >= 1.0 for YOLOv8, >= 1.1 columnar
     rand_interp_methods = [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_LANCZOS4]
     """YOLO Dataset.
     Args:
@@ -46,86 +48,139 @@ class YOLODataset(BaseDataset):
                          single_cls)
 
     def cache_labels(self, path=Path("./labels.cache")):
-        # Cache dataset labels, check images and read shapes
-        x = {"labels": []}
-        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
+        """
+        Cache dataset labels, check images and read shapes. Image/label pairs whose files have the same size, mtime and
+        inode as in the existing cache are reused, only new or modified pairs are verified.
+
+        Returns:
+            (LabelStore): labels of all images, in order, with per image 'stats' and 'counts' (nm, nf, ne, nc).
+            (dict): warnings by image index.
+            (bool): whether nothing had to be verified.
+        """
+        n = len(self.im_files)
+        stats = np.concatenate((file_stats(self.im_files), file_stats(self.label_files)), 1)  # (n, 6)
+        old, old_msgs = self.load_label_cache(path)
+        idx = np.full(n, -1, dtype=np.int64)  # row of every image in the old cache, -1 to verify
+        if old is not None:
+            rows = {f: i for i, f in enumerate(old.im_files)}
+            idx = np.array([rows.get(f, -1) for f in self.im_files], dtype=np.int64)
+            found = idx >= 0
+            found[found] = (old.images["stats"][idx[found]] == stats[found]).all(1)
+            idx[~found] = -1
+        todo = np.flatnonzero(idx < 0)
+
+        empty = np.zeros((0, 5), dtype=np.float32)
+        files, shapes, lbs, segments, keypoints, counts, msgs = [], [], [], [], [], [], {}
+        nm, nf, ne, nc = old.images["counts"][idx[idx >= 0]].sum(0) if old is not None else (0, 0, 0, 0)
         desc = f"{self.prefix}Scanning {path.parent / path.stem}..."
-        with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(
-                pool.imap(verify_image_label,
-                          zip(self.im_files, self.label_files, repeat(self.prefix), repeat(self.use_keypoints))),
-                desc=desc,
-                total=len(self.im_files),
-                bar_format=TQDM_BAR_FORMAT,
-            )
-            for im_file, lb, shape, segments, keypoint, nm_f, nf_f, ne_f, nc_f, msg in pbar:
-                nm += nm_f
-                nf += nf_f
-                ne += ne_f
-                nc += nc_f
-                if im_file:
-                    x["labels"].append(
-                        dict(
-                            im_file=im_file,
-                            shape=shape,
-                            cls=lb[:, 0:1],  # n, 1
-                            bboxes=lb[:, 1:],  # n, 4
-                            segments=segments,
-                            keypoints=keypoint,
-                            normalized=True,
-                            bbox_format="xywh",
-                        ))
-                if msg:
-                    msgs.append(msg)
-                pbar.desc = f"{desc} {nf} images, {nm + ne} backgrounds, {nc} corrupt"
-
-        pbar.close()
-        if msgs:
-            LOGGER.info("\n".join(msgs))
+        if len(todo):
+            with Pool(NUM_THREADS) as pool:
+                pbar = tqdm(
+                    pool.imap(verify_image_label,
+                              zip([self.im_files[i] for i in todo], [self.label_files[i] for i in todo],
+                                  repeat(self.prefix), repeat(self.use_keypoints))),
+                    desc=desc,
+                    total=len(todo),
+                    bar_format=TQDM_BAR_FORMAT,
+                )
+                for i, (im_file, lb, shape, segment, keypoint, nm_f, nf_f, ne_f, nc_f, msg) in zip(todo, pbar):
+                    nm += nm_f
+                    nf += nf_f
+                    ne += ne_f
+                    nc += nc_f
+                    if not im_file:  # corrupt, cached as such until the files change
+                        lb, shape, segment, keypoint = empty, (0, 0), [], np.zeros((0, 17, 2), dtype=np.float32)
+                    files.append(self.im_files[i])
+                    shapes.append(shape)
+                    lbs.append(lb)
+                    segments.append(segment)
+                    keypoints.append(keypoint)
+                    counts.append((nm_f, nf_f, ne_f, nc_f))
+                    if msg:
+                        msgs[i] = msg
+                    pbar.desc = f"{desc} {nf} images, {nm + ne} backgrounds, {nc} corrupt"
+            pbar.close()
+            if msgs:
+                LOGGER.info("\n".join(msgs.values()))
+
+        new = LabelStore.from_records(files,
+                                      shapes,
+                                      lbs,
+                                      segments,
+                                      keypoints if self.use_keypoints else None,
+                                      stats=stats[todo],
+                                      counts=np.array(counts, dtype=np.int8).reshape(-1, 4))
+        if old is None:
+            labels = new
+        else:  # reused rows then verified rows, back in image order
+            kept = np.flatnonzero(idx >= 0)
+            labels = LabelStore.concatenate([old.take(idx[kept]), new]).take(np.argsort(np.concatenate((kept, todo))))
+            msgs.update({int(i): old_msgs[int(j)] for i, j in zip(kept, idx[kept]) if int(j) in old_msgs})
         if nf == 0:
             LOGGER.warning(f"{self.prefix}WARNING ⚠️ No labels found in {path}. {HELP_URL}")
-        x["hash"] = get_hash(self.label_files + self.im_files)
-        x["results"] = nf, nm, ne, nc, len(self.im_files)
-        x["msgs"] = msgs  # warnings
-        x["version"] = self.cache_version  # cache version
+        if old is None or len(todo) or len(old) != n:
+            self.save_label_cache(path, labels, msgs)
+        return labels, msgs, old is not None and not len(todo)
+
+    def load_label_cache(self, path):
+        # Returns the labels and warnings of an existing cache, or None, {} if it can't be used
+        try:
+            with open(path, "rb") as f:
+                labels, meta = LabelStore.load(f)
+            assert meta["version"] == self.cache_version  # matches current version
+            assert meta["use_keypoints"] == self.use_keypoints
+            return labels, dict(zip(meta["msg_ids"].tolist(), split_strings(meta["msgs"], len(meta["msg_ids"]))))
+        except Exception:
+            return None, {}
+
+    def save_label_cache(self, path, labels, msgs):
         try:
-            np.save(path, x)  # save cache for next time
-            path.with_suffix(".cache.npy").rename(path)  # remove .npy suffix
+            with open(path.with_suffix(".cache.tmp"), "wb") as f:
+                labels.save(f,
+                            version=self.cache_version,
+                            use_keypoints=self.use_keypoints,
+                            msg_ids=np.array(list(msgs), dtype=np.int64),
+                            msgs=join_strings(msgs.values()))
+            path.with_suffix(".cache.tmp").replace(path)
             LOGGER.info(f"{self.prefix}New cache created: {path}")
         except Exception as e:
             LOGGER.warning(
                 f"{self.prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable: {e}")  # not writeable
-        return x
 
     def get_labels(self):
         self.label_files = img2label_paths(self.im_files)
         cache_path = Path(self.label_files[0]).parent.with_suffix(".cache")
-        try:
-            cache, exists = np.load(str(cache_path), allow_pickle=True).item(), True  # load dict
-            assert cache["version"] == self.cache_version  # matches current version
-            assert cache["hash"] == get_hash(self.label_files + self.im_files)  # identical hash
-        except Exception:
-            cache, exists = self.cache_labels(cache_path), False  # run cache ops
+        labels, msgs, exists = self.cache_labels(cache_path)
 
         # Display cache
-        nf, nm, ne, nc, n = cache.pop("results")  # found, missing, empty, corrupt, total
+        nm, nf, ne, nc = labels.images["counts"].sum(0)  # missing, found, empty, corrupt
+        n = len(labels)
         if exists and LOCAL_RANK in {-1, 0}:
             d = f"Scanning {cache_path}... {nf} images, {nm + ne} backgrounds, {nc} corrupt"
             tqdm(None, desc=self.prefix + d, total=n, initial=n, bar_format=TQDM_BAR_FORMAT)  # display cache results
-            if cache["msgs"]:
-                LOGGER.info("\n".join(cache["msgs"]))  # display warnings
+            if msgs:
+                LOGGER.info("\n".join(msgs.values()))  # display warnings
         assert nf > 0, f"{self.prefix}No labels found in {cache_path}, can not start training. {HELP_URL}"
 
-        # Read cache
-        [cache.pop(k) for k in ("hash", "version", "msgs")]  # remove items
-        labels = cache["labels"]
-        nl = len(np.concatenate([label["cls"] for label in labels], 0))  # number of labels
+        # Read cache, without the corrupt images
+        labels = labels.take(np.flatnonzero(labels.images["counts"][:, 3] == 0))
+        self.im_files = labels.im_files
+        self.label_files = img2label_paths(self.im_files)
+        nl = len(labels.instances["cls"])  # number of labels
         assert nl > 0, f"{self.prefix}All labels empty in {cache_path}, can not start training. {HELP_URL}"
         return labels
 
     # TODO: use hyp config to set all these augmentations
     def build_transforms(self, hyp=None):
-        if self.augment:
+        self.batch_transforms = None  # applied to collated batches on the training device
+        if self.augment and hyp.get("batch_augment", False):  # workers only decode, rect batches are letterboxed
+            self.batch_transforms = BatchAugment(self.imgsz,
+                                                 hyp,
+                                                 rect=self.rect,
+                                                 use_segments=self.use_segments,
+                                                 use_keypoints=self.use_keypoints)
+            transforms = Compose([LetterBox(new_shape=(self.imgsz, self.imgsz))] if self.rect else [])
+        elif self.augment:
             mosaic = self.augment and not self.rect
             transforms = mosaic_transforms(self, self.imgsz, hyp) if mosaic else affine_transforms(self.imgsz, hyp)
         else:
@@ -133,12 +188,16 @@ class YOLODataset(BaseDataset):
         transforms.append(
             Format(bbox_format="xywh",
                    normalize=True,
-                   return_mask=self.use_segments,
+                   return_mask=self.use_segments and self.batch_transforms is None,
                    return_keypoint=self.use_keypoints,
-                   batch_idx=True))
+                   batch_idx=True,
+                   return_segments=self.use_segments and self.batch_transforms is not None))
         return transforms
 
     def close_mosaic(self, hyp):
+        if self.batch_transforms:
+            self.batch_transforms.close_mosaic()
+            return
         self.transforms = affine_transforms(self.imgsz, hyp)
         self.transforms.append(
             Format(bbox_format="xywh",
@@ -169,8 +228,11 @@ class YOLODataset(BaseDataset):
         for i, k in enumerate(keys):
             value = values[i]
             if k == "img":
+                h, w = max(x.shape[1] for x in value), max(x.shape[2] for x in value)
+                if any(x.shape[1:] != (h, w) for x in value):  # unpadded images for BatchAugment, pad bottom right
+                    value = [F.pad(x, (0, w - x.shape[2], 0, h - x.shape[1]), value=114) for x in value]
                 value = torch.stack(value, 0)
-            if k in ["masks", "keypoints", "bboxes", "cls"]:
+            if k in ["masks", "keypoints", "bboxes", "cls", "segments"]:
                 value = torch.cat(value, 0)
             new_batch[k] = value
         new_batch["batch_idx"] = list(new_batch["batch_idx"])
@@ -0,0 +1,169 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+"""
+Columnar dataset labels, the instances of all images concatenated in flat arrays indexed by per image offsets
+"""
+
+import numpy as np
+
+
+def ragged_index(offsets, idx):
+    """
+    Gathers groups of a ragged array.
+
+    Args:
+        offsets (np.ndarray): (n + 1,) start of every group in the flat array, and its total length.
+        idx (np.ndarray): indices of the groups to gather.
+
+    Returns:
+        (np.ndarray): indices in the flat array of the rows of the gathered groups, in order.
+        (np.ndarray): (len(idx) + 1,) offsets of the gathered groups.
+    """
+    idx = np.asarray(idx, dtype=np.int64)
+    lengths = offsets[idx + 1] - offsets[idx]
+    new_offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    return np.arange(new_offsets[-1]) + np.repeat(offsets[idx] - new_offsets[:-1], lengths), new_offsets
+
+
+def join_strings(strings):
+    # Packs strings into a uint8 array, one per line
+    return np.frombuffer('\n'.join(s.replace('\n', ' ') for s in strings).encode(), dtype=np.uint8)
+
+
+def split_strings(x, n):
+    # Unpacks n strings packed by join_strings()
+    return x.tobytes().decode().split('\n') if n else []
+
+
+class LabelStore:
+    """
+    Labels of a dataset stored column-wise.
+
+    Per image arrays have one row per image. Instance arrays have one row per instance, the instances of image i are
+    rows offsets[i]:offsets[i + 1]. Segment points are likewise concatenated, the points of instance j are rows
+    point_offsets[j]:point_offsets[j + 1], and images without segments have zero points for all of their instances.
+
+    Attributes:
+        im_files (list): image files.
+        images (dict): per image arrays, at least 'shape' (n, 2) hw.
+        instances (dict): per instance arrays, 'cls' (N, 1), 'bboxes' (N, 4) xywh normalized and 'keypoints'
+            (N, 17, 2) for keypoint datasets.
+        offsets (np.ndarray): (n + 1,) instance offsets of every image.
+        points (np.ndarray): (P, 2) segment points.
+        point_offsets (np.ndarray): (N + 1,) point offsets of every instance.
+    """
+
+    def __init__(self, im_files, images, instances, offsets, points, point_offsets):
+        self.im_files = im_files
+        self.images = images
+        self.instances = instances
+        self.offsets = offsets
+        self.points = points
+        self.point_offsets = point_offsets
+
+    @classmethod
+    def from_records(cls, im_files, shapes, lbs, segments, keypoints=None, **images):
+        """
+        Builds a store from per image records, as returned by verify_image_label().
+
+        Args:
+            im_files (list): image files.
+            shapes (list): hw of every image.
+            lbs (list): (n, 5) cls, xywh labels of every image.
+            segments (list): list of (m, 2) polygons of every image, empty if the image has no segments.
+            keypoints (list, optional): (n, 17, 2) keypoints of every image.
+            **images: other per image arrays.
+        """
+        n = len(im_files)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(lb) for lb in lbs], out=offsets[1:])
+        lb = np.concatenate(lbs, 0) if n else np.zeros((0, 5), dtype=np.float32)
+        instances = {'cls': lb[:, 0:1], 'bboxes': lb[:, 1:]}
+        if keypoints is not None:
+            instances['keypoints'] = np.concatenate(keypoints, 0) if n else np.zeros((0, 17, 2), dtype=np.float32)
+        counts = np.zeros(len(lb), dtype=np.int64)
+        polygons = []
+        for i, s in enumerate(segments):
+            if len(s):
+                counts[offsets[i]:offsets[i + 1]] = [len(x) for x in s]
+                polygons += s
+        point_offsets = np.zeros(len(lb) + 1, dtype=np.int64)
+        np.cumsum(counts, out=point_offsets[1:])
+        points = np.concatenate(polygons, 0).astype(np.float32) if polygons else np.zeros((0, 2), dtype=np.float32)
+        images = {'shape': np.array(shapes, dtype=np.int64).reshape(n, 2), **images}
+        return cls(list(im_files), images, instances, offsets, points, point_offsets)
+
+    def __len__(self):
+        return len(self.im_files)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, i):
+        # Returns the labels of image i as a dict of views into the store
+        a, b = self.offsets[i], self.offsets[i + 1]
+        p = self.point_offsets[a:b + 1]
+        keypoints = self.instances.get('keypoints')
+        return dict(
+            im_file=self.im_files[i],
+            shape=tuple(self.images['shape'][i]),
+            cls=self.instances['cls'][a:b],  # n, 1
+            bboxes=self.instances['bboxes'][a:b],  # n, 4
+            segments=[self.points[p[j]:p[j + 1]] for j in range(b - a)] if b > a and p[-1] > p[0] else [],
+            keypoints=None if keypoints is None else keypoints[a:b],
+            normalized=True,
+            bbox_format="xywh",
+        )
+
+    def take(self, idx):
+        # Returns a new store of the images idx, in order
+        idx = np.asarray(idx, dtype=np.int64)
+        rows, offsets = ragged_index(self.offsets, idx)
+        point_rows, point_offsets = ragged_index(self.point_offsets, rows)
+        return LabelStore([self.im_files[i] for i in idx], {k: v[idx] for k, v in self.images.items()},
+                          {k: v[rows] for k, v in self.instances.items()}, offsets, self.points[point_rows],
+                          point_offsets)
+
+    def filter(self, keep):
+        # Returns a new store with the instances for which the (N,) bool array keep is True
+        image = np.repeat(np.arange(len(self)), np.diff(self.offsets))  # image of every instance
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(image[keep], minlength=len(self)), out=offsets[1:])
+        point_rows, point_offsets = ragged_index(self.point_offsets, np.flatnonzero(keep))
+        return LabelStore(self.im_files, self.images, {k: v[keep] for k, v in self.instances.items()}, offsets,
+                          self.points[point_rows], point_offsets)
+
+    @staticmethod
+    def concatenate(stores):
+        # Returns a new store of the images of all stores, in order
+        def cat_offsets(offsets):
+            starts = np.cumsum([0] + [o[-1] for o in offsets[:-1]])
+            return np.concatenate([offsets[0][:1]] + [o[1:] + s for o, s in zip(offsets, starts)])
+
+        return LabelStore(sum((s.im_files for s in stores), []),
+                          {k: np.concatenate([s.images[k] for s in stores]) for k in stores[0].images},
+                          {k: np.concatenate([s.instances[k] for s in stores]) for k in stores[0].instances},
+                          cat_offsets([s.offsets for s in stores]), np.concatenate([s.points for s in stores]),
+                          cat_offsets([s.point_offsets for s in stores]))
+
+    def save(self, f, **meta):
+        # Saves the store and metadata arrays to an open file, without pickling
+        np.savez(f,
+                 im_files=join_strings(self.im_files),
+                 offsets=self.offsets,
+                 points=self.points,
+                 point_offsets=self.point_offsets,
+                 **{f'images/{k}': v for k, v in self.images.items()},
+                 **{f'instances/{k}': v for k, v in self.instances.items()},
+                 **meta)
+
+    @classmethod
+    def load(cls, file):
+        # Loads a store saved by save(), returns it and the metadata arrays
+        with np.load(file, allow_pickle=False) as x:
+            x = dict(x)
+        images = {k.split('/', 1)[1]: x.pop(k) for k in list(x) if k.startswith('images/')}
+        instances = {k.split('/', 1)[1]: x.pop(k) for k in list(x) if k.startswith('instances/')}
+        im_files = split_strings(x.pop('im_files'), len(images['shape']))
+        store = cls(im_files, images, instances, x.pop('offsets'), x.pop('points'), x.pop('point_offsets'))
+        return store, x
@@ -0,0 +1,126 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+"""
+Packed image store, pre-resized images in one memory-mapped file shared by all dataloader workers
+
+Usage - build ahead of training, in parallel:
+    $ python -m ultralytics.yolo.data.packed path/to/images --imgsz 640
+"""
+
+import argparse
+import os
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from ..utils import LOGGER, NUM_THREADS, TQDM_BAR_FORMAT
+from .utils import LOCAL_RANK, get_hash
+
+
+class PackedImages:
+    """
+    Read-only store of uint8 HWC images concatenated in one file, with an index of their offsets and shapes.
+
+    Images are returned as zero-copy views of a memory map, so that workers share them through the OS page cache
+    instead of each holding a copy. The map is opened lazily and not pickled, workers started with spawn reopen it.
+
+    Attributes:
+        path (Path): packed images file, the index is stored next to it as <path>.npz.
+        offsets (np.ndarray): (n,) byte offset of every image.
+        shapes (np.ndarray): (n, 3) resized shape of every image.
+        hw0 (np.ndarray): (n, 2) original height and width of every image.
+    """
+    version = 1
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with np.load(self.index_file(self.path)) as x:
+            self.offsets, self.shapes, self.hw0, self.hash = x['offsets'], x['shapes'], x['hw0'], str(x['hash'])
+        self.data = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        # Returns image i, its original and its resized hw
+        if self.data is None:
+            self.data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        shape = tuple(self.shapes[i])
+        im = self.data[self.offsets[i]:self.offsets[i] + np.prod(shape)].reshape(shape)
+        return im, tuple(self.hw0[i]), shape[:2]
+
+    def __getstate__(self):
+        return {**self.__dict__, 'data': None}  # never pickle the mapped images
+
+    @staticmethod
+    def index_file(path):
+        return Path(f'{path}.npz')
+
+    @classmethod
+    def load(cls, path, files):
+        # Returns the store at path if it was built from these files, else None
+        try:
+            store = cls(path)
+            assert store.hash == f'{cls.version}-{get_hash(files)}' and len(store) == len(files)
+            return store
+        except Exception:
+            return None
+
+    @classmethod
+    def build(cls, path, files, read, workers=NUM_THREADS, prefix=''):
+        """
+        Packs images into a new store, reading them in parallel.
+
+        Args:
+            path (str | Path): packed images file to write.
+            files (list): image files, store index i holds files[i].
+            read (callable): read(i) returns image i resized as it should be stored, and its original hw.
+            workers (int): number of reading threads.
+            prefix (str): log prefix.
+
+        Returns:
+            (PackedImages): the store.
+        """
+        path = Path(path)
+        n = len(files)
+        offsets, shapes, hw0 = np.zeros(n, dtype=np.int64), np.zeros((n, 3), dtype=np.int64), np.zeros((n, 2), int)
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        offset = 0
+        with open(tmp, 'wb') as f, ThreadPool(workers) as pool:
+            pbar = tqdm(pool.imap(read, range(n)), total=n, bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
+            for i, (im, h0w0) in enumerate(pbar):
+                im = im if im.ndim == 3 else im[..., None]
+                f.write(np.ascontiguousarray(im).data)
+                offsets[i], shapes[i], hw0[i] = offset, im.shape, h0w0
+                offset += im.nbytes
+                if i % 100 == 0:
+                    pbar.desc = f'{prefix}Packing images ({offset / 1E9:.1f}GB)'
+            pbar.close()
+        index = cls.index_file(tmp)
+        with open(index, 'wb') as f:
+            np.savez(f, offsets=offsets, shapes=shapes, hw0=hw0, hash=f'{cls.version}-{get_hash(files)}')
+        tmp.replace(path)
+        index.replace(cls.index_file(path))  # written last, a store without a valid index is rebuilt
+        LOGGER.info(f'{prefix}Packed {n} images into {path} ({offset / 1E9:.1f}GB)')
+        return cls(path)
+
+
+def main():
+    from .base import BaseDataset
+
+    parser = argparse.ArgumentParser(description='Pack a directory or list of images for cache=mmap training')
+    parser.add_argument('img_path', type=str, help='images directory or *.txt list of images')
+    parser.add_argument('--imgsz', type=int, default=640, help='train image size')
+    parser.add_argument('--val', action='store_true', help='pack for validation, which resizes with INTER_AREA')
+    parser.add_argument('--workers', type=int, default=NUM_THREADS, help='number of reading threads')
+    opt = parser.parse_args()
+
+    dataset = BaseDataset.__new__(BaseDataset)  # only the image reading attributes are needed
+    dataset.imgsz, dataset.augment, dataset.prefix = opt.imgsz, not opt.val, ''
+    dataset.im_files = dataset.get_img_files(opt.img_path)
+    dataset.cache_images_to_pack(workers=opt.workers)
+
+
+if __name__ == '__main__':
+    main()
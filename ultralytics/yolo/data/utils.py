@@ -50,6 +50,16 @@ def get_hash(paths):
     return h.hexdigest()  # return hash
 
 
+def file_stats(files):
+    # Returns the (size, mtime_ns, inode) of every file, -1 for missing files
+    stats = np.full((len(files), 3), -1, dtype=np.int64)
+    for i, f in enumerate(files):
+        with contextlib.suppress(OSError):
+            st = os.stat(f)
+            stats[i] = st.st_size, st.st_mtime_ns, st.st_ino
+    return stats
+
+
 def exif_size(img):
     # Returns exif-corrected PIL size
     s = img.size  # (width, height)
@@ -191,6 +201,65 @@ def polygons2masks_overlap(imgsz, segments, downsample_ratio=1):
     return masks, index
 
 
+def polygons2masks_batch(segments, imgsz, downsample_ratio=1):
+    """
+    Rasterises polygons on their device, a mask pixel is set if its centre is inside the polygon (even-odd rule).
+
+    Every polygon edge toggles the pixels right of where it crosses each row centre, and a cumulative sum along the
+    rows fills the insides, so the cost grows with the polygon heights rather than their areas.
+
+    Args:
+        segments (torch.Tensor): (n, m, 2) closed polygons in pixels.
+        imgsz (tuple): image hw.
+        downsample_ratio (int): mask downsample ratio.
+
+    Returns:
+        (torch.Tensor): (n, h // downsample_ratio, w // downsample_ratio) uint8 masks.
+    """
+    n, m = segments.shape[:2]
+    h, w = imgsz[0] // downsample_ratio, imgsz[1] // downsample_ratio
+    x0, y0 = (segments.float() / downsample_ratio - 0.5).reshape(-1, 2).unbind(1)  # pixel centres at integers
+    x1, y1 = x0.view(n, m).roll(-1, 1).view(-1), y0.view(n, m).roll(-1, 1).view(-1)  # edge ends
+    lo = torch.minimum(y0, y1).ceil().clamp(0, h)  # edges cross rows lo <= y < hi
+    rows = (torch.maximum(y0, y1).ceil().clamp(0, h) - lo).long()
+    edge = torch.arange(n * m, device=segments.device).repeat_interleave(rows)
+    y = lo[edge] + torch.arange(len(edge), device=segments.device) - (rows.cumsum(0) - rows)[edge]
+    x = x0[edge] + (y - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    x = x.ceil().clamp(0, w).long()  # first pixel right of the crossing
+    toggles = torch.zeros(n * h * (w + 1), dtype=torch.uint8, device=segments.device)  # counts wrap, parity holds
+    toggles.index_put_(((edge // m * h + y.long()) * (w + 1) + x,), toggles.new_ones(()), accumulate=True)
+    return toggles.view(n, h, w + 1).cumsum(2, dtype=torch.uint8)[..., :w] & 1
+
+
+def masks2overlap(masks, batch_idx, n):
+    """
+    Merges instance masks into one mask per image, whose pixels index their smallest instance of the image.
+
+    Args:
+        masks (torch.Tensor): (N, h, w) uint8 instance masks.
+        batch_idx (torch.Tensor): (N,) image of every instance, in [0, n) and sorted.
+        n (int): number of images.
+
+    Returns:
+        (torch.Tensor): (n, h, w) overlap masks, pixel value i is the i-th largest instance of its image, 0 is none.
+        (torch.Tensor): (N,) order of the instances, by image and decreasing mask area, that the pixel values follow.
+    """
+    area = masks.view(len(masks), -1).sum(1, dtype=torch.int32).long()
+    key = batch_idx * (area.max() + 1 if len(area) else 1) - area
+    order = (key * len(key) + torch.arange(len(key), device=masks.device)).argsort()  # ties keep their order
+    counts = torch.bincount(batch_idx, minlength=n)
+    rank = torch.empty_like(order)  # 1-based position of every instance in the order of its image
+    rank[order] = torch.arange(len(order), device=masks.device) - (counts.cumsum(0) - counts)[batch_idx[order]] + 1
+    overlap = torch.zeros(n, *masks.shape[1:], device=masks.device,
+                          dtype=torch.int32 if len(batch_idx) and counts.max() > 255 else torch.uint8)
+    rank = rank.view(-1, 1, 1).to(overlap.dtype)
+    end = counts.cumsum(0).tolist()
+    for j in counts.nonzero()[:, 0].tolist():
+        a, b = end[j - 1] if j else 0, end[j]
+        overlap[j] = (masks[a:b] * rank[a:b]).amax(0)
+    return overlap, order
+
+
 def check_dataset_yaml(data, autodownload=True):
     # Download, check and/or unzip dataset if not found locally
     data = check_file(data)
@@ -26,19 +26,24 @@ Usage - formats:
                                     yolov8n_paddle_model       # PaddlePaddle
     """
 import platform
+import time
 from collections import defaultdict
 from pathlib import Path
 
 import cv2
+import numpy as np
+import torch
 
 from ultralytics.nn.autobackend import AutoBackend
 from ultralytics.yolo.configs import get_config
-from ultralytics.yolo.data.dataloaders.stream_loaders import LoadImages, LoadScreenshots, LoadStreams
+from ultralytics.yolo.data.dataloaders.stream_loaders import (LoadImages, LoadScreenshots, LoadStreams,
+                                                              MotionDetector, StreamScheduler)
 from ultralytics.yolo.data.utils import IMG_FORMATS, VID_FORMATS
 from ultralytics.yolo.utils import DEFAULT_CONFIG, LOGGER, SETTINGS, callbacks, colorstr, ops
 from ultralytics.yolo.utils.checks import check_file, check_imgsz, check_imshow
 from ultralytics.yolo.utils.files import increment_path
-from ultralytics.yolo.utils.torch_utils import select_device, smart_inference_mode
+from ultralytics.yolo.utils.tiling import Tiler
+from ultralytics.yolo.utils.torch_utils import HostToDevice, select_device, smart_inference_mode
 
 
 class BasePredictor:
@@ -61,6 +66,9 @@ class BasePredictor:
         data_path (str): Path to data.
     """
 
+    # loader attributes that describe the last batch
+    BATCH_STATE = ('count', 'frame', 'mode', 'motion_masks', 'batch_ids', 'batch_ts')
+
     def __init__(self, config=DEFAULT_CONFIG, overrides=None):
         """
         Initializes the BasePredictor class.
@@ -89,12 +97,35 @@ class BasePredictor:
         self.vid_path, self.vid_writer = None, None
         self.annotator = None
         self.data_path = None
+        self.roi_masks = {}  # rasterised roi per (stream, input shape or None at frame resolution, image shape)
+        self.tiler = None
+        self.static = False  # the current batch is a static scene, predictions are held from the last inference
+        self.held = None
+        self.device_preprocess = False
+        self.transfer = None  # HostToDevice, CUDA only
+        self.batch_state = {}
+        self.im0_gpu = None  # frames of the batch on device, when preprocessed there
+        self.streams, self.stream = [], 0  # stream index of every image of the batch, of the image being written
+        self.t_start = None  # time setup started, for the time to first frame
         self.callbacks = defaultdict(list, {k: [v] for k, v in callbacks.default_callbacks.items()})  # add callbacks
         callbacks.add_integration_callbacks(self)
 
     def preprocess(self, img):
         pass
 
+    def preprocess_frames(self, im0s, upload=None):
+        """
+        Uploads the raw uint8 frames once, unless `upload` already did, and letterboxes them on the device. The uploaded
+        HWC BGR frames are kept in `im0_gpu` for mask plotting and reid crops.
+        """
+        self.im0_gpu = self.transfer.ready(upload) if upload else [torch.from_numpy(x).to(self.device) for x in im0s]
+        auto = getattr(self.dataset, 'auto', False)
+        if len({x.shape for x in im0s}) == 1:
+            img = ops.letterbox(torch.stack(self.im0_gpu), self.imgsz, auto, self.model.stride)
+        else:  # LoadStreams letterboxes differing shapes without auto, to the same input shape
+            img = torch.cat([ops.letterbox(x[None], self.imgsz, auto, self.model.stride) for x in self.im0_gpu])
+        return img.half() if self.model.fp16 else img
+
     def get_annotator(self, img):
         raise NotImplementedError("get_annotator function needs to be implemented")
 
@@ -105,6 +136,7 @@ class BasePredictor:
         return preds
 
     def setup(self, source=None, model=None):
+        self.t_start = time.time()
         # source
         source = str(source if source is not None else self.args.source)
         is_file = Path(source).suffix[1:] in (IMG_FORMATS + VID_FORMATS)
@@ -118,35 +150,63 @@ class BasePredictor:
         device = select_device(self.args.device)
         model = model or self.args.model
         self.args.half &= device.type != 'cpu'  # half precision only supported on CUDA
-        model = AutoBackend(model, device=device, dnn=self.args.dnn, fp16=self.args.half)
+        model = AutoBackend(model, device=device, dnn=self.args.dnn, fp16=self.args.half, cache=self.args.model_cache)
         stride, pt = model.stride, model.pt
         imgsz = check_imgsz(self.args.imgsz, stride=stride)  # check image size
 
         # Dataloader
         bs = 1  # batch_size
-        if webcam:
+        motion = MotionDetector(self.args.motion_size) if self.args.motion else None
+        transforms = getattr(model.model, 'transforms', None)
+        self.device_preprocess = self.args.device_preprocess and transforms is None and not self.args.tile
+        preprocess = not (self.device_preprocess or self.args.tile)  # letterbox in the loader
+        self.transfer = HostToDevice(device) if device.type == 'cuda' and transforms is None else None
+        if webcam and self.args.max_batch:
+            self.args.show = check_imshow(warn=True)
+            self.dataset = StreamScheduler(source,
+                                           imgsz=imgsz,
+                                           stride=stride,
+                                           auto=pt,
+                                           transforms=transforms,
+                                           vid_stride=self.args.vid_stride,
+                                           motion=motion,
+                                           preprocess=preprocess,
+                                           max_batch=self.args.max_batch,
+                                           max_wait=self.args.max_wait,
+                                           slo=self.args.slo)
+            bs = len(self.dataset)
+        elif webcam:
             self.args.show = check_imshow(warn=True)
             self.dataset = LoadStreams(source,
                                        imgsz=imgsz,
                                        stride=stride,
                                        auto=pt,
-                                       transforms=getattr(model.model, 'transforms', None),
-                                       vid_stride=self.args.vid_stride)
+                                       transforms=transforms,
+                                       vid_stride=self.args.vid_stride,
+                                       motion=motion,
+                                       preprocess=preprocess)
             bs = len(self.dataset)
         elif screenshot:
             self.dataset = LoadScreenshots(source,
                                            imgsz=imgsz,
                                            stride=stride,
                                            auto=pt,
-                                           transforms=getattr(model.model, 'transforms', None))
+                                           transforms=transforms)
         else:
             self.dataset = LoadImages(source,
                                       imgsz=imgsz,
                                       stride=stride,
                                       auto=pt,
-                                      transforms=getattr(model.model, 'transforms', None),
-                                      vid_stride=self.args.vid_stride)
+                                      transforms=transforms,
+                                      vid_stride=self.args.vid_stride,
+                                      motion=motion,
+                                      preprocess=preprocess)
         self.vid_path, self.vid_writer = [None] * bs, [None] * bs
+        if self.args.tile:
+            tile = check_imgsz(self.args.tile, stride=stride)
+            self.tiler = Tiler(tile, self.args.tile_overlap, self.args.tile_skip)
+            self.args.retina_masks = True  # tile masks are pasted at frame resolution
+            imgsz = [tile, tile]
         model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
 
         self.model = model
@@ -165,45 +225,80 @@ class BasePredictor:
         model.eval()
         self.seen, self.windows, self.dt = 0, [], (ops.Profile(), ops.Profile(), ops.Profile())
         self.all_outputs = []
-        for batch in self.dataset:
+        batches = iter(self.dataset)
+        fetched = self.fetch(batches)
+        while fetched is not None:
             self.run_callbacks("on_predict_batch_start")
-            path, im, im0s, vid_cap, s = batch
+            (path, im, im0s, vid_cap, s), self.batch_state, upload = fetched
+            fetched = None
             visualize = increment_path(self.save_dir / Path(path).stem, mkdir=True) if self.args.visualize else False
+            self.streams = self.batch_state.get('batch_ids') or list(range(len(im0s) if self.webcam else 1))
+            motion = self.motion_boxes(im0s)
+            self.static = motion is not None and self.held is not None and self.held[2] < self.args.motion_hold and \
+                self.held[3] == self.streams and not any(len(x) for x in motion)
             with self.dt[0]:
-                im = self.preprocess(im)
+                self.im0_gpu = None
+                if self.static and not self.plots_input():  # nothing is plotted over it, the held input gives the shape
+                    im = self.held[1]
+                elif self.tiler:
+                    im = self.preprocess(self.tiler.split(im0s if self.webcam else [im0s], motion, self.streams))
+                elif self.device_preprocess:
+                    im = self.preprocess_frames(im0s if self.webcam else [im0s], upload)
+                else:
+                    im = self.preprocess(im if upload is None else self.transfer.ready(upload)[0])
                 if len(im.shape) == 3:
                     im = im[None]  # expand for batch dim
+            if self.static:  # hold the last predictions, skip inference, plot over the current frames
+                preds, held_im, n, _ = self.held
+                self.held = preds, held_im, n + 1, self.streams
+            else:
+                if motion is not None:
+                    self.dataset.motion.commit(self.streams)
 
-            # Inference
-            with self.dt[1]:
-                preds = model(im, augment=self.args.augment, visualize=visualize)
+                # Inference
+                with self.dt[1]:
+                    preds = model(im, augment=self.args.augment, visualize=visualize)
+                if self.transfer is not None:  # read ahead, the next upload overlaps this inference
+                    fetched = self.fetch(batches)
 
-            # postprocess
-            with self.dt[2]:
-                preds = self.postprocess(preds, im, im0s)
+                # postprocess
+                with self.dt[2]:
+                    preds = self.postprocess(preds, im, im0s)
+                if motion is not None:
+                    self.held = preds, im, 0, self.streams
 
-            for i in range(len(im)):
-                if self.webcam:
-                    path, im0s = path[i], im0s[i]
-                p = Path(path)
-                s += self.write_results(i, preds, (p, im, im0s))
+            for i in range(len(im0s) if self.webcam else 1):
+                self.stream = self.streams[i]  # stream of the i-th image of the batch
+                p, im0 = (path[i], im0s[i]) if self.webcam else (path, im0s)
+                p = Path(p)
+                s += self.write_results(i, preds, (p, im, im0))
 
                 if self.args.show:
                     self.show(p)
 
                 if self.args.save:
-                    self.save_preds(vid_cap, i, str(self.save_dir / p.name))
+                    self.save_preds(vid_cap, self.stream, str(self.save_dir / p.name))
 
             # Print time (inference-only)
-            LOGGER.info(f"{s}{'' if len(preds) else '(no detections), '}{self.dt[1].dt * 1E3:.1f}ms")
+            LOGGER.info(f"{s}{'' if len(preds) else '(no detections), '}"
+                        f"{'static' if self.static else f'{self.dt[1].dt * 1E3:.1f}ms'}")
 
+            if self.t_start is not None:
+                LOGGER.info(f'Time to first frame {time.time() - self.t_start:.2f}s')
+                self.t_start = None
+            if hasattr(self.dataset, 'done'):
+                self.dataset.done(self.batch_state['batch_ids'], self.batch_state['batch_ts'])
             self.run_callbacks("on_predict_batch_end")
+            fetched = fetched or self.fetch(batches)
 
         # Print results
         t = tuple(x.t / self.seen * 1E3 for x in self.dt)  # speeds per image
         LOGGER.info(
             f'Speed: %.1fms pre-process, %.1fms inference, %.1fms postprocess per image at shape {(1, 3, *self.imgsz)}'
             % t)
+        if hasattr(self.dataset, 'latency_stats'):
+            for src, (p50, p99), n in zip(self.dataset.sources, self.dataset.latency_stats(), self.dataset.dropped):
+                LOGGER.info(f'{src}: latency p50 {p50 * 1E3:.1f}ms, p99 {p99 * 1E3:.1f}ms, {n} frames dropped')
         if self.args.save_txt or self.args.save:
             s = f"\n{len(list(self.save_dir.glob('labels/*.txt')))} labels saved to {self.save_dir / 'labels'}" if self.args.save_txt else ''
             LOGGER.info(f"Results saved to {colorstr('bold', self.save_dir)}{s}")
@@ -211,6 +306,47 @@ class BasePredictor:
         self.run_callbacks("on_predict_end")
         return self.all_outputs
 
+    def fetch(self, batches):
+        """
+        Returns the next batch of the dataset, the loader attributes describing it and the handle of its started upload
+        to the device, or None at the end. The attributes are captured so that the next batch can be read ahead.
+        """
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        state = {k: getattr(self.dataset, k) for k in self.BATCH_STATE if hasattr(self.dataset, k)}
+        upload = None
+        # a batch without motion is likely held and then needs no input, a mispredicted one is preprocessed in the loop
+        still = self.still(state.get('motion_masks')) and not self.plots_input()
+        if self.transfer is not None and not self.tiler and not still:
+            _, im, im0s, _, _ = batch
+            upload = self.transfer((list(im0s) if self.webcam else [im0s]) if self.device_preprocess else [im])
+        return batch, state, upload
+
+    def plots_input(self):
+        """
+        Returns whether write_results() plots over the preprocessed input, which static batches then preprocess too.
+        Results are plotted over the frames by default.
+        """
+        return False
+
+    def still(self, masks):
+        # Whether the motion masks of a batch report a static scene, False without motion information
+        return masks is not None and not any(m.mean() >= self.args.motion for m in masks)
+
+    def motion_boxes(self, im0s):
+        """
+        Returns per frame the xyxy boxes of the regions in which more than `motion` of the pixels of the dataset's motion
+        masks changed, or None when there is no motion information for this batch.
+        """
+        masks = self.batch_state.get('motion_masks')
+        if masks is None:
+            return None
+        im0s = im0s if self.webcam else [im0s]
+        return [
+            MotionDetector.boxes(m, im0.shape) if m.mean() >= self.args.motion else np.zeros((0, 4), dtype=np.float32)
+            for m, im0 in zip(masks, im0s)]
+
     def show(self, p):
         im0 = self.annotator.result()
         if platform.system() == 'Linux' and p not in self.windows:
@@ -223,7 +359,7 @@ class BasePredictor:
     def save_preds(self, vid_cap, idx, save_path):
         im0 = self.annotator.result()
         # save imgs
-        if self.dataset.mode == 'image':
+        if self.batch_state['mode'] == 'image':
             cv2.imwrite(save_path, im0)
         else:  # 'video' or 'stream'
             if self.vid_path[idx] != save_path:  # new video
@@ -26,10 +26,11 @@ import ultralytics.yolo.utils as utils
 from ultralytics import __version__
 from ultralytics.nn.tasks import attempt_load_one_weight
 from ultralytics.yolo.configs import get_config
+from ultralytics.yolo.data.build import rebuild_dataloader
 from ultralytics.yolo.data.utils import check_dataset, check_dataset_yaml
 from ultralytics.yolo.utils import (DEFAULT_CONFIG, LOGGER, RANK, SETTINGS, TQDM_BAR_FORMAT, callbacks, colorstr,
                                     yaml_save)
-from ultralytics.yolo.utils.autobatch import check_train_batch_size
+from ultralytics.yolo.utils.autobatch import autotune, check_train_batch_size
 from ultralytics.yolo.utils.checks import check_file, print_args
 from ultralytics.yolo.utils.dist import ddp_cleanup, generate_ddp_command
 from ultralytics.yolo.utils.files import get_latest_run, increment_path
@@ -88,6 +89,8 @@ class BaseTrainer:
         self.console = LOGGER
         self.validator = None
         self.model = None
+        self.batch_transforms = None
+        self.train_loader = None  # built by autotune() before the batch size is known, else in _setup_train()
         self.callbacks = defaultdict(list)
         init_seeds(self.args.seed + 1 + RANK, deterministic=self.args.deterministic)
 
@@ -193,6 +196,13 @@ class BaseTrainer:
         ckpt = self.setup_model()
         self.model = self.model.to(self.device)
         self.set_model_attributes()
+        if self.args.autotune:
+            if world_size > 1:
+                self.console.warning("WARNING ⚠️ autotune is only available in single-device training, skipping")
+            else:
+                self.autotune()
+        if self.args.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
         if world_size > 1:
             self.model = DDP(self.model, device_ids=[rank])
 
@@ -222,7 +232,13 @@ class BaseTrainer:
 
         # dataloaders
         batch_size = self.batch_size // world_size if world_size > 1 else self.batch_size
-        self.train_loader = self.get_dataloader(self.trainset, batch_size=batch_size, rank=rank, mode="train")
+        if self.train_loader is None:
+            self.train_loader = self.get_dataloader(self.trainset, batch_size=batch_size, rank=rank, mode="train")
+        else:  # reuse the dataset autotune() was run on, only the loader follows the tuned settings
+            self.train_loader = rebuild_dataloader(self.train_loader, batch_size, self.args.workers,
+                                                   self.args.pin_memory) or \
+                self.get_dataloader(self.trainset, batch_size=batch_size, rank=rank, mode="train")
+        self.batch_transforms = getattr(self.train_loader.dataset, "batch_transforms", None)
         if rank in {0, -1}:
             self.test_loader = self.get_dataloader(self.testset, batch_size=batch_size * 2, rank=-1, mode="val")
             self.validator = self.get_validator()
@@ -359,8 +375,8 @@ class BaseTrainer:
         ckpt = {
             'epoch': self.epoch,
             'best_fitness': self.best_fitness,
-            'model': deepcopy(de_parallel(self.model)).half(),
-            'ema': deepcopy(self.ema.ema).half(),
+            'model': deepcopy(de_parallel(self.model)).half().to(memory_format=torch.contiguous_format),
+            'ema': deepcopy(self.ema.ema).half().to(memory_format=torch.contiguous_format),
             'updates': self.ema.updates,
             'optimizer': self.optimizer.state_dict(),
             'train_args': self.args,
@@ -405,11 +421,39 @@ class BaseTrainer:
         if self.ema:
             self.ema.update(self.model)
 
+    def autotune(self):
+        """
+        > Benchmarks the batch size (if batch=-1), dataloader workers, pin_memory and channels_last for the most
+        training images/s on the train dataset, and applies them. See utils.autobatch.autotune(). The train loader is
+        built here, before the batch size is known, and only rebuilt around the same dataset in _setup_train().
+        """
+        workers, self.args.workers = self.args.workers, 0  # no workers are started for the tuning, see _setup_train()
+        batch_size = self.batch_size if self.batch_size > 0 else 16
+        self.train_loader = self.get_dataloader(self.trainset, batch_size=batch_size, rank=-1, mode="train")
+        self.args.workers = workers
+        dataset = self.train_loader.dataset
+        self.batch_transforms = getattr(dataset, "batch_transforms", None)
+
+        def step(model, batch):
+            with torch.cuda.amp.autocast(self.amp):
+                batch = self.preprocess_batch(batch)
+                loss = self.criterion(model(batch["img"]), batch)[0]
+            loss.backward()
+
+        data = f"{self.trainset}-{len(dataset)}-cache_{self.args.cache}-batch_augment_{self.args.batch_augment}"
+        r = autotune(self.model, self.args.imgsz, self.amp, self.batch_size, dataset, step, data=data)
+        self.batch_transforms = None
+        if r:
+            self.batch_size = r["batch"]
+            self.args.workers, self.args.pin_memory, self.args.channels_last = \
+                r["workers"], r["pin_memory"], r["channels_last"]
+
     def preprocess_batch(self, batch):
         """
-        > Allows custom preprocessing model inputs and ground truths depending on task type.
+        > Allows custom preprocessing model inputs and ground truths depending on task type. Applies the batch
+        transforms of the train dataset, if any, once the images are on the training device.
         """
-        return batch
+        return self.batch_transforms(batch) if self.batch_transforms else batch
 
     def validate(self):
         """
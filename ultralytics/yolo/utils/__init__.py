@@ -14,7 +14,6 @@ from pathlib import Path
 
 import cv2
 import numpy as np
-import pandas as pd
 import torch
 import yaml
 
@@ -63,7 +62,6 @@ HELP_MSG = \
 # Settings
 torch.set_printoptions(linewidth=320, precision=5, profile='long')
 np.set_printoptions(linewidth=320, formatter={'float_kind': '{:11.5g}'.format})  # format short g, %precision=5
-pd.options.display.max_columns = 10
 cv2.setNumThreads(0)  # prevent OpenCV from multithreading (incompatible with PyTorch DataLoader)
 os.environ['NUMEXPR_MAX_THREADS'] = str(NUM_THREADS)  # NumExpr max threads
 os.environ['CUBLAS_WORKSPACE_CONFIG'] = ':4096:8'  # for deterministic training
@@ -360,17 +358,19 @@ def get_settings(file=USER_CONFIG_DIR / 'settings.yaml'):
     """
     from ultralytics.yolo.utils.torch_utils import torch_distributed_zero_first
 
-    root = get_git_root_dir() or Path('')  # not is_pip_package()
-    defaults = {
-        'datasets_dir': str(root / 'datasets'),  # default datasets directory.
-        'weights_dir': str(root / 'weights'),  # default weights directory.
-        'runs_dir': str(root / 'runs'),  # default runs directory.
-        'sync': True,  # sync analytics to help with YOLO development
-        'uuid': uuid.getnode()}  # device UUID to align analytics
+    def get_defaults(root=Path('')):
+        return {
+            'datasets_dir': str(root / 'datasets'),  # default datasets directory.
+            'weights_dir': str(root / 'weights'),  # default weights directory.
+            'runs_dir': str(root / 'runs'),  # default runs directory.
+            'sync': True,  # sync analytics to help with YOLO development
+            'uuid': uuid.getnode()}  # device UUID to align analytics
 
+    # the git root is only looked up when defaults are written, a git subprocess on every import is slow
+    defaults = get_defaults()
     with torch_distributed_zero_first(RANK):
         if not file.exists():
-            yaml_save(file, defaults)
+            yaml_save(file, get_defaults(get_git_root_dir() or Path('')))  # not is_pip_package()
 
         settings = yaml_load(file)
 
@@ -381,7 +381,8 @@ def get_settings(file=USER_CONFIG_DIR / 'settings.yaml'):
             LOGGER.warning('WARNING ⚠️ Different global settings detected, resetting to defaults. '
                            'This may be due to an ultralytics package update. '
                            f'View and update your global settings directly in {file}')
-            settings = defaults  # merge **defaults with **settings (prefer **settings)
+            # merge **defaults with **settings (prefer **settings)
+            settings = get_defaults(get_git_root_dir() or Path(''))
             yaml_save(file, settings)  # save updated defaults
 
         return settings
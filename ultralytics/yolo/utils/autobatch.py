@@ -3,13 +3,18 @@
 Auto-batch utils
 """
 
+import hashlib
+import os
+import platform
 from copy import deepcopy
+from pathlib import Path
 
 import numpy as np
 import torch
+from torch.utils.data import DataLoader, RandomSampler
 
-from ultralytics.yolo.utils import LOGGER, colorstr
-from ultralytics.yolo.utils.torch_utils import profile
+from ultralytics.yolo.utils import LOGGER, USER_CONFIG_DIR, colorstr, yaml_load, yaml_save
+from ultralytics.yolo.utils.torch_utils import de_parallel, profile, time_sync
 
 
 def check_train_batch_size(model, imgsz=640, amp=True):
@@ -70,3 +75,181 @@ def autobatch(model, imgsz=640, fraction=0.7, batch_size=16):
     fraction = (np.polyval(p, b) + r + a) / t  # actual fraction predicted
     LOGGER.info(f'{prefix}Using batch-size {b} for {d} {t * fraction:.2f}G/{t:.2f}G ({fraction * 100:.0f}%) ✅')
     return b
+
+
+def autotune(model, imgsz=640, amp=True, batch_size=-1, dataset=None, step=None, fraction=0.7,
+             file=USER_CONFIG_DIR / 'autotune.yaml', data=''):
+    """
+    Benchmarks short training runs on CPU or CUDA for the batch size, dataloader workers, pin_memory and memory format
+    with the most images/s, within `fraction` of the free device memory.
+
+    Batch sizes and channels_last are timed on random images first, then workers and pin_memory on batches of the
+    dataset at the chosen batch size. Results are cached in `file` per model, device and imgsz, and per dataset and
+    loading mode when workers are tuned, later runs skip the search.
+
+    Args:
+        model (nn.Module): model to tune on, a copy is trained so that its weights and statistics are left untouched.
+        imgsz (int): image size.
+        amp (bool): use automatic mixed precision on CUDA.
+        batch_size (int): batch size, -1 to tune it.
+        dataset (Dataset, optional): training dataset to tune workers and pin_memory on, they are not tuned if None.
+        step (callable, optional): step(model, batch) computes the loss of a dataset batch and runs backward.
+        fraction (float): fraction of the free device memory the training step may use.
+        file (Path): results cache.
+        data (str): identifies the dataset and how it is loaded (path, size, cache mode, augmentation), part of the
+            cache key when `dataset` is given.
+
+    Returns:
+        (dict | None): batch, workers, pin_memory and channels_last settings, None if no batch size fits in memory.
+    """
+    prefix = colorstr('AutoTune: ')
+    device = next(model.parameters()).device
+    amp = amp and device.type == 'cuda'
+    key = autotune_key(model, device, imgsz, amp, batch_size, data if dataset is not None else None)
+    cache = yaml_load(file) if Path(file).exists() else {}
+    if key in cache:
+        LOGGER.info(f'{prefix}Using cached settings {cache[key]} for {key}')
+        return cache[key]
+    LOGGER.info(f'{prefix}Benchmarking training throughput for --imgsz {imgsz} on {key.split("-", 1)[1]}')
+    model = deepcopy(de_parallel(model)).train()
+
+    # Batch size and memory format, on random images
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+    base = _memory(device)
+    if device.type == 'cuda':
+        budget = fraction * (torch.cuda.get_device_properties(device).total_memory - base)
+    else:
+        import psutil
+        budget = fraction * psutil.virtual_memory().available
+    results = []  # images/s, batch size, channels_last
+    sweeps = {False: [0, 0], True: [0, 0]}  # best images/s and slower batch sizes in a row of each memory format
+    for b in [batch_size] if batch_size > 0 else [2 ** i for i in range(9)]:
+        for channels_last in [k for k, v in sweeps.items() if v[1] < 2]:
+            model = model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+            try:
+                ips, mem = _time_steps(model, b, imgsz, device, amp, channels_last)
+            except RuntimeError as e:  # out of memory
+                LOGGER.info(f'{prefix}batch {b} channels_last={channels_last} failed: {str(e).splitlines()[0]}')
+                sweeps[channels_last][1] = 2
+                continue
+            finally:
+                if device.type == 'cuda':
+                    torch.cuda.empty_cache()
+            mem -= base
+            LOGGER.info(f'{prefix}batch {b:<4d}channels_last={channels_last!s:<6s}{ips:8.1f} img/s {mem / 1E9:8.2f}G')
+            if mem > budget and b > 1:
+                sweeps[channels_last][1] = 2
+                continue
+            results.append((ips, b, channels_last))
+            best, slower = sweeps[channels_last]
+            sweeps[channels_last] = [max(best, ips), slower + 1 if ips < best * 0.97 else 0]  # 2 slower: saturated
+        if all(v[1] >= 2 for v in sweeps.values()):
+            break
+    if not results:
+        LOGGER.warning(f'{prefix}WARNING ⚠️ no batch size fits in memory, keeping current settings')
+        return None
+    ips = max(x[0] for x in results)
+    model_ips, b, channels_last = min((x for x in results if x[0] >= ips * 0.97), key=lambda x: x[1])  # smallest b
+    model = model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+
+    # Dataloader workers and pin_memory, on dataset batches
+    workers, pin_memory = 0, False
+    if dataset is not None:
+        step = step or _default_step(amp)
+        cap = min(os.cpu_count() // max(torch.cuda.device_count(), 1), b)
+        best = 0
+        for w in [0] + [2 ** i for i in range(cap.bit_length())]:
+            ips = _time_loader(model, dataset, b, w, False, step)
+            LOGGER.info(f'{prefix}batch {b:<4d}workers {w:<4d}{ips:8.1f} img/s')
+            if ips > best * 1.05:
+                workers, best = w, ips
+            elif w:
+                break  # more workers no longer help
+            if best > model_ips * 0.95:
+                break  # loading keeps up with the model
+        if device.type == 'cuda':
+            ips = _time_loader(model, dataset, b, workers, True, step)
+            LOGGER.info(f'{prefix}batch {b:<4d}workers {workers:<4d}{ips:8.1f} img/s with pin_memory')
+            pin_memory = ips > best
+
+    r = dict(batch=b, workers=workers, pin_memory=pin_memory, channels_last=channels_last)
+    cache[key] = r
+    yaml_save(file, cache)
+    LOGGER.info(f'{prefix}Using {r}, saved to {file} ✅')
+    return r
+
+
+def autotune_key(model, device, imgsz, amp, batch_size, data=None):
+    # Returns the autotune() cache key of a model architecture, device, training settings and dataset, if any
+    m = de_parallel(model)
+    arch = hashlib.md5(str(getattr(m, 'yaml', m)).encode()).hexdigest()[:16]
+    if device.type == 'cuda':
+        name = torch.cuda.get_device_name(device).replace(' ', '_')
+    else:
+        name = f'{platform.processor() or platform.machine()}_{os.cpu_count()}cpu'
+    b = f'b{batch_size}' if batch_size > 0 else 'auto'
+    d = '' if data is None else f'-data_{hashlib.md5(str(data).encode()).hexdigest()[:16]}'
+    return f'{arch}-{device.type}_{name}-{imgsz}-{b}{"-amp" if amp else ""}{d}-torch{torch.__version__}'
+
+
+def _loss(y):
+    # Sums all outputs of a model, a stand-in training loss
+    return y.float().sum() if isinstance(y, torch.Tensor) else sum(_loss(x) for x in y)
+
+
+def _default_step(amp):
+    def step(model, batch):
+        img = batch['img'].to(next(model.parameters()).device, non_blocking=True).float() / 255
+        with torch.cuda.amp.autocast(amp):
+            loss = _loss(model(img))
+        loss.backward()
+
+    return step
+
+
+def _memory(device):
+    # Returns the bytes of memory held by this process on a device, the peak since the last reset on CUDA
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_reserved(device)
+    import psutil
+    return psutil.Process().memory_info().rss
+
+
+def _time_steps(model, batch_size, imgsz, device, amp, channels_last, n=5):
+    # Returns the median images/s of n training steps on random images after a warmup step, and the peak memory held
+    x = torch.rand(batch_size, 3, imgsz, imgsz, device=device)
+    x = x.contiguous(memory_format=torch.channels_last) if channels_last else x
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    dt = []
+    for i in range(n + 1):
+        t = time_sync()
+        with torch.cuda.amp.autocast(amp):
+            loss = _loss(model(x))
+        if i == 0:
+            mem = _memory(device)  # activations are alive until backward
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+        dt.append(time_sync() - t)
+    return batch_size / np.median(dt[1:]), max(mem, _memory(device))
+
+
+def _time_loader(model, dataset, batch_size, workers, pin_memory, step, n=4):
+    # Returns images/s of training steps on dataset batches loaded with these settings. The workers prefetch two batches
+    # each, so that many are consumed before timing to measure them at their steady rate.
+    warmup, n = 2 * workers + 1, n + workers
+    sampler = RandomSampler(dataset, replacement=True, num_samples=batch_size * (warmup + n))
+    loader = DataLoader(dataset,
+                        batch_size=batch_size,
+                        sampler=sampler,
+                        num_workers=workers,
+                        pin_memory=pin_memory,
+                        collate_fn=getattr(dataset, 'collate_fn', None))
+    for i, batch in enumerate(loader):
+        if i == warmup:
+            t = time_sync()
+        step(model, batch)
+        model.zero_grad(set_to_none=True)
+    return batch_size * n / (time_sync() - t)
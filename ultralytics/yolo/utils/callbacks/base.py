@@ -3,6 +3,8 @@
 Base callbacks
 """
 
+import importlib
+
 
 # Trainer callbacks ----------------------------------------------------------------------------------------------------
 def on_pretrain_routine_start(trainer):
@@ -138,12 +140,26 @@ default_callbacks = {
     'on_export_end': on_export_end}
 
 
+# Events hooked by each integration, the integration modules are imported when one of their events is first run
+integration_events = {
+    'clearml': ('on_pretrain_routine_start', 'on_train_epoch_end', 'on_fit_epoch_end', 'on_train_end'),
+    'comet': ('on_pretrain_routine_start', 'on_train_epoch_end', 'on_fit_epoch_end', 'on_train_end'),
+    'hub': ('on_pretrain_routine_end', 'on_fit_epoch_end', 'on_model_save', 'on_train_end', 'on_train_start',
+            'on_val_start', 'on_predict_start', 'on_export_start'),
+    'tensorboard': ('on_pretrain_routine_start', 'on_fit_epoch_end', 'on_batch_end')}
+
+
+def lazy_callback(integration, event):
+    # Returns a callback that imports the integration on first call and runs its callback for the event, if any
+    def callback(instance):
+        f = importlib.import_module(f'.{integration}', __package__).callbacks.get(event)
+        if f is not None:
+            f(instance)
+
+    return callback
+
+
 def add_integration_callbacks(instance):
-    from .clearml import callbacks as clearml_callbacks
-    from .comet import callbacks as comet_callbacks
-    from .hub import callbacks as hub_callbacks
-    from .tensorboard import callbacks as tb_callbacks
-
-    for x in clearml_callbacks, comet_callbacks, hub_callbacks, tb_callbacks:
-        for k, v in x.items():
-            instance.callbacks[k].append(v)  # callback[name].append(func)
+    for integration, events in integration_events.items():
+        for k in events:
+            instance.callbacks[k].append(lazy_callback(integration, k))  # callback[name].append(func)
@@ -7,7 +7,7 @@ from typing import List
 
 import numpy as np
 
-from .ops import ltwh2xywh, ltwh2xyxy, resample_segments, xywh2ltwh, xywh2xyxy, xyxy2ltwh, xyxy2xywh
+from .ops import ltwh2xywh, ltwh2xyxy, resample_polygons, xywh2ltwh, xywh2xyxy, xyxy2ltwh, xyxy2xywh
 
 
 # From PyTorch internals
@@ -178,10 +178,8 @@ class Instances:
         self.normalized = normalized
 
         if len(segments) > 0:
-            # list[np.array(1000, 2)] * num_samples
-            segments = resample_segments(segments)
-            # (N, 1000, 2)
-            segments = np.stack(segments, axis=0)
+            # list[np.array(m, 2)] * num_samples -> (N, 1000, 2)
+            segments = resample_polygons(np.concatenate(segments, 0), [len(s) for s in segments])
         else:
             segments = np.zeros((0, 1000, 2), dtype=np.float32)
         self.segments = segments
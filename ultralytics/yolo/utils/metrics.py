@@ -6,7 +6,6 @@ import math
 import warnings
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import torch
 import torch.nn as nn
@@ -116,6 +115,24 @@ def mask_iou(mask1, mask2, eps=1e-7):
     return intersection / (union + eps)
 
 
+def cropped_mask_iou(mask1, mask2, eps=1e-7):
+    """
+    mask1: [N, h, w] m1 means number of gt objects
+    mask2: [M, h, w] m2 means number of predicted objects
+    Note: intersections are only computed over the rows and columns where mask1 has pixels, same result as mask_iou()
+    return: masks iou, [N, M]
+    """
+    area1, area2 = mask1.flatten(1).sum(1), mask2.flatten(1).sum(1)
+    any1 = mask1.amax(0) > 0  # h, w
+    rows, cols = torch.nonzero(any1.any(1)).view(-1), torch.nonzero(any1.any(0)).view(-1)
+    if len(rows) == 0:
+        return mask1.new_zeros(len(mask1), len(mask2))
+    y1, y2, x1, x2 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    intersection = torch.matmul(mask1[:, y1:y2, x1:x2].flatten(1), mask2[:, y1:y2, x1:x2].flatten(1).t()).clamp(0)
+    union = (area1[:, None] + area2[None]) - intersection  # (area1 + area2) - intersection
+    return intersection / (union + eps)
+
+
 def masks_iou(mask1, mask2, eps=1e-7):
     """
     mask1: [N, n] m1 means number of predicted objects
@@ -229,6 +246,7 @@ class ConfusionMatrix:
 
     @TryExcept('WARNING ⚠️ ConfusionMatrix plot failure')
     def plot(self, normalize=True, save_dir='', names=()):
+        import matplotlib.pyplot as plt
         import seaborn as sn
 
         array = self.matrix / ((self.matrix.sum(0).reshape(1, -1) + 1E-9) if normalize else 1)  # normalize columns
@@ -272,6 +290,8 @@ def smooth(y, f=0.05):
 
 
 def plot_pr_curve(px, py, ap, save_dir=Path('pr_curve.png'), names=()):
+    import matplotlib.pyplot as plt
+
     # Precision-recall curve
     fig, ax = plt.subplots(1, 1, figsize=(9, 6), tight_layout=True)
     py = np.stack(py, axis=1)
@@ -294,6 +314,8 @@ def plot_pr_curve(px, py, ap, save_dir=Path('pr_curve.png'), names=()):
 
 
 def plot_mc_curve(px, py, save_dir=Path('mc_curve.png'), names=(), xlabel='Confidence', ylabel='Metric'):
+    import matplotlib.pyplot as plt
+
     # Metric-confidence curve
     fig, ax = plt.subplots(1, 1, figsize=(9, 6), tight_layout=True)
 
@@ -363,6 +385,23 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir=Path(), na
 
     # Find unique classes
     unique_classes, nt = np.unique(target_cls, return_counts=True)
+    return ap_per_class_counts(tp, np.ones(len(conf)), conf, pred_cls, unique_classes, nt, plot, save_dir, names, eps,
+                               prefix)
+
+
+def ap_per_class_counts(tp, n, conf, pred_cls, unique_classes, nt, plot=False, save_dir=Path(), names=(), eps=1e-16,
+                        prefix=""):
+    """ ap_per_class() of groups of predictions of equal confidence and class.
+    # Arguments
+        tp:  True positives of every group (nparray, nx1 or nx10).
+        n:  Number of predictions of every group (nparray).
+        conf:  Confidence of every group, in decreasing order (nparray).
+        pred_cls:  Predicted class of every group (nparray).
+        unique_classes:  Classes with targets (nparray).
+        nt:  Number of targets of every class (nparray).
+    # Returns
+        The average precision as computed in py-faster-rcnn.
+    """
     nc = unique_classes.shape[0]  # number of classes, number of detections
 
     # Create Precision-Recall curve and compute AP for each class
@@ -371,12 +410,12 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir=Path(), na
     for ci, c in enumerate(unique_classes):
         i = pred_cls == c
         n_l = nt[ci]  # number of labels
-        n_p = i.sum()  # number of predictions
+        n_p = n[i].sum()  # number of predictions
         if n_p == 0 or n_l == 0:
             continue
 
         # Accumulate FPs and TPs
-        fpc = (1 - tp[i]).cumsum(0)
+        fpc = (n[i, None] - tp[i]).cumsum(0)
         tpc = tp[i].cumsum(0)
 
         # Recall
@@ -410,6 +449,50 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir=Path(), na
     return tp, fp, p, r, f1, ap, unique_classes.astype(int)
 
 
+class APHistogram:
+    """
+    Streaming inputs of ap_per_class(), predictions are counted per class and confidence bin instead of being stored,
+    so memory is O(nc * niou * bins) whatever the number of images. Predictions sharing a bin rank as ties.
+
+    Attributes:
+        tp (Tensor): (k, nc, niou, bins) true positives of each of the k tp matrices updated together (masks, boxes).
+        n (Tensor): (nc, bins) predictions.
+        nt (Tensor): (nc, ) targets.
+    """
+
+    def __init__(self, nc, niou=10, k=1, bins=4096, device=None):
+        self.bins = bins
+        self.tp = torch.zeros(k, nc, niou, bins, dtype=torch.int32, device=device)
+        self.n = torch.zeros(nc, bins, dtype=torch.int32, device=device)
+        self.nt = torch.zeros(nc, dtype=torch.int32, device=device)
+
+    def update(self, tp, conf, pred_cls, target_cls):
+        """
+        Args:
+            tp (tuple): (n, niou) bool true positives of the predictions, one per k.
+            conf (Tensor): (n, ) confidence of the predictions.
+            pred_cls (Tensor): (n, ) class of the predictions.
+            target_cls (Tensor): (m, ) class of the targets.
+        """
+        one = self.nt.new_ones(1)
+        self.nt.put_(target_cls.long(), one.expand(len(target_cls)), accumulate=True)
+        cell = pred_cls.long() * self.bins + (conf * self.bins).long().clamp(0, self.bins - 1)  # class, bin
+        self.n.put_(cell, one.expand(len(cell)), accumulate=True)
+        niou = self.tp.shape[2]
+        for tp_k, x in zip(self.tp, tp):
+            i, j = torch.nonzero(x, as_tuple=True)
+            cls, b = torch.div(cell[i], self.bins, rounding_mode='floor'), cell[i] % self.bins
+            tp_k.put_((cls * niou + j) * self.bins + b, one.expand(len(i)), accumulate=True)
+
+    def compute(self, k=0, **kwargs):
+        # Returns ap_per_class() of the k-th tp matrix, the predictions of a bin at its center confidence
+        tp, n, nt = self.tp[k].cpu().numpy(), self.n.cpu().numpy(), self.nt.cpu().numpy()
+        b, c = np.nonzero(n.T[::-1])  # non-empty bins, by decreasing confidence
+        b = self.bins - 1 - b
+        return ap_per_class_counts(tp[c, :, b], n[c, b], (b + 0.5) / self.bins, c, np.flatnonzero(nt), nt[nt > 0],
+                                   **kwargs)
+
+
 class Metric:
 
     def __init__(self) -> None:
@@ -502,9 +585,9 @@ class DetMetrics:
         self.names = names
         self.metric = Metric()
 
-    def process(self, tp, conf, pred_cls, target_cls):
-        results = ap_per_class(tp, conf, pred_cls, target_cls, plot=self.plot, save_dir=self.save_dir,
-                               names=self.names)[2:]
+    def process(self, stats):
+        # stats: APHistogram of the box true positives
+        results = stats.compute(0, plot=self.plot, save_dir=self.save_dir, names=self.names)[2:]
         self.metric.update(results)
 
     @property
@@ -542,24 +625,11 @@ class SegmentMetrics:
         self.metric_box = Metric()
         self.metric_mask = Metric()
 
-    def process(self, tp_m, tp_b, conf, pred_cls, target_cls):
-        results_mask = ap_per_class(tp_m,
-                                    conf,
-                                    pred_cls,
-                                    target_cls,
-                                    plot=self.plot,
-                                    save_dir=self.save_dir,
-                                    names=self.names,
-                                    prefix="Mask")[2:]
+    def process(self, stats):
+        # stats: APHistogram of the mask (k=0) and box (k=1) true positives
+        results_mask = stats.compute(0, plot=self.plot, save_dir=self.save_dir, names=self.names, prefix="Mask")[2:]
         self.metric_mask.update(results_mask)
-        results_box = ap_per_class(tp_b,
-                                   conf,
-                                   pred_cls,
-                                   target_cls,
-                                   plot=self.plot,
-                                   save_dir=self.save_dir,
-                                   names=self.names,
-                                   prefix="Box")[2:]
+        results_box = stats.compute(1, plot=self.plot, save_dir=self.save_dir, names=self.names, prefix="Box")[2:]
         self.metric_box.update(results_box)
 
     @property
@@ -229,6 +229,139 @@ def non_max_suppression(
     return output
 
 
+def batched_non_max_suppression(
+        prediction,
+        conf_thres=0.25,
+        iou_thres=0.45,
+        classes=None,
+        agnostic=False,
+        multi_label=False,
+        max_det=300,
+        nm=0,  # number of masks
+        as_list=False,
+        max_candidates=0,
+        min_wh=0,
+        roi_mask=None,
+):
+    """
+    > Perform non-maximum suppression (NMS) on a whole batch at once. Candidates of all images are gathered together
+    and suppressed by a single torchvision.ops.batched_nms() call keyed by image and class, so there is no per-image
+    Python loop and no time limit. With max_candidates, only the top-scoring candidates of each image are selected from
+    the class scores of the raw head output, and boxes and mask coefficients are only gathered for those.
+
+    Arguments:
+        prediction (torch.Tensor): A tensor of shape (batch_size, num_classes + 4 + num_masks, num_boxes), as output
+            by the model.
+        conf_thres (float): The confidence threshold below which boxes will be filtered out.
+        iou_thres (float): The IoU threshold below which boxes will be filtered out during NMS.
+        classes (List[int] | List[List[int]]): A list of class indices to consider, or one such list (or None) per
+            image. If None, all classes will be considered.
+        agnostic (bool): If True, the model is agnostic to the number of classes, and all
+            classes will be considered as one.
+        multi_label (bool): If True, each box may have multiple labels.
+        max_det (int): The maximum number of boxes to keep per image after NMS.
+        nm (int): The number of masks output by the model.
+        as_list (bool): If True, return a list of per-image tensors like non_max_suppression().
+        max_candidates (int): The maximum number of candidates per image going into NMS, 0 to keep all.
+        min_wh (int): The minimum box width and height in input pixels, smaller candidates are dropped before NMS.
+        roi_mask (torch.Tensor): A boolean tensor of shape (batch_size, height, width) at input resolution,
+            candidates whose box center falls outside of it are dropped before NMS.
+
+    Returns:
+        (torch.Tensor, torch.Tensor): A tensor of shape (batch_size, max_det, 6 + num_masks), zero padded, with
+            columns (x1, y1, x2, y2, confidence, class, mask1, mask2, ...) and a tensor of shape (batch_size,) with
+            the number of kept boxes per image. A list as non_max_suppression() if as_list=True.
+    """
+
+    # Checks
+    assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
+    assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
+    if isinstance(prediction, (list, tuple)):  # YOLOv5 model in validation model, output = (inference_out, loss_out)
+        prediction = prediction[0]  # select only inference output
+
+    device = prediction.device
+    mps = 'mps' in device.type  # Apple MPS
+    if mps:  # MPS not fully supported yet, convert tensors to CPU before NMS
+        prediction = prediction.cpu()
+    bs = prediction.shape[0]  # batch size
+    nc = prediction.shape[1] - nm - 4  # number of classes
+    mi = 4 + nc  # mask start index
+    max_nms = 30000 * bs  # maximum number of boxes into torchvision.ops.batched_nms()
+    multi_label &= nc > 1  # multiple labels per box
+
+    # Candidates as (image, class, anchor) index triplets
+    cls = prediction[:, 4:mi]
+    na = cls.shape[2]  # number of anchors
+    if multi_label:
+        if max_candidates:  # top-k over all (class, anchor) pairs of each image
+            conf, k = cls.flatten(1).topk(min(max_candidates, nc * na), 1)
+            b = torch.arange(bs, device=k.device)[:, None].expand_as(k)
+            j, a = k // na, k % na
+            k = conf > conf_thres
+            b, j, a, conf = b[k], j[k], a[k], conf[k]
+        else:
+            b, j, a = (cls > conf_thres).nonzero(as_tuple=True)
+            conf = cls[b, j, a]
+    else:  # best class only
+        conf, j = cls.max(1)
+        if max_candidates:  # top-k anchors of each image
+            conf, a = conf.topk(min(max_candidates, na), 1)
+            j = j.gather(1, a)
+            b = torch.arange(bs, device=a.device)[:, None].expand_as(a)
+            k = conf > conf_thres
+            b, j, a, conf = b[k], j[k], a[k], conf[k]
+        else:
+            b, a = (conf > conf_thres).nonzero(as_tuple=True)
+            conf, j = conf[b, a], j[b, a]
+
+    # Filter by class, size and region of interest before NMS and mask decoding
+    xywh = prediction[b, :4, a]
+    k = torch.ones_like(conf, dtype=torch.bool)
+    if classes is not None:
+        if isinstance(classes, int):
+            classes = [classes]
+        if not all(isinstance(c, int) for c in classes):  # one list per image
+            allowed = torch.zeros((bs, nc), dtype=torch.bool, device=j.device)
+            for xi, c in enumerate(classes):
+                allowed[xi, slice(None) if c is None else c] = True
+            k &= allowed[b, j]
+        else:
+            k &= (j[:, None] == torch.tensor(classes, device=j.device)).any(1)
+    if min_wh:
+        k &= (xywh[:, 2:4] >= min_wh).all(1)
+    if roi_mask is not None:
+        h, w = roi_mask.shape[1:]
+        x = xywh[:, 0].long().clamp_(0, w - 1)
+        y = xywh[:, 1].long().clamp_(0, h - 1)
+        k &= roi_mask[b, y, x]
+    if not k.all():
+        b, j, a, conf, xywh = b[k], j[k], a[k], conf[k], xywh[k]
+    if conf.shape[0] > max_nms:  # remove excess boxes
+        k = conf.topk(max_nms).indices
+        b, j, a, conf, xywh = b[k], j[k], a[k], conf[k], xywh[k]
+
+    # Batched NMS, sorted by descending confidence
+    box = xywh2xyxy(xywh)
+    i = torchvision.ops.batched_nms(box, conf, b if agnostic else b * nc + j, iou_thres)
+
+    # Keep the first max_det boxes of each image
+    i = i[torch.sort(b[i], stable=True).indices]  # group by image, confidence order preserved
+    bi = b[i]
+    n = torch.bincount(bi, minlength=bs)
+    rank = torch.arange(len(i), device=i.device) - (n.cumsum(0) - n)[bi]
+    k = rank < max_det
+    i, bi, rank = i[k], bi[k], rank[k]
+
+    output = torch.zeros((bs, max_det, 6 + nm), device=prediction.device)
+    output[bi, rank] = torch.cat((box[i], conf[i, None], j[i, None].float(), prediction[bi, mi:, a[i]]), 1)
+    n = n.clamp(max=max_det)
+    if mps:
+        output, n = output.to(device), n.to(device)
+    if as_list:
+        return [x[:m] for x, m in zip(output, n.tolist())]
+    return output, n
+
+
 def clip_boxes(boxes, shape):
     """
     > It takes a list of bounding boxes and a shape (height, width) and clips the bounding boxes to the
@@ -295,6 +428,43 @@ def scale_image(im1_shape, masks, im0_shape, ratio_pad=None):
     return masks
 
 
+def letterbox(ims, new_shape=(640, 640), auto=False, stride=32, scaleup=True):
+    """
+    > Batched LetterBox on the device of the frames, followed by BGR to RGB and scaling to 0-1, in a handful of torch
+    ops instead of a cv2 resize and border per frame
+
+    Args:
+      ims: uint8 BGR frames of the same shape, [n, h, w, 3]
+      new_shape: model input shape, [h, w]
+      auto: pad to the minimum rectangle that is a multiple of stride
+      stride: model stride
+      scaleup: allow upscaling
+
+    Returns:
+      float RGB images, [n, 3, h', w'], same values as LetterBox followed by / 255 up to interpolation rounding.
+    """
+    h, w = ims.shape[1:3]
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    r = min(new_shape[0] / h, new_shape[1] / w)
+    if not scaleup:  # only scale down, do not scale up
+        r = min(r, 1.0)
+    new_unpad = int(round(w * r)), int(round(h * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]  # wh padding
+    if auto:  # minimum rectangle
+        dw, dh = dw % stride, dh % stride
+    dw /= 2  # divide padding into 2 sides
+    dh /= 2
+
+    x = ims.permute(0, 3, 1, 2).flip(1).float()  # BHWC to BCHW, BGR to RGB
+    if (w, h) != new_unpad:  # resize
+        x = F.interpolate(x, size=new_unpad[::-1], mode='bilinear', align_corners=False)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    x = F.pad(x, (left, right, top, bottom), value=114.0)  # add border
+    return x.div_(255)
+
+
 def xyxy2xywh(x):
     """
     > It takes a list of bounding boxes, and converts them from the format [x1, y1, x2, y2] to [x, y, w,
@@ -491,14 +661,32 @@ def resample_segments(segments, n=1000):
     Returns:
       the resampled segments.
     """
-    for i, s in enumerate(segments):
-        s = np.concatenate((s, s[0:1, :]), axis=0)
-        x = np.linspace(0, len(s) - 1, n)
-        xp = np.arange(len(s))
-        segments[i] = np.concatenate([np.interp(x, xp, s[:, i]) for i in range(2)]).reshape(2, -1).T  # segment xy
+    if len(segments):
+        segments[:] = list(resample_polygons(np.concatenate(segments, 0), [len(s) for s in segments], n))
     return segments
 
 
+def resample_polygons(points, lengths, n=1000):
+    """
+    > It resamples all polygons of a ragged array to n points each with one np.interp() call per coordinate, the
+    closed polygons are laid end to end on a single axis with a gap of one between them
+
+    Args:
+      points: (P, 2) points of all polygons, concatenated.
+      lengths: number of points of every polygon.
+      n: number of points to resample every polygon to. Defaults to 1000
+
+    Returns:
+      (N, n, 2) resampled polygons, the last point of each is its first.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    closed = np.insert(points, starts + lengths, points[starts], axis=0)  # append the first point of every polygon
+    x = np.linspace(0, 1, n) * lengths[:, None] + (starts + np.arange(len(lengths)))[:, None]  # starts in closed
+    xp = np.arange(len(closed))
+    return np.stack([np.interp(x.ravel(), xp, closed[:, i]) for i in range(2)], -1).reshape(len(lengths), n, 2)
+
+
 def crop_mask(masks, boxes):
     """
     > It takes a mask and a bounding box, and returns a mask that is cropped to the bounding box
@@ -53,9 +53,88 @@ def select_highest_overlaps(mask_pos, overlaps, n_max_boxes):
     return target_gt_idx, fg_mask, mask_pos
 
 
+def anchor_grids(anc_points):
+    """recover the grids of anchors laid out by make_anchors(), row-major and level after level
+
+    Args:
+        anc_points (Tensor): shape(h*w, 2)
+    Return:
+        (list): (start, h, w, x0, y0, stride) of every level, None if the anchors are not laid out as grids
+    """
+    y = anc_points[:, 1]
+    starts = [0] + (torch.nonzero(y[1:] < y[:-1]).view(-1) + 1).tolist() + [len(anc_points)]
+    grids = []
+    for a, b in zip(starts[:-1], starts[1:]):
+        x0, y0 = anc_points[a].tolist()
+        w = int((y[a:b] == y0).sum())
+        h = (b - a) // w
+        s = anc_points[a + 1, 0].item() - x0 if w > 1 else y[a + w].item() - y0 if h > 1 else 1.0
+        i = torch.arange(b - a, device=anc_points.device)
+        grid = torch.stack((i % w, torch.div(i, w, rounding_mode='floor')), -1) * s + anc_points.new_tensor([x0, y0])
+        if h * w != b - a or s <= 0 or not torch.allclose(grid.to(anc_points.dtype), anc_points[a:b], atol=s / 100):
+            return None
+        grids.append((a, h, w, x0, y0, s))
+    return grids
+
+
+def select_candidate_pairs(xy_centers, gt_bboxes, grids, eps=1e-9):
+    """select the anchor centers in gts, looking only at the window of every level that each gt covers
+
+    Args:
+        xy_centers (Tensor): shape(h*w, 2)
+        gt_bboxes (Tensor): shape(n_boxes, 4)
+        grids (list): anchor_grids(xy_centers)
+    Return:
+        gt_idx (Tensor): shape(n_pairs), gt of every candidate pair
+        anchor_idx (Tensor): shape(n_pairs), anchor of every candidate pair
+    """
+    device = gt_bboxes.device
+    start, h, w, x0, y0, s = torch.tensor(grids, dtype=torch.float64, device=device).T
+    boxes = gt_bboxes.double()[:, None]  # n_boxes, 1, 4
+    x_lo = ((boxes[..., 0] - x0) / s).floor().clamp(0).long()  # n_boxes, n_levels
+    y_lo = ((boxes[..., 1] - y0) / s).floor().clamp(0).long()
+    nx = (torch.minimum(((boxes[..., 2] - x0) / s).ceil(), w - 1).long() - x_lo + 1).clamp(0)
+    ny = (torch.minimum(((boxes[..., 3] - y0) / s).ceil(), h - 1).long() - y_lo + 1).clamp(0)
+
+    # enumerate the anchors of every (gt, level) window
+    counts = (nx * ny).view(-1)
+    window = torch.arange(len(counts), device=device).repeat_interleave(counts)
+    i = torch.arange(len(window), device=device) - (counts.cumsum(0) - counts)[window]
+    nx, level = nx.view(-1)[window], window % len(grids)
+    anchor_idx = start.long()[level] + (y_lo.view(-1)[window] + torch.div(i, nx, rounding_mode='floor')) * \
+        w.long()[level] + x_lo.view(-1)[window] + i % nx
+    gt_idx = torch.div(window, len(grids), rounding_mode='floor')
+
+    # windows are a superset, keep the anchors select_candidates_in_gts() would
+    xy = xy_centers[anchor_idx]
+    lt, rb = gt_bboxes[gt_idx].chunk(2, 1)
+    keep = torch.cat((xy - lt, rb - xy), 1).amin(1) > eps
+    return gt_idx[keep], anchor_idx[keep]
+
+
+def segment_max(values, index, n):
+    """max of the non-negative values of every index
+
+    Args:
+        values (Tensor): shape(m)
+        index (Tensor): shape(m), in [0, n)
+    Return:
+        (Tensor): shape(n), 0 for indices without values
+    """
+    out = values.new_zeros(n)
+    rank = torch.empty_like(index)
+    rank[values.argsort()] = torch.arange(len(values), device=values.device)
+    order = (index * len(values) + rank).argsort()  # by index, then ascending values
+    index, values = index[order], values[order]
+    last = torch.ones_like(index, dtype=torch.bool)
+    last[:-1] = index[1:] != index[:-1]
+    out[index[last]] = values[last]
+    return out
+
+
 class TaskAlignedAssigner(nn.Module):
 
-    def __init__(self, topk=13, num_classes=80, alpha=1.0, beta=6.0, eps=1e-9):
+    def __init__(self, topk=13, num_classes=80, alpha=1.0, beta=6.0, eps=1e-9, sparse=True):
         super().__init__()
         self.topk = topk
         self.num_classes = num_classes
@@ -63,6 +142,7 @@ class TaskAlignedAssigner(nn.Module):
         self.alpha = alpha
         self.beta = beta
         self.eps = eps
+        self.sparse = sparse  # assign gt-anchor pairs instead of dense (b, n_max_boxes, h*w) tensors, same results
 
     @torch.no_grad()
     def forward(self, pd_scores, pd_bboxes, anc_points, gt_labels, gt_bboxes, mask_gt):
@@ -81,6 +161,7 @@ class TaskAlignedAssigner(nn.Module):
             target_bboxes (Tensor): shape(bs, num_total_anchors, 4)
             target_scores (Tensor): shape(bs, num_total_anchors, num_classes)
             fg_mask (Tensor): shape(bs, num_total_anchors)
+            target_gt_idx (Tensor): shape(bs, num_total_anchors)
         """
         self.bs = pd_scores.size(0)
         self.n_max_boxes = gt_bboxes.size(1)
@@ -91,6 +172,10 @@ class TaskAlignedAssigner(nn.Module):
                     torch.zeros_like(pd_scores).to(device), torch.zeros_like(pd_scores[..., 0]).to(device),
                     torch.zeros_like(pd_scores[..., 0]).to(device))
 
+        grids = anchor_grids(anc_points) if self.sparse else None
+        if grids is not None:
+            return self.forward_sparse(pd_scores, pd_bboxes, anc_points, gt_labels, gt_bboxes, mask_gt, grids)
+
         mask_pos, align_metric, overlaps = self.get_pos_mask(pd_scores, pd_bboxes, gt_labels, gt_bboxes, anc_points,
                                                              mask_gt)
 
@@ -108,6 +193,107 @@ class TaskAlignedAssigner(nn.Module):
 
         return target_labels, target_bboxes, target_scores, fg_mask.bool(), target_gt_idx
 
+    def forward_sparse(self, pd_scores, pd_bboxes, anc_points, gt_labels, gt_bboxes, mask_gt, grids):
+        """forward() on the gt-anchor pairs in the candidate windows of the valid gts only
+
+        Memory grows with the number of candidate pairs rather than with bs * n_max_boxes * num_total_anchors.
+        Pairs are indexed by image, flat gt index (image * n_max_boxes + gt) and anchor.
+        """
+        n_anchors, n_max_boxes = pd_scores.shape[1], self.n_max_boxes
+        valid = torch.nonzero(mask_gt.view(-1)).view(-1)  # flat index of the valid gts
+        gt_idx, anchor_idx = select_candidate_pairs(anc_points, gt_bboxes.view(-1, 4)[valid], grids)
+        gt_idx = valid[gt_idx]
+        batch_idx = torch.div(gt_idx, n_max_boxes, rounding_mode='floor')
+        align_metric, overlaps = self.get_pair_metrics(pd_scores, pd_bboxes, gt_labels, gt_bboxes, batch_idx, gt_idx,
+                                                       anchor_idx)
+        pos = self.select_topk_pairs(align_metric, gt_idx, anchor_idx, self.bs * n_max_boxes, n_anchors)
+        batch_idx, gt_idx, anchor_idx, align_metric, overlaps = (x[pos] for x in (batch_idx, gt_idx, anchor_idx,
+                                                                                    align_metric, overlaps))
+
+        # an anchor assigned to multiple gts goes to the gt, valid or not, it overlaps most, as select_highest_overlaps()
+        fg_idx = batch_idx * n_anchors + anchor_idx
+        multi = torch.bincount(fg_idx, minlength=self.bs * n_anchors)[fg_idx] > 1
+        if multi.any():
+            multi_idx = fg_idx[multi].unique()
+            b, a = torch.div(multi_idx, n_anchors, rounding_mode='floor'), multi_idx % n_anchors
+            multi_overlaps = bbox_iou(gt_bboxes[b], pd_bboxes[b, a].unsqueeze(1), xywh=False, CIoU=True).squeeze(-1)
+            g = multi_overlaps.clamp(0).argmax(1) + b * n_max_boxes
+            metrics = self.get_pair_metrics(pd_scores, pd_bboxes, gt_labels, gt_bboxes, b, g, a)
+            keep = ~multi
+            batch_idx, gt_idx, anchor_idx = torch.cat((batch_idx[keep], b)), torch.cat((gt_idx[keep], g)), \
+                torch.cat((anchor_idx[keep], a))
+            align_metric, overlaps = (torch.cat((x[keep], y)) for x, y in zip((align_metric, overlaps), metrics))
+            fg_idx = batch_idx * n_anchors + anchor_idx
+
+        # assigned target, background anchors point to the first gt of their image
+        target_gt_idx = torch.zeros(self.bs * n_anchors, dtype=torch.long, device=pd_scores.device)
+        target_gt_idx[fg_idx] = gt_idx - batch_idx * n_max_boxes
+        fg_mask = torch.zeros_like(target_gt_idx, dtype=torch.bool)
+        fg_mask[fg_idx] = True
+        target_gt_idx, fg_mask = target_gt_idx.view(self.bs, n_anchors), fg_mask.view(self.bs, n_anchors)
+        flat_idx = target_gt_idx + torch.arange(self.bs, device=pd_scores.device)[:, None] * n_max_boxes
+        target_labels = gt_labels.long().flatten()[flat_idx]  # (b, h*w)
+        target_bboxes = gt_bboxes.view(-1, 4)[flat_idx]  # (b, h*w, 4)
+
+        # normalize
+        pos_align_metrics = segment_max(align_metric, gt_idx, self.bs * n_max_boxes)
+        pos_overlaps = segment_max(overlaps, gt_idx, self.bs * n_max_boxes)
+        norm_align_metric = align_metric * pos_overlaps[gt_idx] / (pos_align_metrics[gt_idx] + self.eps)
+        target_scores = align_metric.new_zeros(self.bs * n_anchors, self.num_classes)
+        target_scores[fg_idx, gt_labels.long().flatten()[gt_idx]] = norm_align_metric
+
+        return target_labels, target_bboxes, target_scores.view(self.bs, n_anchors, -1), fg_mask, target_gt_idx
+
+    def get_pair_metrics(self, pd_scores, pd_bboxes, gt_labels, gt_bboxes, batch_idx, gt_idx, anchor_idx):
+        # get_box_metrics() of the given (image, flat gt index, anchor) pairs
+        bbox_scores = pd_scores[batch_idx, anchor_idx, gt_labels.long().flatten()[gt_idx]]
+        overlaps = bbox_iou(gt_bboxes.view(-1, 4)[gt_idx], pd_bboxes[batch_idx, anchor_idx], xywh=False,
+                            CIoU=True).squeeze(-1).clamp(0)
+        align_metric = bbox_scores.pow(self.alpha) * overlaps.pow(self.beta)
+        return align_metric, overlaps
+
+    def select_topk_pairs(self, metrics, gt_idx, anchor_idx, n_gts, n_anchors):
+        """select_topk_candidates() of the candidate pairs of every gt
+
+        Args:
+            metrics: (n_pairs), align metric of every pair.
+            gt_idx: (n_pairs), flat gt index of every pair, in [0, n_gts).
+            anchor_idx: (n_pairs), anchor of every pair, in [0, n_anchors).
+        Return:
+            (Tensor): (n_pairs) bool, the pairs in the topk of their gt
+        """
+        n = len(metrics)
+        rank = torch.empty_like(gt_idx)
+        rank[metrics.argsort(descending=True)] = torch.arange(n, device=metrics.device)
+        order = (gt_idx * n + rank).argsort()  # by gt, then descending metric
+        counts = torch.bincount(gt_idx, minlength=n_gts)
+        starts = counts.cumsum(0) - counts
+        rank = torch.arange(n, device=metrics.device) - starts[gt_idx[order]]  # rank within gt
+        is_in_topk = torch.zeros_like(gt_idx, dtype=torch.bool)
+        is_in_topk[order] = (rank < self.topk) & (metrics[order] > 0)
+
+        # torch.topk() breaks ties among a row's zeros and at its k-th value arbitrarily, so gts whose topk would pick
+        # some of their zero metric candidates, or tie at the boundary, rerun it on their full row of metrics
+        n_pos = torch.bincount(gt_idx[metrics > 0], minlength=n_gts)
+        ambiguous = (n_pos < self.topk) & (counts > n_pos)
+        tied = torch.nonzero(n_pos > self.topk).view(-1)
+        kth = metrics[order][starts[tied] + self.topk - 1]
+        ambiguous[tied] = kth == metrics[order][starts[tied] + self.topk]
+        ambiguous = torch.nonzero(ambiguous).view(-1)
+        if len(ambiguous):
+            row = torch.full_like(counts, -1)
+            row[ambiguous] = torch.arange(len(ambiguous), device=metrics.device)
+            row = row[gt_idx]
+            chunk = max(1, (1 << 24) // n_anchors)  # rows at a time
+            for i in range(0, len(ambiguous), chunk):
+                p = torch.nonzero((row >= i) & (row < i + chunk)).view(-1)
+                r, a = row[p] - i, anchor_idx[p]
+                rows = metrics.new_zeros(min(chunk, len(ambiguous) - i), n_anchors)
+                rows[r, a] = metrics[p]
+                topk_idxs = torch.topk(rows, self.topk, dim=-1)[1]
+                is_in_topk[p] = torch.zeros_like(rows, dtype=torch.bool).scatter_(1, topk_idxs, True)[r, a]
+        return is_in_topk
+
     def get_pos_mask(self, pd_scores, pd_bboxes, gt_labels, gt_bboxes, anc_points, mask_gt):
         # get anchor_align metric, (b, max_num_obj, h*w)
         align_metric, overlaps = self.get_box_metrics(pd_scores, pd_bboxes, gt_labels, gt_bboxes)
@@ -0,0 +1,202 @@
+# Ultralytics YOLO 🚀, GPL-3.0 license
+"""
+Sliced inference utils for high resolution and wide-area sources
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision
+
+from ultralytics.yolo.data.augment import LetterBox
+
+
+@lru_cache(maxsize=32)
+def tile_plan(shape, tile=640, overlap=0.2):
+    """
+    Computes the windows covering an image of a given shape, cached per resolution.
+
+    Window 0 is always the full frame (letterboxed down to the tile size) so that objects larger than the tile overlap
+    are still seen whole. The remaining windows are tile x tile crops spread evenly so that neighbours overlap by at
+    least `overlap` and the last one is flush with the border.
+
+    Args:
+        shape (tuple): (height, width) of the image.
+        tile (int): tile size in pixels.
+        overlap (float): minimum overlap between neighbouring tiles, as a fraction of the tile size.
+
+    Returns:
+        (tuple): windows as (x1, y1, x2, y2) tuples in image pixels.
+    """
+    h, w = shape
+    windows = [(0, 0, w, h)]
+    if h <= tile and w <= tile:
+        return tuple(windows)  # the full frame tile is already native resolution
+
+    def starts(size):
+        if size <= tile:
+            return [0]
+        n = int(np.ceil((size - tile * overlap) / (tile * (1 - overlap))))
+        return np.linspace(0, size - tile, max(n, 2)).round().astype(int).tolist()
+
+    for y in starts(h):
+        for x in starts(w):
+            windows.append((x, y, min(x + tile, w), min(y + tile, h)))
+    return tuple(windows)
+
+
+class Tiler:
+    """
+    Splits frames into overlapping tiles that are inferred as a single batch, and merges the per-tile predictions back
+    into frame coordinates.
+
+    Crop tiles in which nothing was detected for `skip` consecutive frames are left out of the batch, they are
+    rescanned every `skip` frames or as soon as a detection from the full frame tile or a moving region overlaps them.
+    The full frame tile is never skipped.
+
+    Attributes:
+        tile (int): tile size in pixels.
+        overlap (float): overlap between neighbouring tiles, as a fraction of the tile size.
+        skip (int): number of empty frames after which a tile is skipped, 0 to never skip.
+        tiles (list): per tile of the last batch, (frame index, window index, window, gain, (padw, padh)).
+        streams (list): stream index of every frame of the last batch.
+        empty (dict): consecutive frames without detections per (stream index, window index).
+    """
+
+    def __init__(self, tile=640, overlap=0.2, skip=0):
+        self.tile = tile
+        self.overlap = overlap
+        self.skip = skip
+        self.letterbox = LetterBox(tile, auto=False, scaleup=False)
+        self.tiles = []
+        self.windows = []
+        self.streams = []
+        self.empty = defaultdict(int)
+        self.count = 0
+
+    def split(self, im0s, motion=None, streams=None):
+        """
+        Args:
+            im0s (list): BGR HWC frames.
+            motion (list, optional): per frame xyxy boxes of the moving regions, the tiles they overlap are not skipped.
+            streams (list, optional): stream index of every frame, the skipping state is kept per stream. Defaults to
+                the position of the frame in im0s.
+
+        Returns:
+            (np.ndarray): RGB CHW tiles of shape (n, 3, tile, tile), ready for the predictor's preprocess().
+        """
+        self.count += 1
+        rescan = not self.skip or self.count % self.skip == 0
+        tiles, self.tiles = [], []
+        self.windows = [tile_plan(im0.shape[:2], self.tile, self.overlap) for im0 in im0s]
+        self.streams = list(range(len(im0s)) if streams is None else streams)
+        for i, im0 in enumerate(im0s):
+            if motion is not None:
+                self.activate(i, motion[i])
+            for j, (x1, y1, x2, y2) in enumerate(self.windows[i]):
+                if j and not rescan and self.empty[(self.streams[i], j)] >= self.skip:
+                    continue
+                crop = im0[y1:y2, x1:x2]
+                h, w = crop.shape[:2]
+                gain = min(self.tile / h, self.tile / w, 1.0)
+                pad = (self.tile - round(w * gain)) / 2, (self.tile - round(h * gain)) / 2
+                tiles.append(self.letterbox(image=crop))
+                self.tiles.append((i, j, (x1, y1, x2, y2), gain, pad))
+        return np.ascontiguousarray(np.stack(tiles).transpose((0, 3, 1, 2))[:, ::-1])  # HWC to CHW, BGR to RGB
+
+    def to_frame(self, boxes, k):
+        """Maps xyxy boxes from the letterboxed tile k to frame coordinates, in place."""
+        _, _, (x1, y1, x2, y2), gain, (padw, padh) = self.tiles[k]
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - padw) / gain + x1).clamp_(x1, x2)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - padh) / gain + y1).clamp_(y1, y2)
+        return boxes
+
+    def activate(self, i, boxes):
+        """Resets the empty count of the tiles of frame i that overlap any of the xyxy boxes (tensor or array)."""
+        if not len(boxes):
+            return
+        for j, (x1, y1, x2, y2) in enumerate(self.windows[i]):
+            key = (self.streams[i], j)
+            if self.empty.get(key) and \
+                    ((boxes[:, 0] < x2) & (boxes[:, 2] > x1) & (boxes[:, 1] < y2) & (boxes[:, 3] > y1)).any():
+                self.empty[key] = 0
+
+    def merge(self, preds, iou_thres=0.45, agnostic=False, max_det=300):
+        """
+        Maps per tile detections to frame coordinates and suppresses the duplicates found by overlapping tiles.
+
+        Boxes cut by the border of a crop tile are ranked below whole boxes and dropped when they mostly lie inside a
+        kept box of the same class, so that the truncated half of an object seen whole by a neighbouring tile does
+        not survive the IoU based NMS.
+
+        Args:
+            preds (list): per tile detections (n, 6 + nm) in letterboxed tile coordinates, as returned by
+                ops.batched_non_max_suppression(..., as_list=True).
+            iou_thres (float): IoU threshold of the cross-tile NMS.
+            agnostic (bool): class-agnostic cross-tile NMS.
+            max_det (int): maximum number of detections per frame.
+
+        Returns:
+            (list): per frame, the detections (n, 6 + nm) in frame coordinates, sorted by confidence, and their source
+                (n, 2) as (tile index, row in preds[tile index]).
+        """
+        n = len(self.windows)
+        dets, srcs, cuts = [[] for _ in range(n)], [[] for _ in range(n)], [[] for _ in range(n)]
+        for k, (pred, (i, j, window, *_)) in enumerate(zip(preds, self.tiles)):
+            key = (self.streams[i], j)
+            self.empty[key] = 0 if len(pred) else self.empty[key] + 1
+            det = self.to_frame(pred.clone(), k)
+            x1, y1, x2, y2 = window
+            w, h = self.windows[i][0][2:]
+            cut = torch.zeros_like(det[:, 0], dtype=torch.bool)
+            if j:  # crop tile, an edge is a cut unless it is also the frame border
+                cut |= (det[:, 0] <= x1 + 1) & (x1 > 0) | (det[:, 1] <= y1 + 1) & (y1 > 0)
+                cut |= (det[:, 2] >= x2 - 1) & (x2 < w) | (det[:, 3] >= y2 - 1) & (y2 < h)
+            else:  # full frame tile, wake up the skipped tiles its detections fall in
+                self.activate(i, det)
+            dets[i].append(det)
+            cuts[i].append(cut)
+            srcs[i].append(torch.stack((torch.full_like(det[:, 0], k), torch.arange(len(det), device=det.device)), 1))
+
+        output = []
+        for i in range(n):
+            det, src, cut = torch.cat(dets[i]), torch.cat(srcs[i]).long(), torch.cat(cuts[i])
+            cls = det[:, 5] * (not agnostic)
+            keep = torchvision.ops.batched_nms(det[:, :4], det[:, 4] - cut.float(), cls, iou_thres)
+            det, src, cut, cls = det[keep], src[keep], cut[keep], cls[keep]
+            if cut.any() and not cut.all():
+                a, b = det[cut, :4], det[~cut, :4]
+                inter = (torch.min(a[:, None, 2:], b[:, 2:]) - torch.max(a[:, None, :2], b[:, :2])).clamp(0).prod(2)
+                ios = inter / (a[:, 2:] - a[:, :2]).prod(1, keepdim=True).clamp(1e-7)  # intersection over cut box area
+                covered = ((ios > iou_thres) & (cls[cut, None] == cls[~cut])).any(1)
+                cut[cut.clone()] = covered
+                det, src = det[~cut], src[~cut]
+            order = det[:, 4].argsort(descending=True)[:max_det]
+            output.append((det[order], src[order]))
+        return output
+
+    def paste_masks(self, masks, k, shape):
+        """
+        Pastes tile resolution masks of tile k into frame sized canvases.
+
+        Args:
+            masks (torch.Tensor): (n, tile, tile) masks of the letterboxed tile.
+            k (int): tile index.
+            shape (tuple): (height, width) of the frame.
+
+        Returns:
+            (torch.Tensor): the (n, height, width) canvases.
+        """
+        _, _, (x1, y1, x2, y2), gain, (padw, padh) = self.tiles[k]
+        out = torch.zeros((len(masks), *shape[:2]), dtype=masks.dtype, device=masks.device)
+        top, left = int(round(padh - 0.1)), int(round(padw - 0.1))
+        h, w = round((y2 - y1) * gain), round((x2 - x1) * gain)
+        masks = masks[:, top:top + h, left:left + w]
+        if gain != 1:
+            masks = F.interpolate(masks[None].float(), (y2 - y1, x2 - x1), mode='bilinear',
+                                  align_corners=False)[0].gt_(0.5).to(out.dtype)
+        out[:, y1:y2, x1:x2] = masks
+        return out
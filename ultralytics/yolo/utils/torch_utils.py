@@ -1,5 +1,6 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
+import hashlib
 import math
 import os
 import platform
@@ -18,7 +19,7 @@ import torch.nn.functional as F
 from torch.nn.parallel import DistributedDataParallel as DDP
 
 import ultralytics
-from ultralytics.yolo.utils import DEFAULT_CONFIG_DICT, DEFAULT_CONFIG_KEYS, LOGGER
+from ultralytics.yolo.utils import DEFAULT_CONFIG_DICT, DEFAULT_CONFIG_KEYS, LOGGER, USER_CONFIG_DIR
 from ultralytics.yolo.utils.checks import git_describe
 
 from .checks import check_version
@@ -113,7 +114,7 @@ def fuse_conv_and_bn(conv, bn):
                           bias=True).requires_grad_(False).to(conv.weight.device)
 
     # Prepare filters
-    w_conv = conv.weight.clone().view(conv.out_channels, -1)
+    w_conv = conv.weight.clone().reshape(conv.out_channels, -1)
     w_bn = torch.diag(bn.weight.div(torch.sqrt(bn.eps + bn.running_var)))
     fusedconv.weight.copy_(torch.mm(w_bn, w_conv).view(fusedconv.weight.shape))
 
@@ -270,6 +271,97 @@ class ModelEMA:
         copy_attr(self.ema, model, include, exclude)
 
 
+class HostToDevice:
+    """ Host to device transfers of numpy batches through pinned staging buffers and non-blocking copies on a side CUDA
+    stream. Staging buffers are double buffered so that the next batch can be staged while the copy of the current one
+    is in flight, and the consumer stream waits on an event instead of the host. Falls back to plain copies on CPU.
+    """
+
+    def __init__(self, device, slots=2):
+        self.device = device
+        self.cuda = device.type == 'cuda'
+        self.stream = torch.cuda.Stream(device) if self.cuda else None
+        self.buffers = [{} for _ in range(slots)]  # pinned buffers per slot, by array index
+        self.events = [None] * slots  # copy done events per slot
+        self.slot = 0
+
+    def __call__(self, arrays):
+        # Start copying a list of numpy arrays to the device, returns a handle for ready()
+        if not self.cuda:
+            return [torch.from_numpy(np.ascontiguousarray(a)).to(self.device) for a in arrays], None
+        self.slot = (self.slot + 1) % len(self.buffers)
+        buffers, event = self.buffers[self.slot], self.events[self.slot]
+        if event is not None:
+            event.synchronize()  # the last copy out of this slot's buffers is done
+        tensors = []
+        with torch.cuda.stream(self.stream):
+            for i, a in enumerate(arrays):
+                buf = buffers.get(i)
+                if buf is None or buf.shape != a.shape or buf.numpy().dtype != a.dtype:
+                    buf = buffers[i] = torch.empty(a.shape, dtype=torch.from_numpy(np.empty(0, a.dtype)).dtype,
+                                                        pin_memory=True)
+                np.copyto(buf.numpy(), a)
+                tensors.append(buf.to(self.device, non_blocking=True))
+            event = self.events[self.slot] = torch.cuda.Event()
+            event.record(self.stream)
+        return tensors, event
+
+    def ready(self, handle):
+        # Make the current stream wait for the copies of a handle, returns the device tensors
+        tensors, event = handle
+        if event is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(event)
+            for t in tensors:
+                t.record_stream(stream)  # allocated on the side stream, used on this one
+        return tensors
+
+
+def file_hash(file, chunk=1 << 20):
+    # Returns the sha1 of the contents of a file
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for b in iter(lambda: f.read(chunk), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+def cached_model(weights, device, fp16, build, cache_dir=USER_CONFIG_DIR / 'model_cache'):
+    """
+    Returns the model built by `build()`, restored from a cache of ready to run (fused, eval mode, on device) models
+    when one was saved for the same weights contents, device, dtype and torch version, else built and saved.
+
+    Args:
+        weights (str | Path): weights file the model is built from.
+        device (torch.device): device the model runs on.
+        fp16 (bool): whether the model is half precision.
+        build (callable): builds the model when it is not cached.
+        cache_dir (str | Path): cache directory.
+
+    Returns:
+        (nn.Module): the model.
+        (bool): whether it was restored from the cache.
+    """
+    dev = f'{device.type}{device.index or 0}' if device.type == 'cuda' else device.type
+    key = f"{Path(weights).stem}-{file_hash(weights)[:16]}-{dev}-{'fp16' if fp16 else 'fp32'}-torch{torch.__version__}"
+    f = Path(cache_dir) / f'{key}.pt'
+    if f.exists():
+        try:
+            kwargs = {'weights_only': False} if check_version(torch.__version__, '1.13.0') else {}
+            return torch.load(f, map_location=device, **kwargs), True
+        except Exception as e:
+            LOGGER.warning(f'WARNING ⚠️ could not restore cached model {f}, rebuilding it: {e}')
+    model = build()
+    try:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_suffix(f'.{os.getpid()}.tmp')
+        torch.save(model, tmp)
+        tmp.replace(f)  # atomic, concurrent launches never read a partial file
+    except Exception as e:
+        LOGGER.warning(f'WARNING ⚠️ could not cache model to {f}: {e}')
+    return model, False
+
+
 def strip_optimizer(f='best.pt', s=''):
     """
     Strip optimizer from 'f' to finalize training, optionally save as 's'.
@@ -1,11 +1,15 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
+import importlib
 from pathlib import Path
 
-from ultralytics.yolo.v8 import classify, detect, segment
-
 ROOT = Path(__file__).parents[0]  # yolov8 ROOT
 
 __all__ = ["classify", "segment", "detect"]
 
-from ultralytics.yolo.configs import hydra_patch  # noqa (patch hydra cli)
+
+def __getattr__(name):
+    # a task is only imported when used, e.g. predicting with detect doesn't load segment's tracker
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
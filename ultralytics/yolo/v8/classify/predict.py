@@ -1,10 +1,10 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
-import hydra
 import torch
 
+from ultralytics.yolo.configs import hydra_main
 from ultralytics.yolo.engine.predictor import BasePredictor
-from ultralytics.yolo.utils import DEFAULT_CONFIG, ROOT
+from ultralytics.yolo.utils import ROOT
 from ultralytics.yolo.utils.checks import check_imgsz
 from ultralytics.yolo.utils.plotting import Annotator
 
@@ -15,7 +15,7 @@ class ClassificationPredictor(BasePredictor):
         return Annotator(img, example=str(self.model.names), pil=True)
 
     def preprocess(self, img):
-        img = torch.Tensor(img).to(self.model.device)
+        img = (img if isinstance(img, torch.Tensor) else torch.Tensor(img)).to(self.model.device)
         img = img.half() if self.model.fp16 else img.float()  # uint8 to fp16/32
         return img
 
@@ -27,14 +27,14 @@ class ClassificationPredictor(BasePredictor):
         self.seen += 1
         im0 = im0.copy()
         if self.webcam:  # batch_size >= 1
-            log_string += f'{idx}: '
-            frame = self.dataset.cound
+            log_string += f'{self.stream}: '
+            frame = self.batch_state['count']
         else:
-            frame = getattr(self.dataset, 'frame', 0)
+            frame = self.batch_state.get('frame', 0)
 
         self.data_path = p
         # save_path = str(self.save_dir / p.name)  # im.jpg
-        self.txt_path = str(self.save_dir / 'labels' / p.stem) + ('' if self.dataset.mode == 'image' else f'_{frame}')
+        self.txt_path = str(self.save_dir / 'labels' / p.stem) + ('' if self.batch_state['mode'] == 'image' else f'_{frame}')
         log_string += '%gx%g ' % im.shape[2:]  # print string
         self.annotator = self.get_annotator(im0)
 
@@ -55,7 +55,7 @@ class ClassificationPredictor(BasePredictor):
         return log_string
 
 
-@hydra.main(version_base=None, config_path=str(DEFAULT_CONFIG.parent), config_name=DEFAULT_CONFIG.name)
+@hydra_main
 def predict(cfg):
     cfg.model = cfg.model or "squeezenet1_0"
     cfg.imgsz = check_imgsz(cfg.imgsz, min_dim=2)  # check image size
@@ -1,10 +1,13 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
-import hydra
+import numpy as np
 import torch
+from omegaconf import OmegaConf
 
+from ultralytics.yolo.configs import hydra_main
+from ultralytics.yolo.data.utils import polygon2mask
 from ultralytics.yolo.engine.predictor import BasePredictor
-from ultralytics.yolo.utils import DEFAULT_CONFIG, ROOT, ops
+from ultralytics.yolo.utils import ROOT, ops
 from ultralytics.yolo.utils.checks import check_imgsz
 from ultralytics.yolo.utils.plotting import Annotator, colors, save_one_box
 
@@ -15,17 +18,103 @@ class DetectionPredictor(BasePredictor):
         return Annotator(img, line_width=self.args.line_thickness, example=str(self.model.names))
 
     def preprocess(self, img):
-        img = torch.from_numpy(img).to(self.model.device)
+        img = (img if isinstance(img, torch.Tensor) else torch.from_numpy(img)).to(self.model.device)
         img = img.half() if self.model.fp16 else img.float()  # uint8 to fp16/32
         img /= 255  # 0 - 255 to 0.0 - 1.0
         return img
 
+    def candidate_filters(self, img, orig_img):
+        """
+        Per-image filters applied to the raw candidates before NMS, as keyword arguments of
+        ops.batched_non_max_suppression(). `classes` and `roi` are either shared by all streams or given as a list with
+        one entry per stream, `roi` is a polygon in original image pixels, rasterised at input resolution and cached.
+        In tiled mode the images are tiles, per stream classes are given to every tile of the stream and `roi` is applied
+        to the merged detections by roi_keep() instead.
+        """
+        classes = self.args.classes
+        classes = OmegaConf.to_container(classes) if OmegaConf.is_config(classes) else classes
+        if isinstance(classes, list) and not all(isinstance(c, int) for c in classes):  # per stream
+            streams = [self.streams[t[0]] for t in self.tiler.tiles] if self.tiler else self.streams
+            classes = [classes[i] if i < len(classes) else None for i in streams]
+        if self.tiler:
+            return dict(classes=classes, min_wh=self.args.min_wh, roi_mask=None)
+
+        roi_mask = None
+        roi = self.roi_polygons()
+        if roi:
+            masks = []
+            for i, stream in enumerate(self.streams):
+                shape = orig_img[i].shape if self.webcam else orig_img.shape
+                key = (stream, tuple(img.shape[2:]), shape[:2])
+                if key not in self.roi_masks:
+                    polygon = roi[stream] if stream < len(roi) else None
+                    if polygon is None:
+                        mask = np.ones(img.shape[2:], dtype=np.uint8)
+                    else:  # original image to letterboxed input coordinates, inverse of ops.scale_boxes()
+                        gain = min(img.shape[2] / shape[0], img.shape[3] / shape[1])
+                        pad = (img.shape[3] - shape[1] * gain) / 2, (img.shape[2] - shape[0] * gain) / 2
+                        mask = polygon2mask(img.shape[2:], [(np.asarray(polygon) * gain + pad).reshape(-1)])
+                    self.roi_masks[key] = torch.from_numpy(mask).bool().to(img.device)
+                masks.append(self.roi_masks[key])
+            roi_mask = torch.stack(masks)
+        return dict(classes=classes, min_wh=self.args.min_wh, roi_mask=roi_mask)
+
+    def roi_polygons(self):
+        # Returns `roi` as one polygon, or None, per stream
+        roi = self.args.roi
+        roi = OmegaConf.to_container(roi) if OmegaConf.is_config(roi) else roi
+        if roi and roi[0] is not None and isinstance(roi[0][0], (int, float)):  # shared polygon
+            roi = [roi] * (max(self.streams) + 1)
+        return roi
+
+    def roi_keep(self, dets, orig_img):
+        """
+        Returns per frame a boolean tensor selecting the merged tile detections whose box center falls inside of the
+        stream's `roi`, rasterised at frame resolution and cached, or None when no `roi` is set.
+        """
+        roi = self.roi_polygons()
+        if not roi:
+            return None
+        keep = []
+        for i, (det, stream) in enumerate(zip(dets, self.streams)):
+            shape = orig_img[i].shape if self.webcam else orig_img.shape
+            key = (stream, None, shape[:2])
+            if key not in self.roi_masks:
+                polygon = roi[stream] if stream < len(roi) else None
+                mask = np.ones(shape[:2], dtype=np.uint8) if polygon is None else \
+                    polygon2mask(shape[:2], [np.asarray(polygon).reshape(-1)])
+                self.roi_masks[key] = torch.from_numpy(mask).bool().to(det.device)
+            x = ((det[:, 0] + det[:, 2]) / 2).long().clamp_(0, shape[1] - 1)
+            y = ((det[:, 1] + det[:, 3]) / 2).long().clamp_(0, shape[0] - 1)
+            keep.append(self.roi_masks[key][y, x])
+        return keep
+
     def postprocess(self, preds, img, orig_img):
-        preds = ops.non_max_suppression(preds,
-                                        self.args.conf,
-                                        self.args.iou,
-                                        agnostic=self.args.agnostic_nms,
-                                        max_det=self.args.max_det)
+        if self.tiler:
+            preds = ops.batched_non_max_suppression(preds,
+                                                    self.args.conf,
+                                                    self.args.iou,
+                                                    agnostic=self.args.agnostic_nms,
+                                                    max_det=self.args.max_det,
+                                                    as_list=True,
+                                                    max_candidates=self.args.max_candidates,
+                                                    **self.candidate_filters(img, orig_img))
+            preds = [det for det, _ in self.tiler.merge(preds, self.args.iou, self.args.agnostic_nms, self.args.max_det)]
+            keep = self.roi_keep(preds, orig_img)
+            if keep is not None:
+                preds = [pred[k] for pred, k in zip(preds, keep)]
+            for pred in preds:
+                pred[:, :4] = pred[:, :4].round()
+            return preds
+
+        preds = ops.batched_non_max_suppression(preds,
+                                                self.args.conf,
+                                                self.args.iou,
+                                                agnostic=self.args.agnostic_nms,
+                                                max_det=self.args.max_det,
+                                                as_list=True,
+                                                max_candidates=self.args.max_candidates,
+                                                **self.candidate_filters(img, orig_img))
 
         for i, pred in enumerate(preds):
             shape = orig_img[i].shape if self.webcam else orig_img.shape
@@ -41,14 +130,14 @@ class DetectionPredictor(BasePredictor):
         self.seen += 1
         im0 = im0.copy()
         if self.webcam:  # batch_size >= 1
-            log_string += f'{idx}: '
-            frame = self.dataset.count
+            log_string += f'{self.stream}: '
+            frame = self.batch_state['count']
         else:
-            frame = getattr(self.dataset, 'frame', 0)
+            frame = self.batch_state.get('frame', 0)
 
         self.data_path = p
         # save_path = str(self.save_dir / p.name)  # im.jpg
-        self.txt_path = str(self.save_dir / 'labels' / p.stem) + ('' if self.dataset.mode == 'image' else f'_{frame}')
+        self.txt_path = str(self.save_dir / 'labels' / p.stem) + ('' if self.batch_state['mode'] == 'image' else f'_{frame}')
         log_string += '%gx%g ' % im.shape[2:]  # print string
         self.annotator = self.get_annotator(im0)
 
@@ -83,7 +172,7 @@ class DetectionPredictor(BasePredictor):
         return log_string
 
 
-@hydra.main(version_base=None, config_path=str(DEFAULT_CONFIG.parent), config_name=DEFAULT_CONFIG.name)
+@hydra_main
 def predict(cfg):
     cfg.model = cfg.model or "yolov8n.pt"
     cfg.imgsz = check_imgsz(cfg.imgsz, min_dim=2)  # check image size
@@ -3,16 +3,15 @@
 import os
 from pathlib import Path
 
-import hydra
-import numpy as np
 import torch
 
+from ultralytics.yolo.configs import hydra_main
 from ultralytics.yolo.data import build_dataloader
 from ultralytics.yolo.data.dataloaders.v5loader import create_dataloader
 from ultralytics.yolo.engine.validator import BaseValidator
-from ultralytics.yolo.utils import DEFAULT_CONFIG, colorstr, ops, yaml_load
+from ultralytics.yolo.utils import colorstr, ops, yaml_load
 from ultralytics.yolo.utils.checks import check_file, check_requirements
-from ultralytics.yolo.utils.metrics import ConfusionMatrix, DetMetrics, box_iou
+from ultralytics.yolo.utils.metrics import APHistogram, ConfusionMatrix, DetMetrics, box_iou
 from ultralytics.yolo.utils.plotting import output_to_target, plot_images
 from ultralytics.yolo.utils.torch_utils import de_parallel
 
@@ -53,7 +52,7 @@ class DetectionValidator(BaseValidator):
         self.confusion_matrix = ConfusionMatrix(nc=self.nc)
         self.seen = 0
         self.jdict = []
-        self.stats = []
+        self.stats = APHistogram(self.nc, self.niou, device=self.device)
 
     def get_desc(self):
         return ('%22s' + '%11s' * 6) % ('Class', 'Images', 'Instances', 'Box(P', "R", "mAP50", "mAP50-95)")
@@ -81,7 +80,7 @@ class DetectionValidator(BaseValidator):
 
             if npr == 0:
                 if nl:
-                    self.stats.append((correct_bboxes, *torch.zeros((2, 0), device=self.device), cls.squeeze(-1)))
+                    self.stats.update((correct_bboxes,), *torch.zeros((2, 0), device=self.device), cls.squeeze(-1))
                     if self.args.plots:
                         self.confusion_matrix.process_batch(detections=None, labels=cls.squeeze(-1))
                 continue
@@ -103,7 +102,7 @@ class DetectionValidator(BaseValidator):
                 # TODO: maybe remove these `self.` arguments as they already are member variable
                 if self.args.plots:
                     self.confusion_matrix.process_batch(predn, labelsn)
-            self.stats.append((correct_bboxes, pred[:, 4], pred[:, 5], cls.squeeze(-1)))  # (conf, pcls, tcls)
+            self.stats.update((correct_bboxes,), pred[:, 4], pred[:, 5], cls.squeeze(-1))  # (conf, pcls, tcls)
 
             # Save
             if self.args.save_json:
@@ -112,10 +111,9 @@ class DetectionValidator(BaseValidator):
             #    save_one_txt(predn, save_conf, shape, file=save_dir / 'labels' / f'{path.stem}.txt')
 
     def get_stats(self):
-        stats = [torch.cat(x, 0).cpu().numpy() for x in zip(*self.stats)]  # to numpy
-        if len(stats) and stats[0].any():
-            self.metrics.process(*stats)
-        self.nt_per_class = np.bincount(stats[-1].astype(int), minlength=self.nc)  # number of targets per class
+        if self.stats.tp[0].any():
+            self.metrics.process(self.stats)
+        self.nt_per_class = self.stats.nt.cpu().numpy()  # number of targets per class
         return self.metrics.results_dict
 
     def print_results(self):
@@ -126,7 +124,7 @@ class DetectionValidator(BaseValidator):
                 f'WARNING ⚠️ no labels found in {self.args.task} set, can not compute metrics without labels')
 
         # Print results per class
-        if (self.args.verbose or not self.training) and self.nc > 1 and len(self.stats):
+        if (self.args.verbose or not self.training) and self.nc > 1 and self.nt_per_class.any():
             for i, c in enumerate(self.metrics.ap_class_index):
                 self.logger.info(pf % (self.names[c], self.seen, self.nt_per_class[c], *self.metrics.class_result(i)))
 
@@ -143,20 +141,36 @@ class DetectionValidator(BaseValidator):
             correct (array[N, 10]), for 10 IoU levels
         """
         iou = box_iou(labels[:, 1:], detections[:, :4])
-        correct = np.zeros((detections.shape[0], self.iouv.shape[0])).astype(bool)
-        correct_class = labels[:, 0:1] == detections[:, 5]
-        for i in range(len(self.iouv)):
-            x = torch.where((iou >= self.iouv[i]) & correct_class)  # IoU > threshold and classes match
-            if x[0].shape[0]:
-                matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]),
-                                    1).cpu().numpy()  # [label, detect, iou]
-                if x[0].shape[0] > 1:
-                    matches = matches[matches[:, 2].argsort()[::-1]]
-                    matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                    # matches = matches[matches[:, 2].argsort()[::-1]]
-                    matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-                correct[matches[:, 1].astype(int), i] = True
-        return torch.tensor(correct, dtype=torch.bool, device=detections.device)
+        return self.match_predictions(iou, labels[:, 0:1] == detections[:, 5])
+
+    def match_predictions(self, iou, correct_class):
+        """
+        Return correct prediction matrix for all IoU levels at once, on the device of iou
+        Each detection matches the label of its class it overlaps most, and each label keeps the first (most confident)
+        of the detections that match it above the IoU level
+        Arguments:
+            iou (array[M, N]), IoU of every label and detection
+            correct_class (array[M, N]), whether the label and detection classes match
+        Returns:
+            correct (array[N, 10]), for 10 IoU levels
+        """
+        n = iou.shape[1]
+        if iou.shape[0] == 0 or n == 0:
+            return torch.zeros(n, self.niou, dtype=torch.bool, device=iou.device)
+        best_iou, best_label = torch.where(correct_class, iou, torch.zeros_like(iou)).max(0)  # (N, )
+        order = (best_label * n + torch.arange(n, device=iou.device)).argsort()  # detections by label, then index
+        valid = best_iou[order, None] >= self.iouv.to(iou.device)  # (N, 10)
+
+        # first valid detection of every label, for every IoU level
+        seen = valid.int().cumsum(0)
+        label = best_label[order]
+        first = torch.ones_like(label, dtype=torch.bool)
+        first[1:] = label[1:] != label[:-1]
+        start = torch.where(first, torch.arange(n, device=iou.device), torch.zeros_like(label)).cummax(0)[0]
+        before = torch.where(start[:, None] > 0, seen[(start - 1).clamp(0)], torch.zeros_like(seen))
+        correct = torch.zeros_like(valid)
+        correct[order] = valid & (seen - before == 1)
+        return correct
 
     def get_dataloader(self, dataset_path, batch_size):
         # TODO: manage splits differently
@@ -230,7 +244,7 @@ class DetectionValidator(BaseValidator):
         return stats
 
 
-@hydra.main(version_base=None, config_path=str(DEFAULT_CONFIG.parent), config_name=DEFAULT_CONFIG.name)
+@hydra_main
 def val(cfg):
     cfg.data = cfg.data or "coco128.yaml"
     validator = DetectionValidator(args=cfg)
@@ -1,13 +1,28 @@
+import argparse
+
 import torch
 
-features = torch.load("features.pth")
-qf = features["qf"]
-ql = features["ql"]
-gf = features["gf"]
-gl = features["gl"]
+parser = argparse.ArgumentParser(description="Rank-1 accuracy of features saved by test.py")
+parser.add_argument("--features", default='features.pth', type=str)
+parser.add_argument("--baseline", default='', type=str, help="features to report the rank-1 delta against")
+args = parser.parse_args()
+
+
+def top1(path):
+    features = torch.load(path)
+    qf = features["qf"]
+    ql = features["ql"]
+    gf = features["gf"]
+    gl = features["gl"]
+
+    scores = qf.mm(gf.t())
+    res = scores.topk(5, dim=1)[1][:, 0]
+    top1correct = gl[res].eq(ql).sum().item()
+    return top1correct / ql.size(0)
 
-scores = qf.mm(gf.t())
-res = scores.topk(5, dim=1)[1][:, 0]
-top1correct = gl[res].eq(ql).sum().item()
 
-print("Acc top1:{:.3f}".format(top1correct / ql.size(0)))
+acc = top1(args.features)
+print("Acc top1:{:.3f}".format(acc))
+if args.baseline:
+    acc_base = top1(args.baseline)
+    print("Baseline top1:{:.3f} delta:{:+.3f}".format(acc_base, acc - acc_base))
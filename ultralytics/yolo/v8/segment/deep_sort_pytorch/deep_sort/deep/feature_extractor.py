@@ -1,50 +1,97 @@
 import torch
-import torchvision.transforms as transforms
+import torch.nn.functional as F
+from torchvision.ops import roi_align
 import numpy as np
 import cv2
 import logging
 
-from .model import Net
+from ultralytics.yolo.utils.torch_utils import cached_model
+
+from .model import Net, load_int8
 
 
 class Extractor(object):
-    def __init__(self, model_path, use_cuda=True):
-        self.net = Net(reid=True)
+    DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+    def __init__(self, model_path, use_cuda=True, precision='fp32', channels_last=False, pad_batch=False,
+                 cache_dir=None):
         self.device = "cuda" if torch.cuda.is_available() and use_cuda else "cpu"
-        state_dict = torch.load(model_path, map_location=torch.device(self.device))[
-            'net_dict']
-        self.net.load_state_dict(state_dict)
         logger = logging.getLogger("root.tracker")
-        logger.info("Loading weights from {}... Done!".format(model_path))
-        self.net.to(self.device)
+        # the built net is cached per checkpoint contents with the other models, device and memory format are applied
+        # after restoring it, so that one entry serves every variant
+        if cache_dir:
+            self.net, cached = cached_model(model_path, torch.device("cpu"), False, lambda: self._build(model_path),
+                                            cache_dir)
+        else:
+            self.net, cached = self._build(model_path), False
+        logger.info("{} {}... Done!".format("Restored cached" if cached else "Loading weights from", model_path))
+        int8 = self.net.int8
+        assert precision in self.DTYPES, "precision must be one of {}".format(list(self.DTYPES))
+        if int8:
+            # quantized kernels only run on CPU, and the int8 net runs as quantized
+            self.device = "cpu"
+            precision, channels_last = 'fp32', False
+        elif precision == 'fp16' and self.device == "cpu":
+            precision = 'fp32'  # no fp16 autocast on CPU
+        self.dtype = self.DTYPES[precision]
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.pad_batch = pad_batch
+        self.net.to(self.device, memory_format=self.memory_format)
+        self.net.eval()
         self.size = (64, 128)
-        self.norm = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-        ])
+        self.mean = torch.tensor([0.485, 0.456, 0.406], device=self.device).view(1, 3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225], device=self.device).view(1, 3, 1, 1)
 
     def _preprocess(self, im_crops):
         """
-        TODO:
-            1. to float with scale from 0 to 1
-            2. resize to (64, 128) as Market1501 dataset did
-            3. concatenate to a numpy array
-            3. to torch Tensor
-            4. normalize
+        Resize to (64, 128) as Market1501 dataset did, then scale to [0, 1]
+        and normalize the whole float32 batch at once on the device.
         """
-        def _resize(im, size):
-            return cv2.resize(im.astype(np.float32)/255., size)
+        im_batch = np.stack([cv2.resize(im.astype(np.float32), self.size) for im in im_crops])
+        im_batch = torch.from_numpy(im_batch).to(self.device).permute(0, 3, 1, 2)
+        im_batch = (im_batch / 255. - self.mean) / self.std
+        return im_batch.contiguous(memory_format=self.memory_format)
 
-        im_batch = torch.cat([self.norm(_resize(im, self.size)).unsqueeze(
-            0) for im in im_crops], dim=0).float()
-        return im_batch
+    @staticmethod
+    def _build(model_path):
+        checkpoint = torch.load(model_path, map_location=torch.device("cpu"))
+        if checkpoint.get('int8', False):
+            # written by quantize.py
+            net = load_int8(checkpoint['net_dict'], checkpoint.get('backend', 'fbgemm'))
+        else:
+            net = Net(reid=True)
+            net.load_state_dict(checkpoint['net_dict'])
+        net.int8 = checkpoint.get('int8', False)  # saved with the net, a restored net says whether it is quantized
+        return net
+
+    @staticmethod
+    def _bucket(n):
+        # next power of two, so that cudnn sees a handful of batch shapes only
+        return 1 << (n - 1).bit_length()
 
     def __call__(self, im_crops):
-        im_batch = self._preprocess(im_crops)
-        with torch.no_grad():
-            im_batch = im_batch.to(self.device)
+        return self._forward(self._preprocess(im_crops))
+
+    def from_frame(self, frame, boxes):
+        """
+        Same as __call__ on the crops `boxes` (x1, y1, x2, y2) of an uint8 HWC frame tensor, cut and resized
+        in one roi_align on the device instead of a cv2 resize per crop.
+        """
+        frame = frame.to(self.device).permute(2, 0, 1)[None].float()
+        rois = torch.tensor([[0, *box] for box in boxes], dtype=torch.float32, device=self.device)
+        im_batch = roi_align(frame, rois, self.size[::-1], sampling_ratio=1, aligned=True)
+        im_batch = (im_batch / 255. - self.mean) / self.std
+        return self._forward(im_batch.contiguous(memory_format=self.memory_format))
+
+    def _forward(self, im_batch):
+        n = len(im_batch)
+        if self.pad_batch and self._bucket(n) > n:
+            im_batch = torch.cat([im_batch, im_batch.new_zeros((self._bucket(n) - n, *im_batch.shape[1:]))])
+            im_batch = im_batch.contiguous(memory_format=self.memory_format)
+        with torch.no_grad(), torch.autocast(self.device, dtype=self.dtype, enabled=self.dtype != torch.float32):
             features = self.net(im_batch)
-        return features.cpu().numpy()
+        # normalize again in float32 for the cosine metric
+        return F.normalize(features[:n].float(), dim=1).cpu().numpy()
 
 
 if __name__ == '__main__':
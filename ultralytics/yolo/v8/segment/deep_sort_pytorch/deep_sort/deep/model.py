@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.quantization import DeQuantStub, QuantStub, convert, fuse_modules, get_default_qconfig, prepare
 
 
 class BasicBlock(nn.Module):
@@ -29,6 +30,8 @@ class BasicBlock(nn.Module):
                 nn.BatchNorm2d(c_out)
             )
             self.is_downsample = True
+        # add + relu as a module so that it can be observed and quantized
+        self.skip_add = nn.quantized.FloatFunctional()
 
     def forward(self, x):
         y = self.conv1(x)
@@ -38,7 +41,13 @@ class BasicBlock(nn.Module):
         y = self.bn2(y)
         if self.is_downsample:
             x = self.downsample(x)
-        return F.relu(x.add(y), True)
+        return self.skip_add.add_relu(x, y)
+
+    def fuse(self):
+        # fold Conv-BN(-ReLU) in place, the block must be in eval mode
+        fuse_modules(self, [['conv1', 'bn1', 'relu'], ['conv2', 'bn2']], inplace=True)
+        if self.is_downsample:
+            fuse_modules(self.downsample, [['0', '1']], inplace=True)
 
 
 def make_layers(c_in, c_out, repeat_times, is_downsample=False):
@@ -76,6 +85,9 @@ class Net(nn.Module):
         self.avgpool = nn.AvgPool2d((8, 4), 1)
         # 256 1 1
         self.reid = reid
+        # no-ops in float, mark where the int8 region starts and ends
+        self.quant = QuantStub()
+        self.dequant = DeQuantStub()
         self.classifier = nn.Sequential(
             nn.Linear(512, 256),
             nn.BatchNorm1d(256),
@@ -85,12 +97,14 @@ class Net(nn.Module):
         )
 
     def forward(self, x):
+        x = self.quant(x)
         x = self.conv(x)
         x = self.layer1(x)
         x = self.layer2(x)
         x = self.layer3(x)
         x = self.layer4(x)
         x = self.avgpool(x)
+        x = self.dequant(x)
         x = x.view(x.size(0), -1)
         # B x 128
         if self.reid:
@@ -100,6 +114,38 @@ class Net(nn.Module):
         x = self.classifier(x)
         return x
 
+    def fuse(self):
+        fuse_modules(self.conv, [['0', '1', '2']], inplace=True)
+        for layer in (self.layer1, self.layer2, self.layer3, self.layer4):
+            for block in layer:
+                block.fuse()
+        return self
+
+
+def prepare_int8(net, backend='fbgemm'):
+    """
+    Fuse `net` and insert observers for post-training static quantization.
+    Only the convolutional trunk is quantized, the classifier stays in float.
+    """
+    torch.backends.quantized.engine = backend
+    net.eval()
+    net.fuse()
+    net.qconfig = get_default_qconfig(backend)
+    net.classifier.qconfig = None
+    return prepare(net, inplace=True)
+
+
+def convert_int8(net):
+    """Swap calibrated float modules of `net` for their int8 counterparts."""
+    return convert(net, inplace=True)
+
+
+def load_int8(state_dict, backend='fbgemm'):
+    """Build an int8 reid Net and load the state dict saved by quantize.py into it."""
+    net = convert_int8(prepare_int8(Net(reid=True), backend))
+    net.load_state_dict(state_dict)
+    return net
+
 
 if __name__ == '__main__':
     net = Net()
@@ -0,0 +1,77 @@
+"""
+INT8 post-training static quantization of the reid Net for CPU inference.
+
+1. dump calibration crops while tracking: DeepSort(..., calib_dir="calib")
+2. quantize, from the deep_sort_pytorch directory:
+       python -m deep_sort.deep.quantize --calib-dir calib --weights deep_sort/deep/checkpoint/ckpt.t7
+3. check rank-1 on market1501, from deep_sort/deep:
+       python test.py --weights checkpoint/ckpt.t7 --output features.pth
+       python test.py --weights checkpoint/ckpt_int8.t7 --output features_int8.pth
+       python evaluate.py --features features_int8.pth --baseline features.pth
+
+The saved checkpoint can be used as REID_CKPT directly, Extractor detects it.
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import torch
+
+from .feature_extractor import Extractor
+from .model import convert_int8, prepare_int8
+
+
+def load_crops(calib_dir):
+    files = sorted(glob.glob(os.path.join(calib_dir, "*.jpg")) + glob.glob(os.path.join(calib_dir, "*.png")))
+    assert files, "Error: no calibration crops found in {}".format(calib_dir)
+    return [cv2.imread(f) for f in files]
+
+
+def quantize(extractor, im_crops, backend='fbgemm', batch_size=64):
+    """
+    Calibrate and convert `extractor.net` to int8 in place, crops are
+    preprocessed exactly as the tracker does.
+    """
+    net = prepare_int8(extractor.net.cpu(), backend)
+    with torch.no_grad():
+        for i in range(0, len(im_crops), batch_size):
+            net(extractor._preprocess(im_crops[i:i + batch_size]))
+    extractor.net = convert_int8(net)
+    extractor.device = "cpu"
+    return extractor
+
+
+def benchmark(extractor, im_crops, batch_size=32, n=20):
+    crops = (im_crops * batch_size)[:batch_size]
+    extractor(crops)  # warmup
+    t = time.time()
+    for _ in range(n):
+        extractor(crops)
+    return n * batch_size / (time.time() - t)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 quantization of the reid extractor")
+    parser.add_argument("--calib-dir", default='calib', type=str)
+    parser.add_argument("--weights", default='deep_sort/deep/checkpoint/ckpt.t7', type=str)
+    parser.add_argument("--save", default='', type=str, help="defaults to <weights>_int8.t7")
+    parser.add_argument("--backend", default='fbgemm', type=str, help="fbgemm (x86) or qnnpack (arm)")
+    args = parser.parse_args()
+
+    im_crops = load_crops(args.calib_dir)
+    extractor = Extractor(args.weights, use_cuda=False)
+    fps_fp32 = benchmark(extractor, im_crops)
+    quantize(extractor, im_crops, args.backend)
+    fps_int8 = benchmark(extractor, im_crops)
+    print("Calibrated on {} crops, throughput fp32:{:.1f} int8:{:.1f} crops/s ({:.2f}x)".format(
+        len(im_crops), fps_fp32, fps_int8, fps_int8 / fps_fp32))
+
+    save = args.save or os.path.splitext(args.weights)[0] + "_int8.t7"
+    print("Saving parameters to {}".format(save))
+    torch.save({'net_dict': extractor.net.state_dict(), 'int8': True, 'backend': args.backend}, save)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,14 @@ import torchvision
 import argparse
 import os
 
-from model import Net
+from model import Net, load_int8
 
 parser = argparse.ArgumentParser(description="Train on market1501")
 parser.add_argument("--data-dir", default='data', type=str)
 parser.add_argument("--no-cuda", action="store_true")
 parser.add_argument("--gpu-id", default=0, type=int)
+parser.add_argument("--weights", default='./checkpoint/ckpt.t7', type=str)
+parser.add_argument("--output", default='features.pth', type=str)
 args = parser.parse_args()
 
 # device
@@ -39,13 +41,18 @@ galleryloader = torch.utils.data.DataLoader(
 )
 
 # net definition
-net = Net(reid=True)
 assert os.path.isfile(
-    "./checkpoint/ckpt.t7"), "Error: no checkpoint file found!"
-print('Loading from checkpoint/ckpt.t7')
-checkpoint = torch.load("./checkpoint/ckpt.t7")
+    args.weights), "Error: no checkpoint file found!"
+print('Loading from {}'.format(args.weights))
+checkpoint = torch.load(args.weights, map_location="cpu")
 net_dict = checkpoint['net_dict']
-net.load_state_dict(net_dict, strict=False)
+if checkpoint.get('int8', False):
+    # quantized kernels only run on CPU
+    device = "cpu"
+    net = load_int8(net_dict, checkpoint.get('backend', 'fbgemm'))
+else:
+    net = Net(reid=True)
+    net.load_state_dict(net_dict, strict=False)
 net.eval()
 net.to(device)
 
@@ -77,4 +84,4 @@ features = {
     "gf": gallery_features,
     "gl": gallery_labels
 }
-torch.save(features, "features.pth")
+torch.save(features, args.output)
@@ -1,3 +1,8 @@
+import copy
+import os
+from functools import partial
+
+import cv2
 import numpy as np
 import torch
 
@@ -5,6 +10,7 @@ from .deep.feature_extractor import Extractor
 from .sort.nn_matching import NearestNeighborDistanceMetric
 from .sort.detection import Detection
 from .sort.tracker import Tracker
+from .sort.iou_matching import iou
 
 
 __all__ = ["DeepSort"]
@@ -22,36 +28,79 @@ class DeepSort(object):
         n_init=3,
         nn_budget=100,
         use_cuda=True,
+        calib_dir=None,
+        calib_size=1000,
+        reuse_iou=0.0,
+        reuse_diff=0.05,
+        reuse_interval=10,
+        lazy_reid=False,
+        precision='fp32',
+        channels_last=False,
+        pad_batch=False,
+        nn_index="exact",
+        nn_nlist=64,
+        nn_nprobe=8,
+        reid_cache_dir=None,
     ):
         self.min_confidence = min_confidence
         self.nms_max_overlap = nms_max_overlap
+        # when set, the first `calib_size` reid crops are dumped for INT8 calibration (deep/quantize.py)
+        self.calib_dir = calib_dir
+        self.calib_size = calib_size
+        self._n_calib = 0
+        if calib_dir is not None:
+            os.makedirs(calib_dir, exist_ok=True)
+        # a detection overlapping its predicted track by more than `reuse_iou` whose crop thumbnail differs by
+        # less than `reuse_diff` reuses the track feature, at most `reuse_interval` frames in a row (0 disables)
+        self.reuse_iou = reuse_iou
+        self.reuse_diff = reuse_diff
+        self.reuse_interval = reuse_interval
+        # only extract features for detections the tracker can't associate by IoU alone
+        self.lazy_reid = lazy_reid
 
-        self.extractor = Extractor(model_path, use_cuda=use_cuda)
+        self.extractor = Extractor(
+            model_path, use_cuda=use_cuda, precision=precision, channels_last=channels_last, pad_batch=pad_batch,
+            cache_dir=reid_cache_dir)
 
         max_cosine_distance = max_dist
-        metric = NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-        self.tracker = Tracker(
-            metric, max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init
-        )
+        self._metric_args = ("cosine", max_cosine_distance, nn_budget)
+        self._metric_kwargs = dict(index=nn_index, nlist=nn_nlist, nprobe=nn_nprobe)
+        self._tracker_kwargs = dict(max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init)
+        self.tracker = self._new_tracker()
+
+    def _new_tracker(self):
+        metric = NearestNeighborDistanceMetric(*self._metric_args, **self._metric_kwargs)
+        return Tracker(metric, **self._tracker_kwargs)
 
-    def update(self, bbox_xywh, confidences, oids, ori_img):
+    def spawn(self):
+        """
+        Return a DeepSort for another camera, with the same settings and reid extractor but its own tracks.
+        """
+        other = copy.copy(self)
+        other.tracker = self._new_tracker()
+        return other
+
+    def update(self, bbox_xywh, confidences, oids, ori_img, ori_img_device=None):
+        # `ori_img_device` is the same frame already uploaded as an uint8 HWC tensor, reid crops are then cut from it
         self.height, self.width = ori_img.shape[:2]
+        self._ori_img_device = ori_img_device
+        # predict first so that stable detections can reuse the feature of their track
+        self.tracker.predict()
+
         # generate detections
-        features = self._get_features(bbox_xywh, ori_img)
+        keep = [i for i, conf in enumerate(confidences) if conf > self.min_confidence]
         bbox_tlwh = self._xywh_to_tlwh(bbox_xywh)
-        detections = [
-            Detection(bbox_tlwh[i], conf, features[i], oid)
-            for i, (conf, oid) in enumerate(zip(confidences, oids))
-            if conf > self.min_confidence
-        ]
+        detections = [Detection(bbox_tlwh[i], confidences[i], None, oids[i]) for i in keep]
+        extract = partial(self._extract_features, detections, [bbox_xywh[i] for i in keep], ori_img)
+        if not self.lazy_reid:
+            extract(range(len(detections)))
 
         # run on non-maximum supression
         boxes = np.array([d.tlwh for d in detections])
         scores = np.array([d.confidence for d in detections])
 
         # update tracker
-        self.tracker.predict()
-        self.tracker.update(detections)
+        self.tracker.update(detections, extract if self.lazy_reid else None, partial(extract, reuse=False))
 
         # output bbox identities
         outputs = []
@@ -116,14 +165,97 @@ class DeepSort(object):
         h = int(y2 - y1)
         return t, l, w, h
 
-    def _get_features(self, bbox_xywh, ori_img):
+    def _get_crops(self, bbox_xywh, ori_img):
         im_crops = []
         for box in bbox_xywh:
             x1, y1, x2, y2 = self._xywh_to_xyxy(box)
             im = ori_img[y1:y2, x1:x2]
             im_crops.append(im)
+        return im_crops
+
+    def _save_calib_crops(self, im_crops):
+        for im in im_crops:
+            if self._n_calib >= self.calib_size:
+                break
+            if im.size == 0:
+                continue
+            cv2.imwrite(os.path.join(self.calib_dir, "{:06d}.jpg".format(self._n_calib)), im)
+            self._n_calib += 1
+
+    def _get_features(self, bbox_xywh, ori_img):
+        if self._crop_on_device():
+            return self._get_features_device(bbox_xywh)
+        im_crops = self._get_crops(bbox_xywh, ori_img)
+        if self.calib_dir is not None:
+            self._save_calib_crops(im_crops)
         if im_crops:
             features = self.extractor(im_crops)
         else:
             features = np.array([])
         return features
+
+    def _crop_on_device(self):
+        return getattr(self, '_ori_img_device', None) is not None and self.calib_dir is None
+
+    def _get_features_device(self, bbox_xywh):
+        if not len(bbox_xywh):
+            return np.array([])
+        return self.extractor.from_frame(self._ori_img_device, [self._xywh_to_xyxy(box) for box in bbox_xywh])
+
+    def _extract_features(self, detections, bbox_xywh, ori_img, indices, reuse=True):
+        """Fill in the features of `detections[indices]` that have not been extracted yet."""
+        indices = [i for i in indices if detections[i].feature is None]
+        if not indices:
+            return
+        features, thumbs, reused_from = self._get_features_cached(
+            [bbox_xywh[i] for i in indices], [detections[i].tlwh for i in indices], ori_img, reuse)
+        for i, feature, thumb, r in zip(indices, features, thumbs, reused_from):
+            detections[i].feature = np.asarray(feature, dtype=np.float32)
+            detections[i].thumb = thumb
+            detections[i].reused_from = r
+
+    @staticmethod
+    def _thumbnail(im):
+        if im.size == 0:
+            return None
+        return cv2.resize(im, (8, 16), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.
+
+    def _get_features_cached(self, bbox_xywh, bbox_tlwh, ori_img, reuse=True):
+        """
+        Same as _get_features, but a detection that is the mutual best IoU match of a confirmed track
+        updated in the previous frame, with a nearly unchanged crop, takes the last feature of that track
+        instead of running the extractor, unless `reuse` is False. Returns features, crop thumbnails and the
+        id of the track the feature was copied from, or None, per box.
+        """
+        n = len(bbox_xywh)
+        if not self.reuse_iou:
+            return self._get_features(bbox_xywh, ori_img), [None] * n, [None] * n
+
+        im_crops = self._get_crops(bbox_xywh, ori_img)
+        thumbs = [self._thumbnail(im) for im in im_crops]
+        features, reused_from = [None] * n, [None] * n
+        tracks = [] if not reuse else [
+            t for t in self.tracker.tracks
+            if t.is_confirmed() and t.time_since_update == 1 and t.thumb is not None and
+            t.n_reused < self.reuse_interval
+        ]
+        if tracks and n:
+            candidates = np.array([np.asarray(b, dtype=float) for b in bbox_tlwh])
+            ious = np.stack([iou(t.to_tlwh(), candidates) for t in tracks])  # tracks x detections
+            best_det = ious.argmax(1)
+            for j, i in enumerate(ious.argmax(0)):
+                if best_det[i] != j or ious[i, j] < self.reuse_iou or thumbs[j] is None:
+                    continue
+                if np.abs(thumbs[j] - tracks[i].thumb).mean() < self.reuse_diff:
+                    features[j], reused_from[j] = tracks[i].last_feature, tracks[i].track_id
+
+        missing = [j for j in range(n) if features[j] is None]
+        if missing and self._crop_on_device():
+            for j, feature in zip(missing, self._get_features_device([bbox_xywh[j] for j in missing])):
+                features[j] = feature
+        elif missing:
+            if self.calib_dir is not None:
+                self._save_calib_crops([im_crops[j] for j in missing])
+            for j, feature in zip(missing, self.extractor([im_crops[j] for j in missing])):
+                features[j] = feature
+        return features, thumbs, reused_from
@@ -12,8 +12,13 @@ class Detection(object):
         Bounding box in format `(x, y, w, h)`.
     confidence : float
         Detector confidence score.
-    feature : array_like
-        A feature vector that describes the object contained in this image.
+    feature : array_like | NoneType
+        A feature vector that describes the object contained in this image,
+        None if it is extracted later on demand.
+    thumb : Optional[ndarray]
+        A small thumbnail of the image crop, used to detect unchanged crops.
+    reused_from : Optional[int]
+        Id of the track `feature` was copied from instead of being extracted.
 
     Attributes
     ----------
@@ -23,14 +28,21 @@ class Detection(object):
         Detector confidence score.
     feature : ndarray | NoneType
         A feature vector that describes the object contained in this image.
+    thumb : ndarray | NoneType
+        A small thumbnail of the image crop.
+    reused_from : int | NoneType
+        Id of the track `feature` was copied from instead of being extracted,
+        the feature is only valid for a match to that track.
 
     """
 
-    def __init__(self, tlwh, confidence, feature, oid):
+    def __init__(self, tlwh, confidence, feature, oid, thumb=None, reused_from=None):
         self.tlwh = np.asarray(tlwh, dtype=float)
         self.confidence = float(confidence)
-        self.feature = np.asarray(feature, dtype=np.float32)
+        self.feature = None if feature is None else np.asarray(feature, dtype=np.float32)
         self.oid = oid
+        self.thumb = thumb
+        self.reused_from = reused_from
 
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
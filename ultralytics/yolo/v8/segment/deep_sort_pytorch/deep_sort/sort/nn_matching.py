@@ -1,6 +1,13 @@
 # vim: expandtab:ts=4:sw=4
+from collections import deque
+
 import numpy as np
 
+try:
+    import faiss
+except ImportError:  # optional, only speeds up IVF training
+    faiss = None
+
 
 def _pdist(a, b):
     """Compute pair-wise squared distance between points in `a` and `b`.
@@ -96,6 +103,151 @@ def _nn_cosine_distance(x, y):
     return distances.min(axis=0)
 
 
+class GalleryIndex(object):
+    """
+    Incremental store of gallery samples for `NearestNeighborDistanceMetric`.
+    Samples live in slots of one preallocated matrix, so adding, evicting and
+    removing targets never restacks the gallery.
+
+    With `nlist` = 0 the search is exact, one matrix product over the samples
+    of the requested targets. Otherwise, once enough samples have been seen,
+    an inverted file (IVF) of `nlist` k-means cells is trained and each query
+    is only compared to the samples of its `nprobe` nearest cells, trading
+    recall for speed. Targets without samples in the probed cells get an
+    infinite distance.
+
+    Parameters
+    ----------
+    metric : str
+        Either "euclidean" or "cosine".
+    nlist : int
+        Number of IVF cells, 0 for exact search.
+    nprobe : int
+        Number of cells visited per query, the recall knob.
+    capacity : int
+        Initial number of slots, doubled when full.
+
+    """
+
+    train_factor = 32  # samples per cell needed before training the IVF
+    kmeans_iter = 20
+
+    def __init__(self, metric, nlist=0, nprobe=8, capacity=1024):
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.vectors = None
+        self.slot_target = np.zeros(capacity, dtype=np.int64)
+        self.slot_list = np.full(capacity, -1, dtype=np.int64)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.slots = {}  # target -> deque of slots, oldest first
+        self.centroids = None
+
+    def _distance(self, a, b):
+        if self.metric == "cosine":
+            return 1. - np.dot(a, b.T)  # rows are normalized on the way in
+        return _pdist(a, b)
+
+    def _normalize(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if self.metric == "cosine":
+            x = x / np.linalg.norm(x, axis=-1, keepdims=True)
+        return x
+
+    def _grow(self):
+        n = len(self.used)
+        self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+        self.slot_target = np.concatenate([self.slot_target, np.zeros(n, dtype=np.int64)])
+        self.slot_list = np.concatenate([self.slot_list, np.full(n, -1, dtype=np.int64)])
+        self.used = np.concatenate([self.used, np.zeros(n, dtype=bool)])
+        self.free.extend(range(2 * n - 1, n - 1, -1))
+
+    def _release(self, slot):
+        self.used[slot] = False
+        self.slot_list[slot] = -1
+        self.free.append(slot)
+
+    def _train(self):
+        slots = np.flatnonzero(self.used)
+        data = self.vectors[slots]
+        if faiss is not None:
+            kmeans = faiss.Kmeans(data.shape[1], self.nlist, niter=self.kmeans_iter,
+                                  spherical=self.metric == "cosine", seed=0)
+            kmeans.train(data)
+            centroids = kmeans.centroids
+        else:
+            rng = np.random.default_rng(0)
+            centroids = data[rng.choice(len(data), self.nlist, replace=False)]
+            for _ in range(self.kmeans_iter):
+                assign = self._distance(centroids, data).argmin(axis=0)
+                counts = np.bincount(assign, minlength=self.nlist)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, data)
+                nonempty = counts > 0
+                centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+                centroids = self._normalize(centroids)
+        self.centroids = self._normalize(centroids)
+        self.slot_list[slots] = self._distance(self.centroids, data).argmin(axis=0)
+
+    def partial_fit(self, features, targets, active_targets, budget=None):
+        """Add samples, evict the oldest beyond `budget` and drop inactive
+        targets, see `NearestNeighborDistanceMetric.partial_fit`."""
+        features = self._normalize(features)
+        if len(features) and self.vectors is None:
+            self.vectors = np.zeros((len(self.used), features.shape[1]), dtype=np.float32)
+        for feature, target in zip(features, targets):
+            if not self.free:
+                self._grow()
+            slot = self.free.pop()
+            self.vectors[slot] = feature
+            self.slot_target[slot] = target
+            self.used[slot] = True
+            if self.centroids is not None:
+                self.slot_list[slot] = self._distance(self.centroids, feature[None]).argmin()
+            target_slots = self.slots.setdefault(target, deque())
+            target_slots.append(slot)
+            if budget is not None and len(target_slots) > budget:
+                self._release(target_slots.popleft())
+
+        active_targets = set(active_targets)
+        for target in [k for k in self.slots if k not in active_targets]:
+            for slot in self.slots.pop(target):
+                self._release(slot)
+
+        if self.nlist and self.centroids is None and self.used.sum() >= self.train_factor * self.nlist:
+            self._train()
+
+    def search(self, features, targets):
+        """Return the cost matrix of `NearestNeighborDistanceMetric.distance`."""
+        cost_matrix = np.full((len(targets), len(features)), np.inf)
+        targets = [(row, target) for row, target in enumerate(targets) if self.slots.get(target)]
+        if not targets or len(features) == 0:
+            return cost_matrix
+        features = self._normalize(features)
+        counts = [len(self.slots[target]) for _, target in targets]
+        slots = np.fromiter((s for _, target in targets for s in self.slots[target]), dtype=np.int64)
+        rows = np.repeat([row for row, _ in targets], counts)
+
+        if self.centroids is None:
+            # exact, samples of a target are contiguous so reduce per segment
+            starts = np.cumsum([0] + counts[:-1])
+            distances = self._distance(self.vectors[slots], features)
+            cost_matrix[rows[starts]] = np.minimum.reduceat(distances, starts, axis=0)
+        else:
+            probes = np.argsort(self._distance(self.centroids, features), axis=0)[:self.nprobe]
+            slot_list = self.slot_list[slots]
+            for j in range(len(features)):
+                mask = np.isin(slot_list, probes[:, j])
+                if not mask.any():
+                    continue
+                distances = self._distance(self.vectors[slots[mask]], features[j:j + 1])[:, 0]
+                np.minimum.at(cost_matrix[:, j], rows[mask], distances)
+        if self.metric == "euclidean":
+            cost_matrix = np.maximum(0.0, cost_matrix)
+        return cost_matrix
+
+
 class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
@@ -111,16 +263,25 @@ class NearestNeighborDistanceMetric(object):
     budget : Optional[int]
         If not None, fix samples per class to at most this number. Removes
         the oldest samples when the budget is reached.
+    index : str
+        Gallery search backend. "exact" compares against each target in
+        turn, "blocked" is exact in a single matrix product over an
+        incremental `GalleryIndex`, "ivf" is approximate, see `GalleryIndex`.
+    nlist : int
+        Number of IVF cells for the "ivf" index.
+    nprobe : int
+        Number of IVF cells visited per query for the "ivf" index.
 
     Attributes
     ----------
     samples : Dict[int -> List[ndarray]]
         A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+        that have been observed so far. Only used by the "exact" index.
 
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    def __init__(self, metric, matching_threshold, budget=None, index="exact",
+                 nlist=64, nprobe=8):
 
         if metric == "euclidean":
             self._metric = _nn_euclidean_distance
@@ -129,9 +290,14 @@ class NearestNeighborDistanceMetric(object):
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        if index not in ("exact", "blocked", "ivf"):
+            raise ValueError(
+                "Invalid index; must be either 'exact', 'blocked' or 'ivf'")
         self.matching_threshold = matching_threshold
         self.budget = budget
         self.samples = {}
+        self._index = None if index == "exact" else GalleryIndex(
+            metric, nlist if index == "ivf" else 0, nprobe)
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -146,6 +312,9 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
+        if self._index is not None:
+            self._index.partial_fit(features, targets, active_targets, self.budget)
+            return
         for feature, target in zip(features, targets):
             self.samples.setdefault(target, []).append(feature)
             if self.budget is not None:
@@ -170,6 +339,8 @@ class NearestNeighborDistanceMetric(object):
             `targets[i]` and `features[j]`.
 
         """
+        if self._index is not None:
+            return self._index.search(features, targets)
         cost_matrix = np.zeros((len(targets), len(features)))
         for i, target in enumerate(targets):
             cost_matrix[i, :] = self._metric(self.samples[target], features)
@@ -40,6 +40,8 @@ class Track:
     feature : Optional[ndarray]
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
+    thumb : Optional[ndarray]
+        Crop thumbnail of the detection this track originates from.
 
     Attributes
     ----------
@@ -60,11 +62,17 @@ class Track:
     features : List[ndarray]
         A cache of features. On each measurement update, the associated feature
         vector is added to this list.
+    last_feature : ndarray | NoneType
+        The most recently extracted feature vector.
+    thumb : ndarray | NoneType
+        Crop thumbnail at the time `last_feature` was extracted.
+    n_reused : int
+        Number of consecutive updates that reused `last_feature`.
 
     """
 
     def __init__(self, mean, covariance, track_id, n_init, max_age,oid,
-                 feature=None):
+                 feature=None, thumb=None):
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
@@ -77,6 +85,9 @@ class Track:
         self.features = []
         if feature is not None:
             self.features.append(feature)
+        self.last_feature = feature
+        self.thumb = thumb
+        self.n_reused = 0
 
         self._n_init = n_init
         self._max_age = max_age
@@ -141,7 +152,14 @@ class Track:
         """
         self.mean, self.covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
-        self.features.append(detection.feature)
+        if detection.reused_from is not None:
+            # already in the gallery, don't add it again
+            self.n_reused += 1
+        elif detection.feature is not None:
+            self.features.append(detection.feature)
+            self.last_feature = detection.feature
+            self.thumb = detection.thumb
+            self.n_reused = 0
 
         self.hits += 1
         self.time_since_update = 0
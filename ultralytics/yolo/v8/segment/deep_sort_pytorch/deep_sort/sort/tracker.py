@@ -60,18 +60,41 @@ class Tracker:
             track.increment_age()
             track.mark_missed()
 
-    def update(self, detections):
+    def update(self, detections, feature_fn=None, refresh_fn=None):
         """Perform measurement update and track management.
 
         Parameters
         ----------
         detections : List[deep_sort.detection.Detection]
             A list of detections at the current time step.
+        feature_fn : Optional[Callable[List[int]] -> None]
+            If given, detection features are extracted lazily: tracks and
+            detections whose IoU association is unambiguous are matched
+            without appearance, and `feature_fn` is called with the indices of
+            the detections that need a `feature` filled in.
+        refresh_fn : Optional[Callable[List[int]] -> None]
+            Called with the indices of the detections whose feature was copied
+            from a track other than the one they end up with, after clearing
+            it, to extract their own. Without it these features are dropped.
 
         """
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(detections, feature_fn)
+
+        # A feature copied from a track is only valid for that track, don't
+        # let it into the gallery of another one.
+        stale = [
+            d for t, d in matches if detections[d].reused_from not in
+            (None, self.tracks[t].track_id)]
+        stale += [
+            d for d in unmatched_detections
+            if detections[d].reused_from is not None]
+        for detection_idx in stale:
+            detections[detection_idx].feature = None
+            detections[detection_idx].reused_from = None
+        if stale and refresh_fn is not None:
+            refresh_fn(stale)
 
         # Update track set.
         for track_idx, detection_idx in matches:
@@ -95,7 +118,7 @@ class Tracker:
         self.metric.partial_fit(
             np.asarray(features), np.asarray(targets), active_targets)
 
-    def _match(self, detections):
+    def _match(self, detections, feature_fn=None):
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
             features = np.array([dets[i].feature for i in detection_indices])
@@ -113,11 +136,18 @@ class Tracker:
         unconfirmed_tracks = [
             i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
 
+        # Match unambiguous pairs by IOU and extract features for the rest.
+        matches_p, detection_indices = [], None
+        if feature_fn is not None:
+            matches_p, confirmed_tracks, detection_indices = \
+                self._pre_associate(detections, confirmed_tracks)
+            feature_fn(detection_indices)
+
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
                 gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                self.tracks, detections, confirmed_tracks, detection_indices)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
         iou_track_candidates = unconfirmed_tracks + [
@@ -131,13 +161,59 @@ class Tracker:
                 iou_matching.iou_cost, self.max_iou_distance, self.tracks,
                 detections, iou_track_candidates, unmatched_detections)
 
-        matches = matches_a + matches_b
+        matches = matches_p + matches_a + matches_b
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
+    def _pre_associate(self, detections, track_indices):
+        """Match confirmed tracks seen in the previous frame to detections
+        where the IOU association is unambiguous: the track has exactly one
+        feasible detection, and no other track could claim that detection
+        either by IOU or, for lost tracks, within the Mahalanobis gate.
+
+        Returns
+        -------
+        (List[(int, int)], List[int], List[int])
+            The matches, the remaining track indices and the remaining
+            detection indices.
+
+        """
+        detection_indices = list(range(len(detections)))
+        if len(track_indices) == 0 or len(detection_indices) == 0:
+            return [], track_indices, detection_indices
+
+        all_tracks = list(range(len(self.tracks)))
+        cost_matrix = iou_matching.iou_cost(
+            self.tracks, detections, all_tracks, detection_indices)
+        cost_matrix = linear_assignment.gate_cost_matrix(
+            self.kf, cost_matrix, self.tracks, detections, all_tracks,
+            detection_indices)
+        feasible = cost_matrix <= self.max_iou_distance
+        lost_tracks = [
+            i for i in all_tracks if self.tracks[i].time_since_update > 1]
+        if lost_tracks:
+            gated = linear_assignment.gate_cost_matrix(
+                self.kf, np.zeros((len(lost_tracks), len(detection_indices))),
+                self.tracks, detections, lost_tracks, detection_indices)
+            feasible[lost_tracks] = gated < linear_assignment.INFTY_COST
+
+        matches = []
+        for track_idx in track_indices:
+            if self.tracks[track_idx].time_since_update != 1:
+                continue
+            candidates = np.flatnonzero(feasible[track_idx])
+            if len(candidates) == 1 and feasible[:, candidates[0]].sum() == 1:
+                matches.append((track_idx, int(candidates[0])))
+
+        matched_tracks = set(k for k, _ in matches)
+        matched_detections = set(k for _, k in matches)
+        return matches, \
+            [k for k in track_indices if k not in matched_tracks], \
+            [k for k in detection_indices if k not in matched_detections]
+
     def _initiate_track(self, detection):
         mean, covariance = self.kf.initiate(detection.to_xyah())
         self.tracks.append(Track(
             mean, covariance, self._next_id, self.n_init, self.max_age,detection.oid,
-            detection.feature))
+            detection.feature, detection.thumb))
         self._next_id += 1
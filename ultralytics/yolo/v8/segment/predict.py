@@ -1,9 +1,9 @@
 # Ultralytics YOLO 🚀, GPL-3.0 license
 
-import hydra
 import torch
 
-from ultralytics.yolo.utils import DEFAULT_CONFIG, ROOT, ops
+from ultralytics.yolo.configs import hydra_main
+from ultralytics.yolo.utils import DEFAULT_CONFIG, ROOT, USER_CONFIG_DIR, ops
 from ultralytics.yolo.utils.checks import check_imgsz
 from ultralytics.yolo.utils.plotting import colors, save_one_box
 
@@ -21,12 +21,12 @@ from collections import deque
 import numpy as np
 
 palette = (2**11 - 1, 2**15 - 1, 2**20 - 1)
-data_deque = {}
+data_deque = {}  # trail per (stream, track id), every stream's tracker numbers its ids from 1
 
 deepsort = None
 
 
-def init_tracker():
+def init_tracker(half=False, cache=False):
     global deepsort
     cfg_deep = get_config()
     cfg_deep.merge_from_file("deep_sort_pytorch/configs/deep_sort.yaml")
@@ -40,7 +40,18 @@ def init_tracker():
         max_age=cfg_deep.DEEPSORT.MAX_AGE,
         n_init=cfg_deep.DEEPSORT.N_INIT,
         nn_budget=cfg_deep.DEEPSORT.NN_BUDGET,
+        nn_index=cfg_deep.DEEPSORT.NN_INDEX,
+        nn_nlist=cfg_deep.DEEPSORT.NN_NLIST,
+        nn_nprobe=cfg_deep.DEEPSORT.NN_NPROBE,
         use_cuda=True,
+        reuse_iou=cfg_deep.DEEPSORT.REUSE_IOU,
+        reuse_diff=cfg_deep.DEEPSORT.REUSE_DIFF,
+        reuse_interval=cfg_deep.DEEPSORT.REUSE_INTERVAL,
+        lazy_reid=cfg_deep.DEEPSORT.LAZY_REID,
+        precision="fp16" if half else cfg_deep.DEEPSORT.REID_PRECISION,  # follow the detector's half
+        channels_last=cfg_deep.DEEPSORT.REID_CHANNELS_LAST,
+        pad_batch=cfg_deep.DEEPSORT.REID_PAD_BATCH,
+        reid_cache_dir=str(USER_CONFIG_DIR / 'model_cache') if cache else None,
     )
 
 
@@ -121,13 +132,14 @@ def UI_box(x, img, color=None, label=None, line_thickness=None):
         )
 
 
-def draw_boxes(img, bbox, names, object_id, identities=None, offset=(0, 0)):
+def draw_boxes(img, bbox, names, object_id, identities=None, offset=(0, 0), stream=0):
     # cv2.line(img, line[0], line[1], (46,162,112), 3)
 
     height, width, _ = img.shape
-    # remove tracked point from buffer if object is lost
+    # remove tracked point from buffer if object is lost, other streams keep their trails
+    ids = set() if identities is None else {int(x) for x in identities}
     for key in list(data_deque):
-        if key not in identities:
+        if key[0] == stream and key[1] not in ids:
             data_deque.pop(key)
 
     for i, box in enumerate(bbox):
@@ -144,39 +156,61 @@ def draw_boxes(img, bbox, names, object_id, identities=None, offset=(0, 0)):
         id = int(identities[i]) if identities is not None else 0
 
         # create new buffer for new object
-        if id not in data_deque:
-            data_deque[id] = deque(maxlen=64)
+        key = stream, id
+        if key not in data_deque:
+            data_deque[key] = deque(maxlen=64)
         color = compute_color_for_labels(object_id[i])
         obj_name = names[object_id[i]]
         label = "{}{:d}".format("", id) + ":" + "%s" % (obj_name)
 
         # add center to buffer
-        data_deque[id].appendleft(center)
+        data_deque[key].appendleft(center)
         UI_box(box, img, label=label, color=color, line_thickness=2)
         # draw trail
-        for i in range(1, len(data_deque[id])):
+        for i in range(1, len(data_deque[key])):
             # check if on buffer value is none
-            if data_deque[id][i - 1] is None or data_deque[id][i] is None:
+            if data_deque[key][i - 1] is None or data_deque[key][i] is None:
                 continue
             # generate dynamic thickness of trails
             thickness = int(np.sqrt(64 / float(i + i)) * 1.5)
             # draw trails
-            cv2.line(img, data_deque[id][i - 1], data_deque[id][i], color, thickness)
+            cv2.line(img, data_deque[key][i - 1], data_deque[key][i], color, thickness)
     return img
 
 
 class SegmentationPredictor(DetectionPredictor):
 
+    def __init__(self, config=DEFAULT_CONFIG, overrides=None):
+        super().__init__(config, overrides)
+        self.trackers = {}  # DeepSort per stream
+        self.tracks = {}  # last tracker outputs per stream, held on static scenes
+
+    def setup(self, source=None, model=None):
+        model = super().setup(source, model)
+        if deepsort is None:  # loaded here to count towards the time to first frame
+            init_tracker(self.args.half, self.args.model_cache)
+        return model
+
+    def tracker(self, stream):
+        """Returns the DeepSort of a stream, all streams share the reid extractor of the global tracker."""
+        if stream not in self.trackers:
+            self.trackers[stream] = deepsort.spawn() if self.trackers else deepsort
+        return self.trackers[stream]
+
     def postprocess(self, preds, img, orig_img):
+        if self.tiler:
+            return self.postprocess_tiles(preds, img, orig_img)
         masks = []
-        # TODO: filter by classes
-        p = ops.non_max_suppression(
+        p = ops.batched_non_max_suppression(
             preds[0],
             self.args.conf,
             self.args.iou,
             agnostic=self.args.agnostic_nms,
             max_det=self.args.max_det,
             nm=32,
+            as_list=True,
+            max_candidates=self.args.max_candidates,
+            **self.candidate_filters(img, orig_img),
         )
         proto = preds[1][-1]
         for i, pred in enumerate(p):
@@ -200,6 +234,46 @@ class SegmentationPredictor(DetectionPredictor):
 
         return (p, masks)
 
+    def postprocess_tiles(self, preds, img, orig_img):
+        """
+        Merges the predictions of the tiles of every frame, masks are only decoded for the detections that survive the
+        cross-tile NMS and the `roi`, at tile resolution, and pasted into frame sized masks.
+        """
+        p = ops.batched_non_max_suppression(
+            preds[0],
+            self.args.conf,
+            self.args.iou,
+            agnostic=self.args.agnostic_nms,
+            max_det=self.args.max_det,
+            nm=32,
+            as_list=True,
+            max_candidates=self.args.max_candidates,
+            **self.candidate_filters(img, orig_img),
+        )
+        proto = preds[1][-1]
+        merged = self.tiler.merge(p, self.args.iou, self.args.agnostic_nms, self.args.max_det)
+        keep = self.roi_keep([det for det, _ in merged], orig_img)
+        if keep is not None:
+            merged = [(det[k], src[k]) for (det, src), k in zip(merged, keep)]
+        dets, masks = [], []
+        for i, (det, src) in enumerate(merged):
+            shape = orig_img[i].shape if self.webcam else orig_img.shape
+            mask = torch.zeros((len(det), *shape[:2]), device=det.device)
+            for k in src[:, 0].unique().tolist():
+                j = src[:, 0] == k
+                pred = p[k][src[j, 1]]
+                mask[j] = self.tiler.paste_masks(
+                    ops.process_mask(proto[k], pred[:, 6:], pred[:, :4], img.shape[2:], upsample=True), k, shape
+                )
+            det[:, :4] = det[:, :4].round()
+            dets.append(det)
+            masks.append(mask)  # one entry per frame, empty frames included
+        return (dets, masks)
+
+    def plots_input(self):
+        # masks are plotted over the letterboxed input unless at frame resolution
+        return (self.args.show or self.args.save) and not self.args.retina_masks
+
     def write_results(self, idx, preds, batch):
         assert self.dataset is not None
 
@@ -209,14 +283,14 @@ class SegmentationPredictor(DetectionPredictor):
             im = im[None]  # expand for batch dim
         self.seen += 1
         if self.webcam:  # batch_size >= 1
-            log_string += f"{idx}: "
-            frame = self.dataset.count  # type: ignore
+            log_string += f"{self.stream}: "
+            frame = self.batch_state['count']
         else:
-            frame = getattr(self.dataset, "frame", 0)
+            frame = self.batch_state.get("frame", 0)
 
         self.data_path = p
         self.txt_path = str(self.save_dir / "labels" / p.stem) + (
-            "" if self.dataset.mode == "image" else f"_{frame}"
+            "" if self.batch_state["mode"] == "image" else f"_{frame}"
         )
         log_string += "%gx%g " % im.shape[2:]  # print string
         self.annotator = self.get_annotator(im0)
@@ -250,8 +324,8 @@ class SegmentationPredictor(DetectionPredictor):
             mask,
             colors=[colors(x, True) for x in det[:, 5]],
             im_gpu=(
-                torch.as_tensor(im0, dtype=torch.float16)
-                .to(self.device)
+                (self.im0_gpu[idx] if self.im0_gpu else torch.as_tensor(im0, dtype=torch.float16).to(self.device))
+                .half()
                 .permute(2, 0, 1)
                 .flip(0)
                 .contiguous()
@@ -263,37 +337,30 @@ class SegmentationPredictor(DetectionPredictor):
 
         det = reversed(det[:, :6])
         self.all_outputs.append([det, mask])
-        xywh_bboxs = []
-        confs = []
-        oids = []
         outputs = []
-        # Write results
-        for j, (*xyxy, conf, cls) in enumerate(reversed(det[:, :6])):
-            x_c, y_c, bbox_w, bbox_h = xyxy_to_xywh(*xyxy)
-            xywh_obj = [x_c, y_c, bbox_w, bbox_h]
-            xywh_bboxs.append(xywh_obj)
-            confs.append([conf.item()])
-            oids.append(int(cls))
-        xywhs = torch.Tensor(xywh_bboxs)
-        confss = torch.Tensor(confs)
-
-        outputs = deepsort.update(xywhs, confss, oids, im0)
+        # Write results, one device to host copy for the tracker inputs
+        det_cpu = reversed(det).float().cpu()
+        xywhs = ops.xyxy2xywh(det_cpu[:, :4])
+        confss = det_cpu[:, 4:5]
+        oids = det_cpu[:, 5].int().tolist()
+
+        if self.static:  # nothing moved, hold the tracks instead of running the tracker and reid
+            outputs = self.tracks.get(self.stream, [])
+        else:
+            outputs = self.tracker(self.stream).update(
+                xywhs, confss, oids, im0, self.im0_gpu[idx] if self.im0_gpu else None)
+            self.tracks[self.stream] = outputs
         if len(outputs) > 0:
             bbox_xyxy = outputs[:, :4]
             identities = outputs[:, -2]
             object_id = outputs[:, -1]
 
-            draw_boxes(im0, bbox_xyxy, self.model.names, object_id, identities)
+            draw_boxes(im0, bbox_xyxy, self.model.names, object_id, identities, stream=self.stream)
         return log_string
 
 
-@hydra.main(
-    version_base=None,
-    config_path=str(DEFAULT_CONFIG.parent),
-    config_name=DEFAULT_CONFIG.name,
-)
+@hydra_main
 def predict(cfg):
-    init_tracker()
     cfg.model = cfg.model or "yolov8n-seg.pt"
     cfg.imgsz = check_imgsz(cfg.imgsz, min_dim=2)  # check image size
     # cfg.source = cfg.source if cfg.source is not None else ROOT / "assets"
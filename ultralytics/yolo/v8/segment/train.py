@@ -2,14 +2,14 @@
 
 from copy import copy
 
-import hydra
 import torch
 import torch.nn.functional as F
 
 from ultralytics.nn.tasks import SegmentationModel
 from ultralytics.yolo import v8
+from ultralytics.yolo.configs import hydra_main
 from ultralytics.yolo.utils import DEFAULT_CONFIG
-from ultralytics.yolo.utils.ops import crop_mask, xyxy2xywh
+from ultralytics.yolo.utils.ops import xyxy2xywh
 from ultralytics.yolo.utils.plotting import plot_images, plot_results
 from ultralytics.yolo.utils.tal import make_anchors
 from ultralytics.yolo.utils.torch_utils import de_parallel
@@ -108,18 +108,8 @@ class SegLoss(Loss):
         if fg_mask.sum():
             loss[0], loss[3] = self.bbox_loss(pred_distri, pred_bboxes, anchor_points, target_bboxes / stride_tensor,
                                               target_scores, target_scores_sum, fg_mask)
-            for i in range(batch_size):
-                if fg_mask[i].sum():
-                    mask_idx = target_gt_idx[i][fg_mask[i]] + 1
-                    if self.overlap:
-                        gt_mask = torch.where(masks[[i]] == mask_idx.view(-1, 1, 1), 1.0, 0.0)
-                    else:
-                        gt_mask = masks[batch_idx == i][mask_idx]
-                    xyxyn = target_bboxes[i][fg_mask[i]] / imgsz[[1, 0, 1, 0]]
-                    marea = xyxy2xywh(xyxyn)[:, 2:].prod(1)
-                    mxyxy = xyxyn * torch.tensor([mask_w, mask_h, mask_w, mask_h], device=self.device)
-                    loss[1] += self.single_mask_loss(gt_mask, pred_masks[i][fg_mask[i]], proto[i], mxyxy,
-                                                     marea)  # seg loss
+            loss[1] = self.mask_loss(masks, batch_idx.view(-1), fg_mask, target_gt_idx, target_bboxes, pred_masks, proto,
+                                     imgsz)  # seg loss
         # WARNING: Uncomment lines below in case of Multi-GPU DDP unused gradient errors
         #         else:
         #             loss[1] += proto.sum() * 0
@@ -133,14 +123,75 @@ class SegLoss(Loss):
 
         return loss.sum() * batch_size, loss.detach()  # loss(box, cls, dfl)
 
-    def single_mask_loss(self, gt_mask, pred, proto, xyxy, area):
-        # Mask loss for one image
-        pred_mask = (pred @ proto.view(self.nm, -1)).view(-1, *proto.shape[1:])  # (n, 32) @ (32,80,80) -> (n,80,80)
-        loss = F.binary_cross_entropy_with_logits(pred_mask, gt_mask, reduction="none")
-        return (crop_mask(loss, xyxy).mean(dim=(1, 2)) / area).mean()
-
-
-@hydra.main(version_base=None, config_path=str(DEFAULT_CONFIG.parent), config_name=DEFAULT_CONFIG.name)
+    def mask_loss(self, masks, batch_idx, fg_mask, target_gt_idx, target_bboxes, pred_masks, proto, imgsz):
+        """
+        Mask loss of all positive anchors, computed on the prototype pixels inside their target boxes only.
+
+        The positive anchors of a gt share its box and mask, so the in-box prototype pixels of every gt are gathered once
+        and multiplied with the mask coefficients of its anchors, in one batched matmul per power of two pixel count and
+        power of two anchor count, so that neither is padded to more than twice its size.
+
+        Returns:
+            (Tensor): sum over images of the mean over their positive anchors of the in-box BCE, normalized by the mask
+                size and the box area.
+        """
+        batch_size, nm, mask_h, mask_w = proto.shape
+        b, a = torch.nonzero(fg_mask, as_tuple=True)
+        n_max_boxes = int(target_gt_idx.max()) + 1
+        gts, gt_idx, counts = (b * n_max_boxes + target_gt_idx[b, a]).unique(return_inverse=True, return_counts=True)
+        gt_b, gt_j = torch.div(gts, n_max_boxes, rounding_mode='floor'), gts % n_max_boxes
+        order = (gt_idx * len(b) + torch.arange(len(b), device=b.device)).argsort()  # positives grouped by gt
+        starts = counts.cumsum(0) - counts
+        slot = torch.empty_like(b)
+        slot[order] = torch.arange(len(b), device=b.device) - starts[gt_idx[order]]  # position of anchor within its gt
+
+        # in-box pixels, as crop_mask()
+        first = order[starts]
+        xyxyn = target_bboxes[b[first], a[first]] / imgsz[[1, 0, 1, 0]]
+        marea = xyxy2xywh(xyxyn)[:, 2:].prod(1)
+        mxyxy = xyxyn * torch.tensor([mask_w, mask_h, mask_w, mask_h], device=self.device)
+        x1, y1, x2, y2 = mxyxy.ceil().clamp(0).long().T
+        x2, y2 = x2.clamp(max=mask_w), y2.clamp(max=mask_h)
+        nx, ny = (x2 - x1).clamp(0), (y2 - y1).clamp(0)
+        n_pixels = nx * ny
+
+        # mask row of every gt, overlapping masks hold the index + 1 of the gt of every pixel
+        if self.overlap:
+            rows = gt_b
+        else:
+            image_counts = torch.bincount(batch_idx.long(), minlength=batch_size)
+            rows = (batch_idx.long() * len(batch_idx) + torch.arange(len(batch_idx), device=self.device)).argsort()
+            rows = rows[image_counts.cumsum(0)[gt_b] - image_counts[gt_b] + gt_j]
+
+        proto = proto.flatten(2).transpose(1, 2)  # (b, h*w, nm)
+        sizes = 2 ** torch.arange(int(mask_h * mask_w - 1).bit_length() + 1, device=self.device)
+        anchor_sizes = 2 ** torch.arange(int(counts.max() - 1).bit_length() + 1, device=self.device)
+        buckets = torch.searchsorted(sizes, n_pixels) * len(anchor_sizes) + torch.searchsorted(anchor_sizes, counts)
+        loss = torch.zeros(len(b), device=self.device)
+        for bucket in buckets[n_pixels > 0].unique().tolist():
+            g = torch.nonzero(buckets == bucket).view(-1)
+            k = bucket // len(anchor_sizes)
+            local = torch.full_like(gts, -1)
+            local[g] = torch.arange(len(g), device=self.device)
+            pos = torch.nonzero(local[gt_idx] >= 0).view(-1)
+
+            q = torch.arange(int(sizes[k]), device=self.device)
+            valid = q < n_pixels[g, None]  # (n, q)
+            w = nx[g, None].clamp(1)
+            pixels = ((y1[g, None] + torch.div(q, w, rounding_mode='floor')) * mask_w + x1[g, None] + q % w) * valid
+            coef = pred_masks.new_zeros(len(g), int(counts[g].max()), nm)
+            coef[local[gt_idx[pos]], slot[pos]] = pred_masks[b[pos], a[pos]]
+            pred_mask = coef @ proto[gt_b[g, None], pixels].transpose(1, 2)  # (n, anchors, 32) @ (n, 32, q)
+            gt_mask = masks.flatten(1)[rows[g, None], pixels]
+            gt_mask = (gt_mask == gt_j[g, None] + 1).float() if self.overlap else gt_mask
+            bce = F.binary_cross_entropy_with_logits(pred_mask, gt_mask[:, None].expand_as(pred_mask), reduction="none")
+            loss[pos] = (bce * valid[:, None]).sum(2)[local[gt_idx[pos]], slot[pos]]
+
+        loss = loss / (mask_h * mask_w) / marea[gt_idx]
+        return (loss / fg_mask.sum(1)[b]).sum()
+
+
+@hydra_main
 def train(cfg):
     cfg.model = cfg.model or "yolov8n-seg.yaml"
     cfg.data = cfg.data or "coco128-seg.yaml"  # or yolo.ClassificationDataset("mnist")
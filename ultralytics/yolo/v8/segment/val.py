@@ -4,14 +4,14 @@ import os
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
 
-import hydra
 import numpy as np
 import torch
 import torch.nn.functional as F
 
-from ultralytics.yolo.utils import DEFAULT_CONFIG, NUM_THREADS, ops
+from ultralytics.yolo.configs import hydra_main
+from ultralytics.yolo.utils import NUM_THREADS, ops
 from ultralytics.yolo.utils.checks import check_requirements
-from ultralytics.yolo.utils.metrics import ConfusionMatrix, SegmentMetrics, box_iou, mask_iou
+from ultralytics.yolo.utils.metrics import APHistogram, ConfusionMatrix, SegmentMetrics, box_iou, cropped_mask_iou
 from ultralytics.yolo.utils.plotting import output_to_target, plot_images
 
 from ..detect import DetectionValidator
@@ -42,7 +42,7 @@ class SegmentationValidator(DetectionValidator):
         self.plot_masks = []
         self.seen = 0
         self.jdict = []
-        self.stats = []
+        self.stats = APHistogram(self.nc, self.niou, k=2, device=self.device)  # masks, boxes
         if self.args.save_json:
             self.process = ops.process_mask_upsample  # more accurate
         else:
@@ -77,8 +77,8 @@ class SegmentationValidator(DetectionValidator):
 
             if npr == 0:
                 if nl:
-                    self.stats.append((correct_masks, correct_bboxes, *torch.zeros(
-                        (2, 0), device=self.device), cls.squeeze(-1)))
+                    self.stats.update((correct_masks, correct_bboxes), *torch.zeros((2, 0), device=self.device),
+                                      cls.squeeze(-1))
                     if self.args.plots:
                         self.confusion_matrix.process_batch(detections=None, labels=cls.squeeze(-1))
                 continue
@@ -111,8 +111,8 @@ class SegmentationValidator(DetectionValidator):
                                                     masks=True)
                 if self.args.plots:
                     self.confusion_matrix.process_batch(predn, labelsn)
-            self.stats.append((correct_masks, correct_bboxes, pred[:, 4], pred[:,
-                                                                               5], cls.squeeze(-1)))  # conf, pcls, tcls
+            self.stats.update((correct_masks, correct_bboxes), pred[:, 4], pred[:, 5],
+                              cls.squeeze(-1))  # conf, pcls, tcls
 
             pred_masks = torch.as_tensor(pred_masks, dtype=torch.uint8)
             if self.args.plots and self.batch_i < 3:
@@ -141,29 +141,15 @@ class SegmentationValidator(DetectionValidator):
             if overlap:
                 nl = len(labels)
                 index = torch.arange(nl, device=gt_masks.device).view(nl, 1, 1) + 1
-                gt_masks = gt_masks.repeat(nl, 1, 1)  # shape(1,640,640) -> (n,640,640)
-                gt_masks = torch.where(gt_masks == index, 1.0, 0.0)
+                gt_masks = torch.where(gt_masks == index, 1.0, 0.0)  # shape(1,640,640) -> (n,640,640)
             if gt_masks.shape[1:] != pred_masks.shape[1:]:
                 gt_masks = F.interpolate(gt_masks[None], pred_masks.shape[1:], mode="bilinear", align_corners=False)[0]
                 gt_masks = gt_masks.gt_(0.5)
-            iou = mask_iou(gt_masks.view(gt_masks.shape[0], -1), pred_masks.view(pred_masks.shape[0], -1))
+            iou = cropped_mask_iou(gt_masks, pred_masks)
         else:  # boxes
             iou = box_iou(labels[:, 1:], detections[:, :4])
 
-        correct = np.zeros((detections.shape[0], self.iouv.shape[0])).astype(bool)
-        correct_class = labels[:, 0:1] == detections[:, 5]
-        for i in range(len(self.iouv)):
-            x = torch.where((iou >= self.iouv[i]) & correct_class)  # IoU > threshold and classes match
-            if x[0].shape[0]:
-                matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]),
-                                    1).cpu().numpy()  # [label, detect, iou]
-                if x[0].shape[0] > 1:
-                    matches = matches[matches[:, 2].argsort()[::-1]]
-                    matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                    # matches = matches[matches[:, 2].argsort()[::-1]]
-                    matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-                correct[matches[:, 1].astype(int), i] = True
-        return torch.tensor(correct, dtype=torch.bool, device=detections.device)
+        return self.match_predictions(iou, labels[:, 0:1] == detections[:, 5])
 
     def plot_val_samples(self, batch, ni):
         plot_images(batch["img"],
@@ -237,7 +223,7 @@ class SegmentationValidator(DetectionValidator):
         return stats
 
 
-@hydra.main(version_base=None, config_path=str(DEFAULT_CONFIG.parent), config_name=DEFAULT_CONFIG.name)
+@hydra_main
 def val(cfg):
     cfg.data = cfg.data or "coco128-seg.yaml"
     validator = SegmentationValidator(args=cfg)